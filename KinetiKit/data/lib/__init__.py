@@ -1,2 +1,8 @@
 #imported files
-from ._lib import *
\ No newline at end of file
+from ._lib import *
+from ._cache import *
+from ._sdt import *
+from ._tttr import *
+from ._dataset import *
+from ._bulk import *
+from ._watch import *
\ No newline at end of file
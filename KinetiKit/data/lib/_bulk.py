@@ -0,0 +1,177 @@
+"""
+Bulk loading of directories of data files into a DataSet, parsing files
+concurrently.
+"""
+
+import os
+import re
+import glob
+import time
+import warnings
+import concurrent.futures
+
+from KinetiKit.units import units
+from ._lib import data_from_SPCM
+from ._dataset import DataSet
+
+__all__ = ['load_directory', 'parse_filename']
+
+
+# one number (decimal point or comma) followed by a unit of `units`
+default_patterns = {
+    'pulse_power': r'(\d+(?:[.,]\d+)?)\s*([nuμm]?W)(?![A-Za-z])',
+    'wavelength': r'(\d+(?:[.,]\d+)?)\s*(nm)(?![A-Za-z])',
+    }
+
+# units are matched exactly first, so that e.g. 'MW' is not read as 'mW';
+# the lowercase table only serves units written in another case
+_units_exact = dict(units, mW=1e-3, W=1, MW=1e6)
+_units_lower = {key.lower(): val for key, val in units.items()}
+_units_lower['mw'] = 1e-3
+_units_lower['w'] = 1
+
+
+def parse_filename(text, patterns=default_patterns):
+    """
+    Extracts numeric metadata from a filename or title, in SI units.
+
+    Parameters
+    ----------
+    text : string
+        Filename or any other string, e.g. 'het_n=1_0.54uW_TRPL.asc'.
+    patterns : dictionary
+        Regular expressions keyed by metadata column. The first group of each
+        expression must match a number (a decimal comma is accepted); the
+        optional second group a unit of ``KinetiKit.units.units``, by which
+        the number is multiplied. Units are matched case-sensitively first,
+        then case-insensitively, so that e.g. '0,54uw' yields 0.54 uW while
+        'MW' stays distinct from 'mW'. Default extracts `pulse_power` and
+        `wavelength`.
+
+    Returns
+    -------
+    metadata : dictionary
+        Values of the columns whose pattern matched.
+    """
+    metadata = {}
+    for column, pattern in patterns.items():
+        match = re.search(pattern, text, flags=re.IGNORECASE)
+        if match is None:
+            continue
+        value = float(match.group(1).replace(',', '.'))
+        if match.lastindex and match.lastindex > 1:
+            unit = match.group(2)
+            value *= _units_exact.get(unit, _units_lower.get(unit.lower(), 1))
+        metadata[column] = value
+    return metadata
+
+
+def _load_file(filename, patterns, kwargs):
+    do = data_from_SPCM(filename, **kwargs)
+    if do.key is None:
+        do.key = os.path.splitext(os.path.basename(filename))[0]
+    found = parse_filename(os.path.basename(filename), patterns)
+    if len(found) < len(patterns) and 'Title' in do.header:
+        title = parse_filename(do.header['Title'], patterns)
+        title.update(found)
+        found = title
+    for column, value in found.items():
+        if getattr(do, column, None) is None:
+            setattr(do, column, value)
+    return do
+
+
+def load_directory(path, pattern='*.asc', t=None, dark=None,
+                   dark_method='average', patterns=default_patterns,
+                   workers=None, executor='thread', skip_errors=False,
+                   verbose=True, **kwargs):
+    """
+    Imports all data files of a directory (or matching a glob) into a
+    ``DataSet``, parsing the files concurrently.
+
+    The pulse power and wavelength of each trace are extracted from its
+    filename or, failing that, from the title stored in the SPCM header
+    (see ``parse_filename``), unless given explicitly in `kwargs`.
+
+    Parameters
+    ----------
+    path : string
+        Directory, or glob pattern such as 'data/*/TRPL_*.asc'.
+
+    Optional Parameters
+    -------------------
+    pattern : string
+        Glob pattern of the files inside `path` if `path` is a directory.
+        Default is '*.asc'.
+    t : 1-D array, dictionary of the type ``sim.time.linear()`` or None
+        Shared time axis of the dataset, see ``DataSet.from_objects``.
+    dark : float, array, data object or None
+        Dark counts subtracted from all traces, see ``DataSet.dark_subtract``.
+        Subtraction happens before interpolation onto `t`. Default is None.
+    dark_method : 'average' or 'elementwise'
+        Default is 'average'.
+    patterns : dictionary
+        Metadata patterns, see ``parse_filename``.
+    workers : integer or None
+        Number of threads or processes. Default is None, which lets
+        ``concurrent.futures`` decide.
+    executor : 'thread' or 'process'
+        Whether files are parsed in a thread pool or a process pool.
+        Default is 'thread'.
+    skip_errors : boolean
+        If True, files that cannot be read are skipped with a warning
+        instead of raising an error. Default is False.
+    verbose : boolean
+        Whether to print the loading progress and time. Default is True.
+    **kwargs
+        Passed to ``data_from_SPCM``, e.g. `skip_h`, `metadata`, `coll` or
+        `cache`, which stores the parsed files for later loads.
+
+    Returns
+    -------
+    dataset : DataSet
+        Traces sorted by filename.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, pattern)
+    filenames = sorted(glob.glob(path))
+    if len(filenames) == 0:
+        raise FileNotFoundError('No files match %s.' % path)
+
+    if executor == 'thread':
+        pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+    elif executor == 'process':
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    else:
+        raise ValueError('Executor must be \'thread\' or \'process\'.')
+
+    time_start = time.time()
+    objects = {}
+    every = max(len(filenames) // 10, 1)
+    with pool:
+        futures = {pool.submit(_load_file, filename, patterns, kwargs):
+                   filename for filename in filenames}
+        for i, future in enumerate(concurrent.futures.as_completed(futures)):
+            filename = futures[future]
+            try:
+                objects[filename] = future.result()
+            except Exception as error:
+                if not skip_errors:
+                    raise
+                warnings.warn('Skipped %s: %s' % (filename, error),
+                              UserWarning)
+            if verbose and ((i + 1) % every == 0 or i + 1 == len(filenames)):
+                print('Loaded %i/%i files' % (i + 1, len(filenames)))
+
+    objects = [objects[filename] for filename in filenames
+               if filename in objects]
+    if dark is not None:
+        for do in objects:
+            do.dark_subtract(dark, method=dark_method)
+    dataset = DataSet.from_objects(objects, t=t)
+
+    if verbose:
+        elapsed = time.time() - time_start
+        print('Loading %i files took %0.3f seconds (%0.1f files/s)'
+              % (len(objects), elapsed, len(objects) / max(elapsed, 1e-9)))
+    return dataset
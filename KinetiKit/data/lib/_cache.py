@@ -0,0 +1,144 @@
+"""
+Cache of parsed data files as binary .npz sidecars, so that text files are
+only parsed once. Arrays of a cached file are memory-mapped when loaded.
+"""
+
+import os
+import json
+import zlib
+import zipfile
+import threading
+import warnings
+
+import numpy as np
+
+__all__ = ['cache_path', 'clear_cache']
+
+# bump when the layout of the cached arrays changes
+_CACHE_VERSION = 1
+
+
+def cache_path(filename, cache_dir=None):
+    """
+    Returns the path of the cache sidecar of a data file.
+
+    Parameters
+    ----------
+    filename : string
+        The file path of interest.
+    cache_dir : string or None
+        Directory of the cache. Default is None, in which case the sidecar is
+        a hidden file next to the data file, e.g. 'data/.trace.asc.npz' for
+        'data/trace.asc'. Sidecars in a shared `cache_dir` are named after a
+        hash of the absolute path of the data file.
+    """
+    filename = os.path.abspath(filename)
+    basename = os.path.basename(filename)
+    if cache_dir is None:
+        return os.path.join(os.path.dirname(filename), '.%s.npz' % basename)
+    tag = '%08x' % zlib.crc32(filename.encode())
+    return os.path.join(cache_dir, '%s.%s.npz' % (basename, tag))
+
+
+def _signature(filename, options):
+    stat = os.stat(filename)
+    return json.dumps({'version': _CACHE_VERSION,
+                       'mtime': stat.st_mtime_ns,
+                       'size': stat.st_size,
+                       'options': options}, sort_keys=True)
+
+
+def _memmap_member(path, archive, name):
+    # arrays of an uncompressed .npz archive are contiguous in the file, so
+    # they can be mapped at the offset of their .npy data
+    info = archive.getinfo(name)
+    if info.compress_type != zipfile.ZIP_STORED:
+        return None
+    with open(path, 'rb') as file:
+        file.seek(info.header_offset)
+        local = file.read(30)
+        offset = info.header_offset + 30 \
+            + int.from_bytes(local[26:28], 'little') \
+            + int.from_bytes(local[28:30], 'little')
+        file.seek(offset)
+        version = np.lib.format.read_magic(file)
+        if version == (1, 0):
+            header = np.lib.format.read_array_header_1_0(file)
+        else:
+            header = np.lib.format.read_array_header_2_0(file)
+        shape, fortran, dtype = header
+        offset = file.tell()
+    if dtype.hasobject or 0 in shape:
+        return None
+    return np.memmap(path, dtype=dtype, mode='c', offset=offset, shape=shape,
+                     order='F' if fortran else 'C')
+
+
+def load_cache(filename, options, cache_dir=None):
+    """
+    Returns the cached arrays and metadata of a data file, or None if there
+    is no valid cache. A cache is invalid if the modification time or size of
+    the data file, or the parse `options` (a JSON-serializable dictionary),
+    differ from those it was written with.
+
+    Returns
+    -------
+    arrays : dictionary
+        Memory-mapped (copy-on-write) arrays.
+    metadata : dictionary
+        Metadata stored with ``save_cache``.
+    """
+    path = cache_path(filename, cache_dir)
+    if not os.path.exists(path):
+        return None
+    try:
+        with zipfile.ZipFile(path) as archive, np.load(path) as stored:
+            names = [name[:-4] for name in archive.namelist()]
+            if str(stored['_signature']) != _signature(filename, options):
+                return None
+            metadata = json.loads(str(stored['_metadata']))
+            arrays = {}
+            for name in names:
+                if name.startswith('_'):
+                    continue
+                arrays[name] = _memmap_member(path, archive, name + '.npy')
+                if arrays[name] is None:
+                    arrays[name] = stored[name]
+    except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+        return None
+    return arrays, metadata
+
+
+def save_cache(filename, options, arrays, metadata, cache_dir=None):
+    """
+    Writes arrays and JSON-serializable metadata of a parsed data file to its
+    cache sidecar. The sidecar is written to a temporary file and renamed, so
+    that concurrent readers never see a partial cache. Failures (e.g. a
+    read-only directory) only raise a warning.
+    """
+    path = cache_path(filename, cache_dir)
+    temp = '%s.%i.%i.tmp' % (path, os.getpid(), threading.get_ident())
+    try:
+        if cache_dir is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+        with open(temp, 'wb') as file:
+            np.savez(file, _signature=_signature(filename, options),
+                     _metadata=json.dumps(metadata), **arrays)
+        os.replace(temp, path)
+    except OSError as error:
+        warnings.warn('Could not write cache for %s: %s' % (filename, error),
+                      UserWarning)
+        if os.path.exists(temp):
+            os.remove(temp)
+
+
+def clear_cache(filenames, cache_dir=None):
+    """
+    Deletes the cache sidecars of one or many data files, if they exist.
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    for filename in filenames:
+        path = cache_path(filename, cache_dir)
+        if os.path.exists(path):
+            os.remove(path)
@@ -0,0 +1,277 @@
+"""
+Collection of many time-resolved traces on a shared time axis, with batched
+versions of the preprocessing methods of the single-trace data objects.
+"""
+
+import copy
+
+import numpy as np
+from scipy import signal
+
+from KinetiKit.units import ns
+from KinetiKit import kit as kin_kit
+from ._lib import data_from_SPCM, rebin
+
+__all__ = ['DataSet']
+
+
+class DataSet(object):
+    """
+    Set of traces stored as one 2-D array (traces x time points) on a shared
+    time axis, with per-trace metadata stored column-wise.
+
+    The preprocessing methods mirror those of ``data_from_SPCM``
+    (``dark_subtract``, ``interp``, ``rebin``, ``smooth``, ``remove_zeros``,
+    ``extract_peak``, ``extract_average``) but act on all traces at once.
+    A DataSet can be passed directly as `data_arrays` to
+    ``fit.lib.simulate_and_compare`` and ``fit.lib.sac_args``.
+
+    Parameters
+    ----------
+    x : 1-D array
+        Shared time axis, in seconds.
+    y : 2-D array
+        Traces, one per row, with the length of `x`.
+
+    Optional Parameters
+    -------------------
+    **metadata : arrays or lists
+        Per-trace metadata columns with one entry per trace, e.g. `key`,
+        `pulse_power`, `cw_power`, `wavelength`, `coll` or `filename`.
+        Columns that are not given are filled with None.
+    """
+
+    columns = ['key', 'pulse_power', 'cw_power', 'wavelength', 'coll',
+               'filename']
+
+    def __init__(self, x, y, **metadata):
+        self.x = np.asarray(x, dtype=float)
+        self.y = kin_kit.make_2d(np.array(y, dtype=float))
+        if self.y.shape[-1] != len(self.x):
+            raise ValueError('Traces must have the length of the time axis.')
+
+        self.metadata = {}
+        for column in self.columns:
+            self.metadata[column] = np.full(len(self.y), None, dtype=object)
+        for column, values in metadata.items():
+            values = np.asarray(values) if values is not None else None
+            if values is None or values.ndim == 0:
+                values = np.full(len(self.y), values, dtype=object)
+            if len(values) != len(self.y):
+                raise ValueError('Metadata column %s must have one entry per '
+                                 'trace.' % column)
+            self.metadata[column] = values
+
+        self.time_unit = 's'
+        self.dark_subtracted = False
+        self.variance = None
+
+    @classmethod
+    def from_objects(cls, data_objects, t=None):
+        """
+        Returns a DataSet from a list of data objects (e.g. ``data_from_SPCM``
+        instances), taking their metadata attributes as columns.
+
+        Parameters
+        ----------
+        data_objects : list
+            Data objects with `x` and `y` attributes.
+        t : 1-D array, dictionary of the type ``sim.time.linear()`` or None
+            Shared time axis. Traces that are not already on this axis are
+            interpolated onto it. Default is None, in which case the time axis
+            of the first object is used.
+        """
+        if isinstance(t, dict):
+            t = t['array'][::t['subsample']]
+        if t is None:
+            t = data_objects[0].x
+        y = np.empty((len(data_objects), len(t)))
+        for i, do in enumerate(data_objects):
+            if len(do.x) == len(t) and np.array_equal(do.x, t):
+                y[i] = do.y
+            else:
+                y[i] = np.interp(t, do.x, do.y)
+
+        metadata = {column: [getattr(do, column, None) for do in data_objects]
+                    for column in cls.columns}
+        dataset = cls(t, y, **metadata)
+        dataset.dark_subtracted = all(getattr(do, 'dark_subtracted', False)
+                                      for do in data_objects)
+        return dataset
+
+    @classmethod
+    def from_files(cls, filenames, t=None, keys=None, **kwargs):
+        """
+        Returns a DataSet by importing each file with ``data_from_SPCM``.
+        Keyword arguments are passed to ``data_from_SPCM``; `t` is passed to
+        ``from_objects``.
+        """
+        if keys is None:
+            keys = [None] * len(filenames)
+        objects = [data_from_SPCM(filename, key=key, **kwargs)
+                   for filename, key in zip(filenames, keys)]
+        return cls.from_objects(objects, t=t)
+
+    def __len__(self):
+        return len(self.y)
+
+    def __getitem__(self, idx):
+        """
+        Returns a new DataSet with the selected traces. `idx` may be an
+        integer, a slice, a list of integers or a boolean mask.
+        """
+        if isinstance(idx, (int, np.integer)):
+            idx = [idx]
+        selected = copy.copy(self)
+        selected.y = self.y[idx]
+        if self.variance is not None:
+            selected.variance = self.variance[idx]
+        selected.metadata = {column: values[idx]
+                             for column, values in self.metadata.items()}
+        return selected
+
+    def __getattr__(self, name):
+        # metadata columns are accessible as attributes, e.g. dataset.key
+        metadata = self.__dict__.get('metadata', {})
+        if name in metadata:
+            return metadata[name]
+        raise AttributeError(name)
+
+    def select(self, **criteria):
+        """
+        Returns a new DataSet with the traces whose metadata equal the given
+        values, e.g. ``dataset.select(wavelength=400*nm)``.
+        """
+        mask = np.ones(len(self), dtype=bool)
+        for column, value in criteria.items():
+            mask &= self.metadata[column] == value
+        return self[mask]
+
+    def sorted_by(self, column):
+        """
+        Returns a new DataSet with the traces sorted by a metadata column.
+        """
+        return self[list(np.argsort(self.metadata[column], kind='stable'))]
+
+    def dark_subtract(self, dark_counts, method='average'):
+        """
+        Subtracts dark counts from all traces. See
+        ``data_from_SPCM.dark_subtract``.
+
+        Parameters
+        ----------
+        dark_counts : float, array, data object or DataSet
+            A 1-D array (or data object) is subtracted from every trace; a
+            2-D array or DataSet with one row per trace is subtracted row by
+            row.
+        method : 'average' or 'elementwise', optional
+            Whether the average of the dark counts of each trace, or the dark
+            counts point by point, are subtracted.
+        """
+        if self.dark_subtracted:
+            print('Dark subtraction has already been performed')
+            return
+
+        if isinstance(dark_counts, (DataSet, data_from_SPCM)):
+            dark_counts = dark_counts.y
+        dark_counts = np.asarray(dark_counts, dtype=float)
+        if dark_counts.ndim > 0 and method == 'average':
+            dark_counts = np.average(dark_counts, axis=-1)[..., np.newaxis]
+        elif dark_counts.ndim == 2 and len(dark_counts) == 1:
+            dark_counts = dark_counts[0]
+
+        self.y = self.y - dark_counts
+        self.dark_subtracted = True
+
+    def smooth(self, window_length=17, polyorder=2, mode='nearest'):
+        """
+        Smooths all traces with the ``scipy.signal.savgol_filter`` function.
+        """
+        self.y = signal.savgol_filter(self.y, window_length=window_length,
+                                      polyorder=polyorder, mode=mode,
+                                      axis=-1)
+
+    def interp(self, t):
+        """
+        Interpolates all traces along a new time axis, with the same result as
+        ``numpy.interp`` applied to each trace. The interpolation indices and
+        weights are computed once for all traces.
+
+        Parameters
+        ----------
+        t : 1-D array or dictionary of the type ``sim.time.linear()``
+            Defines the time axis along which to interpolate.
+        """
+        if isinstance(t, dict):
+            t = t['array'][::t['subsample']]
+        t = np.asarray(t, dtype=float)
+        x = self.x
+
+        hi = np.clip(np.searchsorted(x, t, side='right'), 1, len(x) - 1)
+        lo = hi - 1
+        weight = np.clip((t - x[lo]) / (x[hi] - x[lo]), 0, 1)
+        self.y = self.y[:, lo] * (1 - weight) + self.y[:, hi] * weight
+        self.x = t
+
+    def rebin(self, factor=None, edges=None):
+        """
+        Rebins all traces by summing the counts of adjacent bins, preserving
+        their integrals, and stores the propagated variance of each new bin
+        in the `variance` attribute. See ``rebin``.
+
+        Unless a `variance` is already set, Poisson statistics are assumed
+        for traces in counts per second of the collection time `coll` (traces
+        without `coll` are taken as counts).
+
+        Parameters
+        ----------
+        factor : integer
+            Number of adjacent bins summed into each new bin.
+        edges : 1-D array or dictionary of the type ``sim.time.linear()``
+            Edges of the new bins, in seconds. Ignored if `factor` is given.
+        """
+        variance = self.variance
+        if variance is None:
+            coll = np.array([1 if c is None else c for c in self.coll],
+                            dtype=float)
+            variance = np.abs(self.y) / coll[:, np.newaxis]
+        self.x, self.y, self.variance = rebin(self.x, self.y, factor=factor,
+                                              edges=edges, variance=variance)
+
+    def remove_zeros(self):
+        """
+        Replaces any negative or zero elements of each trace with the minimum
+        positive value of that trace.
+        """
+        positive = self.y > 0
+        ymin = np.min(np.where(positive, self.y, np.inf), axis=-1,
+                      keepdims=True)
+        self.y = np.where(positive, self.y, ymin)
+
+    def extract_peak(self, avgnum=5):
+        """
+        Returns the peak value of each trace, averaging its `avgnum` largest
+        values to control for noise.
+        """
+        top = -np.partition(-self.y, avgnum - 1, axis=-1)[:, :avgnum]
+        return np.average(top, axis=-1)
+
+    def extract_average(self, t_start=12*ns, t_end=12.5*ns):
+        """
+        Returns the average value of each trace between two times, in seconds.
+        """
+        i_start, t_start = kin_kit.find_nearest(self.x, t_start)
+        i_end, t_end = kin_kit.find_nearest(self.x, t_end)
+        return np.average(self.y[:, i_start:i_end], axis=-1)
+
+    def normalized(self):
+        """
+        Returns the traces normalized by their maximum value.
+        """
+        return kin_kit.normalized(self.y, alert=False)
+
+    def copy(self):
+        """
+        Returns an independent copy of the dataset.
+        """
+        return copy.deepcopy(self)
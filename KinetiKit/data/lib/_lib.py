@@ -9,11 +9,12 @@ from scipy import signal
 from KinetiKit import sim
 from KinetiKit.units import units, ns
 from KinetiKit import kit as kin_kit
+from ._cache import load_cache, save_cache
 import warnings
 import numpy
 import copy
 
-__all__ = ['data_from_SPCM']
+__all__ = ['data_from_SPCM', 'read_spcm', 'rebin']
 
 
 class data_from_SPCM(object):
@@ -45,9 +46,12 @@ class data_from_SPCM(object):
         divided by the collection time to yield counts-per-second units. 
         Default is `True`.
     metadata : boolean
-        If `True` the collection time is obtained from inside the .asc file.
-        For this data object,`metadata=True` only works for Becker & Hickl SPCM
-        data files. Default is  `False`.
+        If `True` the collection time is obtained from inside the .asc file,
+        and the data block is located by its `*BLOCK` marker, so that
+        `skip_h` and `skip_f` are ignored. For this data object,
+        `metadata=True` only works for Becker & Hickl SPCM data files. The
+        parsed header is available in any case as the `header` and `sys_par`
+        attributes (see ``read_spcm``). Default is  `False`.
     pulse_power : float
         pulse power information (in any desired units) for the data. Default is
         `None`.
@@ -60,11 +64,20 @@ class data_from_SPCM(object):
     delimiter : string
         Delimiter in the text file. Default is `','`.
     unpack : boolean
-        See `unpack` argument of ``numpy.genfromtxt``.
+        Unused; kept for compatibility. The file is always read as x and y 
+        columns.
     skip_h : integer
-        See `skip_header` argument of ``numpy.genfromtxt``.
+        Number of lines skipped at the beginning of the file, as the 
+        `skip_header` argument of ``numpy.genfromtxt``.
     skip_f : integer
-        See `skip_footer` argument of ``numpy.genfromtxt``.
+        Number of lines skipped at the end of the file, as the `skip_footer`
+        argument of ``numpy.genfromtxt``.
+    autocrop : boolean
+        If `True` and `metadata` is `True`, the points outside the TAC limits
+        stored in the file are discarded. Default is `False`.
+    cache, cache_dir : boolean, string or None
+        Whether the parsed file is cached in a binary sidecar, and where. See
+        ``read_spcm``. Default is `False`.
         
     """
     
@@ -72,7 +85,7 @@ class data_from_SPCM(object):
                  metadata=False, weigh_by_coll=True, 
                  pulse_power=None, cw_power=None, wavelength=None,
                  delimiter=',', unpack=True, skip_h=10, skip_f=1,
-                 autocrop=False):
+                 autocrop=False, cache=False, cache_dir=None):
         
         self.filename = filename
         self.time_unit = time_unit
@@ -84,26 +97,31 @@ class data_from_SPCM(object):
         self.dark_subtracted=False
         self.weighed_by_coll = False
         
+        spcm = read_spcm(filename, delimiter=delimiter, 
+                         skip_h=None if metadata else skip_h,
+                         skip_f=None if metadata else skip_f,
+                         cache=cache, cache_dir=cache_dir)
+        self.header = spcm['header']
+        self.sys_par = spcm['sys_par']
+        self.x, self.y = spcm['x'], spcm['y']
+        
         # If aquisition information was included in file, this part extracts
         # the aquisition time:
         if metadata:
-            skip_h = 210
-            skip_f = 1 
-            with open(self.filename) as file:
-                SYS_PAR = file.readlines()[10:169]
-            tac_ll = get_spcm_param(SYS_PAR[26])
-            tac_lh = get_spcm_param(SYS_PAR[27])
-            adc_res = get_spcm_param(SYS_PAR[30])
-            self.coll = get_spcm_param(SYS_PAR[35])
+            if 'SP_COL_T' not in self.sys_par:
+                raise ValueError('%s does not contain SPCM system parameters.'
+                                 %filename)
+            self.coll = self.sys_par['SP_COL_T']
             
             if autocrop:
-                skip_h += int(adc_res*(100-tac_lh)/100)
-                skip_f += int(adc_res*tac_ll/100)
+                adc_res = self.sys_par['SP_ADC_RE']
+                crop_h = int(adc_res*(100-self.sys_par['SP_TAC_LH'])/100)
+                crop_f = int(adc_res*self.sys_par['SP_TAC_LL']/100)
+                self.x = self.x[crop_h:len(self.x)-crop_f]
+                self.y = self.y[crop_h:len(self.y)-crop_f]
             
         else:
             self.coll = coll
-                
-        self.x, self.y = np.genfromtxt(filename, delimiter=',', unpack=unpack, skip_header=skip_h, skip_footer=skip_f) 
         
         if weigh_by_coll:
             self.y /= self.coll
@@ -138,20 +156,22 @@ class data_from_SPCM(object):
         
         if not self.dark_subtracted:
             
-            if isinstance(dark_counts, numpy.float) or isinstance(dark_counts, numpy.int):
-                self.y -= dark_counts
+            # subtraction creates a new array, so that read-only (e.g. 
+            # memory-mapped) y-data are never modified
+            if isinstance(dark_counts, (float, int, np.number)):
+                self.y = self.y - dark_counts
             elif isinstance(dark_counts, numpy.ndarray):
                 if method == 'elementwise': 
-                    self.y -= dark_counts
+                    self.y = self.y - dark_counts
                 elif method == 'average':
-                    self.y -= np.average(dark_counts)
+                    self.y = self.y - np.average(dark_counts)
             elif isinstance(dark_counts, data_from_SPCM):
                 if self.weighed_by_coll==False or dark_counts.weighed_by_coll==False:
                     warnings.warn('Dark subtraction was performed. However, we recommend that you convert Counts to Counts Per Second by weighing data objects by the collection time.', UserWarning)
                 if method == 'elementwise':
-                    self.y -= dark_counts.y
+                    self.y = self.y - dark_counts.y
                 elif method == 'average':
-                    self.y -= np.average(dark_counts.y)
+                    self.y = self.y - np.average(dark_counts.y)
             else:
                 return
             self.dark_subtracted=True
@@ -192,6 +212,29 @@ class data_from_SPCM(object):
             self.x = time_array
         
     
+    def rebin(self, factor=None, edges=None):
+        """
+        Rebins the y-values of the object by summing the counts of adjacent 
+        bins, preserving the integral of the trace (unlike ``interp``). The 
+        Poisson variance of each new bin is stored in the `variance` 
+        attribute. See ``rebin``.
+        
+        Parameters
+        ----------
+        factor : integer
+            Number of adjacent bins summed into each new bin.
+        edges : 1-D array or dictionary of the type ``sim.time.linear()``
+            Edges of the new bins, in seconds. Ignored if `factor` is given.
+
+        """
+        variance = getattr(self, 'variance', None)
+        if variance is None:
+            # Poisson variance of counts, in the units of y
+            coll = self.coll if self.weighed_by_coll else 1
+            variance = np.abs(self.y) / coll
+        self.x, self.y, self.variance = rebin(self.x, self.y, factor=factor,
+                                              edges=edges, variance=variance)
+    
     def remove_zeros(self):
         """
         Replaces any negative or zero elements of the object's y-data with the 
@@ -237,12 +280,148 @@ class data_from_SPCM(object):
         return copy.deepcopy(self)
         
         
+def read_spcm(filename, delimiter=',', skip_h=None, skip_f=None, cache=False,
+              cache_dir=None):
+    """
+    Reads a Becker & Hickl SPCM .asc file (or a generic two-column TRPL text
+    file) in a single pass.
+    
+    The header is parsed into dictionaries, and the numeric block is loaded 
+    in bulk. By default the numeric block is located by the `*BLOCK` and 
+    `*END` section markers; if `skip_h` or `skip_f` are given, they instead 
+    set the number of lines skipped at the beginning and end of the file, as
+    in ``numpy.genfromtxt``.
+    
+    Parameters
+    ----------
+    filename : string
+        The file path of interest.
+    delimiter : string
+        Delimiter between the columns of the numeric block. Default is `','`.
+    skip_h, skip_f : integer or None
+        See above. Default is None.
+    cache : boolean
+        If `True`, the parsed file is stored in a binary sidecar (see 
+        ``cache_path``) and later reads memory-map the sidecar instead of 
+        parsing the text. The sidecar is rewritten when the modification 
+        time or size of the file, or the arguments above, change. Default is
+        `False`.
+    cache_dir : string or None
+        Directory of the sidecars. Default is None, i.e. next to the file.
+        
+    Returns
+    -------
+    spcm : dictionary
+        'header' : dictionary of the `Name : value` lines of the header, e.g.
+        'Title' and 'Date'; 'sys_par' : dictionary of the `[NAME,type,value]`
+        parameters of the header (e.g. 'SP_COL_T', the collection time), with
+        values converted by type; 'x', 'y' : float arrays of the first and 
+        second column of the numeric block. Cached arrays are copy-on-write
+        memory maps, so modifying them never changes the sidecar.
+    """
+    if cache:
+        options = {'delimiter': delimiter, 'skip_h': skip_h, 'skip_f': skip_f}
+        cached = load_cache(filename, options, cache_dir)
+        if cached is not None:
+            arrays, metadata = cached
+            return {'header': metadata['header'],
+                    'sys_par': metadata['sys_par'],
+                    'x': arrays['x'],
+                    'y': arrays['y'],
+                    }
+        spcm = read_spcm(filename, delimiter=delimiter, skip_h=skip_h,
+                         skip_f=skip_f)
+        save_cache(filename, options, {'x': spcm['x'], 'y': spcm['y']},
+                   {'header': spcm['header'], 'sys_par': spcm['sys_par']},
+                   cache_dir)
+        return spcm
+    
+    with open(filename, errors='replace') as file:
+        lines = file.read().splitlines()
+    
+    header, sys_par, block_start = parse_spcm_header(lines)
+    if block_start == len(lines):
+        block_start = 0
+    block_end = len(lines)
+    for i in range(len(lines) - 1, block_start - 1, -1):
+        if lines[i].strip().startswith('*END'):
+            block_end = i
+            break
+    
+    start = block_start if skip_h is None else skip_h
+    stop = block_end if skip_f is None else len(lines) - skip_f
+    block = lines[start:stop]
+    
+    text = '\n'.join(block)
+    if delimiter is not None:
+        text = text.replace(delimiter, ' ')
+    try:
+        values = np.fromstring(text, sep=' ')
+    except ValueError:
+        # numpy 2 raises on text (e.g. comments) instead of stopping there
+        values = None
+    if values is None or values.size != 2 * len(block):
+        # irregular lines (e.g. comments or missing values): fall back to
+        # the slow parser
+        values = np.genfromtxt(block, delimiter=delimiter, usecols=(0, 1))
+    values = values.reshape(-1, 2)
+    
+    return {'header': header,
+            'sys_par': sys_par,
+            'x': values[:, 0].copy(),
+            'y': values[:, 1].copy(),
+            }
+        
+
+def parse_spcm_header(lines, stop_marker='*BLOCK'):
+    """
+    Parses the header lines of a Becker & Hickl file into dictionaries.
+    
+    Parameters
+    ----------
+    lines : list of strings
+        Lines of the file, or of a text section of an .sdt file.
+    stop_marker : string
+        Parsing stops at the first line starting with this marker. Default is
+        `'*BLOCK'`.
+    
+    Returns
+    -------
+    header : dictionary
+        Entries of the `Name : value` lines.
+    sys_par : dictionary
+        Entries of the `[NAME,type,value]` parameter lines, converted by type.
+    stop : integer
+        Index of the line following the stop marker, or the number of lines if
+        the marker was not found.
+    """
+    header = {}
+    sys_par = {}
+    for i, line in enumerate(lines):
+        stripped = line.strip()
+        if stripped.startswith(stop_marker):
+            return header, sys_par, i + 1
+        if stripped.startswith('#') and '[' in stripped:
+            try:
+                name, value = get_spcm_param(stripped, return_name=True)
+                sys_par[name] = value
+            except ValueError:
+                pass
+        elif ' :' in stripped:
+            name, sep, value = stripped.partition(':')
+            header[name.strip()] = value.strip()
+    return header, sys_par, len(lines)
+
 def get_spcm_param(line, return_name = False):
-    param_name, ds, value = line.split('[')[1].split(']')[0].split(',')
+    """
+    Returns the value (and optionally the name) of a SPCM header parameter
+    line of the form `#SP [SP_COL_T,F,900]`, converted according to its type.
+    """
+    param_name, ds, value = line.split('[', 1)[1].rsplit(']', 1)[0].split(',', 2)
     if ds == 'I': #integer type
         val = int(value)
     elif ds == 'B': # boolean type
-        val = value == 1
+        val = int(value) == 1
     elif ds == 'F': # float type
         val = float(value)
     else:
@@ -252,4 +431,75 @@ def get_spcm_param(line, return_name = False):
         return param_name, val
     else:
         return val
-    
\ No newline at end of file
+
+
+def rebin(x, y, factor=None, edges=None, variance=None):
+    """
+    Rebins histogram(s) by summing counts, so that the integral of each trace
+    is preserved, and propagates the variance of the counts.
+    
+    Each value of `x` is taken as the start of its bin, as in the time axis
+    of ``sim.time.linear``; the last bin has the width of the one before it.
+    With an integer `factor`, every `factor` adjacent bins are summed and
+    incomplete bins at the end are discarded. With arbitrary `edges`, counts
+    of old bins that straddle a new edge are split in proportion to their
+    overlap with each new bin, assuming a uniform distribution within the 
+    old bin.
+    
+    Parameters
+    ----------
+    x : 1-D array
+        Start of each bin, e.g. time in seconds.
+    y : array
+        Counts, with bins along the last axis. Leading axes (e.g. traces of a
+        dataset) are rebinned independently.
+    
+    Optional Parameters
+    -------------------
+    factor : integer
+        Number of adjacent bins summed into each new bin.
+    edges : 1-D array or dictionary of the type ``sim.time.linear()``
+        Edges of the new bins; for a time dictionary, the bins of its 
+        (subsampled) time axis over one period. Ignored if `factor` is given.
+    variance : array or None
+        Variance of `y`. Default is None, in which case Poisson statistics 
+        are assumed, i.e. the variance of each bin equals its counts.
+    
+    Returns
+    -------
+    x_new : 1-D array
+        Start of each new bin.
+    y_new : array
+        Summed counts.
+    variance_new : array
+        Variance of the summed counts.
+    """
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    if variance is None:
+        variance = np.abs(y)
+    variance = np.broadcast_to(np.asarray(variance, dtype=float), y.shape)
+    n = y.shape[-1]
+    
+    if factor is not None:
+        factor = int(factor)
+        if factor < 1 or factor > n:
+            raise ValueError('Rebinning factor must be between 1 and %i.' % n)
+        m = n // factor
+        shape = y.shape[:-1] + (m, factor)
+        return (x[:m * factor:factor],
+                y[..., :m * factor].reshape(shape).sum(axis=-1),
+                variance[..., :m * factor].reshape(shape).sum(axis=-1))
+    
+    if edges is None:
+        raise ValueError('Either factor or edges must be given.')
+    if isinstance(edges, dict):
+        edges = np.append(edges['array'][::edges['subsample']],
+                          edges['period'])
+    edges = np.asarray(edges, dtype=float)
+    
+    bounds = np.append(x, 2 * x[-1] - x[-2])
+    overlap = np.minimum(edges[1:, np.newaxis], bounds[np.newaxis, 1:]) \
+        - np.maximum(edges[:-1, np.newaxis], bounds[np.newaxis, :-1])
+    weights = np.clip(overlap, 0, None) / np.diff(bounds)
+    return (edges[:-1], y @ weights.T, variance @ (weights**2).T)
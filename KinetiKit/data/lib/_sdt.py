@@ -0,0 +1,277 @@
+"""
+Reader for Becker & Hickl .sdt binary files (SPCM software), which memory-maps
+the measurement blocks instead of requiring an export to .asc.
+"""
+
+import io
+import zipfile
+
+import numpy as np
+
+from ._lib import data_from_SPCM, parse_spcm_header
+
+__all__ = ['SDTFile', 'data_from_SDT']
+
+
+_FILE_HEADER = np.dtype([
+    ('revision', '<i2'),
+    ('info_offset', '<i4'),
+    ('info_length', '<i2'),
+    ('setup_offs', '<i4'),
+    ('setup_length', '<i2'),
+    ('data_block_offset', '<i4'),
+    ('no_of_data_blocks', '<i2'),
+    ('data_block_length', '<i4'),
+    ('meas_desc_block_offset', '<i4'),
+    ('no_of_meas_desc_blocks', '<i2'),
+    ('meas_desc_block_length', '<i2'),
+    ('header_valid', '<u2'),
+    ('reserved1', '<u4'),
+    ('reserved2', '<u2'),
+    ('chksum', '<u2'),
+    ])
+
+_BLOCK_HEADER = np.dtype([
+    ('block_no', '<i2'),
+    ('data_offs', '<i4'),
+    ('next_block_offs', '<i4'),
+    ('block_type', '<u2'),
+    ('meas_desc_block_no', '<i2'),
+    ('lblock_no', '<u4'),
+    ('block_length', '<u4'),
+    ])
+
+# leading fields of the measurement description block; later fields vary
+# between software versions and are not needed here
+_MEASURE_INFO = [
+    ('time', 'S9'), ('date', 'S11'), ('mod_ser_no', 'S16'),
+    ('meas_mode', '<i2'), ('cfd_ll', '<f4'), ('cfd_lh', '<f4'),
+    ('cfd_zc', '<f4'), ('cfd_hf', '<f4'), ('syn_zc', '<f4'),
+    ('syn_fd', '<i2'), ('syn_fq', '<f4'), ('syn_hf', '<f4'),
+    ('tac_r', '<f4'), ('tac_g', '<i2'), ('tac_of', '<f4'),
+    ('tac_ll', '<f4'), ('tac_lh', '<f4'), ('adc_re', '<i2'),
+    ('eal_de', '<i2'), ('ncx', '<i2'), ('ncy', '<i2'), ('page', '<i2'),
+    ('col_t', '<f4'), ('rep_t', '<f4'), ('stopt', '<i2'), ('overfl', 'u1'),
+    ('use_motor', '<i2'), ('steps', '<u2'), ('offset', '<f4'),
+    ('dither', '<i2'), ('incr', '<i2'), ('mem_bank', '<i2'),
+    ('mod_type', 'S16'), ('syn_th', '<f4'), ('dead_time_comp', '<i2'),
+    ('polarity_l', '<i2'), ('polarity_f', '<i2'), ('polarity_p', '<i2'),
+    ('linediv', '<i2'), ('accumulate', '<i2'), ('flbck_y', '<i4'),
+    ('flbck_x', '<i4'), ('bord_u', '<i4'), ('bord_l', '<i4'),
+    ('pix_time', '<f4'), ('pix_clk', '<i2'), ('trigger', '<i2'),
+    ('scan_x', '<i4'), ('scan_y', '<i4'), ('scan_rx', '<i4'),
+    ('scan_ry', '<i4'), ('fifo_typ', '<i2'), ('epx_div', '<i4'),
+    ('mod_type_code', '<i2'), ('mod_fpga_ver', '<i2'),
+    ('overflow_corr_factor', '<f4'), ('adc_zoom', '<i4'), ('cycles', '<i4'),
+    ]
+
+_BLOCK_DTYPE = {0x000: '<u2', 0x100: '<u4', 0x200: '<f8'}
+_BLOCK_ZIPPED = 0x1000
+_IMG_BLOCK = 0x60
+
+
+class SDTFile(object):
+    """
+    Becker & Hickl .sdt file, with its measurement blocks exposed as
+    read-only NumPy views of a memory map of the file.
+
+    Blocks of single decays or multiple curves are 2-D arrays of shape
+    (curves, time bins); FLIM image blocks are 3-D arrays of shape (rows,
+    columns, time bins). No data are read from disk until they are accessed.
+    Compressed blocks cannot be mapped and are decompressed into memory.
+
+    Parameters
+    ----------
+    filename : string
+        The file path of interest
+
+    Attributes
+    ----------
+    header : dictionary
+        `Name : value` entries of the file information section.
+    sys_par : dictionary
+        `[NAME,type,value]` entries of the setup section (e.g. 'SP_COL_T'),
+        as in ``data_from_SPCM.sys_par``.
+    measurements : list of dictionaries
+        Measurement description of each block group, e.g. 'adc_re' (number
+        of time bins), 'tac_r' and 'tac_g' (TAC range and gain) and 'col_t'
+        (collection time).
+    blocks : list of arrays
+        Data of each measurement block.
+    block_info : list of dictionaries
+        Header of each measurement block.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._map = np.memmap(filename, dtype=np.uint8, mode='r')
+
+        fh = self._struct(_FILE_HEADER, 0)
+        self.revision = fh['revision']
+        self.header = parse_spcm_header(
+            self._text(fh['info_offset'], fh['info_length']), '*END')[0]
+        self.sys_par = parse_spcm_header(
+            self._text(fh['setup_offs'], fh['setup_length']), '*END')[1]
+
+        self.measurements = []
+        for i in range(fh['no_of_meas_desc_blocks']):
+            offset = fh['meas_desc_block_offset'] \
+                + i * fh['meas_desc_block_length']
+            self.measurements.append(
+                self._measure_info(offset, fh['meas_desc_block_length']))
+
+        self.blocks = []
+        self.block_info = []
+        offset = fh['data_block_offset']
+        for i in range(fh['no_of_data_blocks']):
+            bh = self._struct(_BLOCK_HEADER, offset)
+            self.block_info.append(bh)
+            self.blocks.append(self._block(bh))
+            offset = bh['next_block_offs']
+
+    def _struct(self, dtype, offset):
+        record = np.ndarray((), dtype, buffer=self._map, offset=int(offset))
+        return {name: record[name].item() for name in dtype.names}
+
+    def _text(self, offset, length):
+        raw = bytes(self._map[offset:offset + length])
+        return raw.decode('latin-1').split('\x00')[0].splitlines()
+
+    def _measure_info(self, offset, length):
+        fields = []
+        size = 0
+        for name, fmt in _MEASURE_INFO:
+            size += np.dtype(fmt).itemsize
+            if size > length:
+                break
+            fields.append((name, fmt))
+        info = self._struct(np.dtype(fields), offset)
+        for key, val in info.items():
+            if isinstance(val, bytes):
+                info[key] = val.split(b'\x00')[0].decode('latin-1').strip()
+        return info
+
+    def _block(self, bh):
+        dtype = np.dtype(_BLOCK_DTYPE[bh['block_type'] & 0xF00])
+        if bh['block_type'] & _BLOCK_ZIPPED:
+            raw = bytes(self._map[bh['data_offs']:
+                                  bh['data_offs'] + bh['block_length']])
+            with zipfile.ZipFile(io.BytesIO(raw)) as archive:
+                data = np.frombuffer(archive.read(archive.namelist()[0]),
+                                     dtype=dtype)
+        else:
+            data = np.ndarray(bh['block_length'] // dtype.itemsize, dtype,
+                              buffer=self._map, offset=bh['data_offs'])
+
+        info = self.measurements[bh['meas_desc_block_no']]
+        bins = info['adc_re']
+        curves = data.size // bins
+        nx, ny = info.get('scan_x', 0), info.get('scan_y', 0)
+        if (bh['block_type'] & 0xF0) == _IMG_BLOCK and nx * ny == curves \
+                and curves > 1:
+            return data[:curves * bins].reshape(ny, nx, bins)
+        return data[:curves * bins].reshape(curves, bins)
+
+    def times(self, block=0):
+        """
+        Returns the time axis of a block, in seconds.
+        """
+        info = self.measurements[self.block_info[block]['meas_desc_block_no']]
+        return np.arange(info['adc_re']) \
+            * (info['tac_r'] / (info['tac_g'] * info['adc_re']))
+
+    def collection_time(self, block=0):
+        """
+        Returns the collection time of a block, in seconds.
+        """
+        return self.measurements[
+            self.block_info[block]['meas_desc_block_no']]['col_t']
+
+    def decay(self, block=0, curve=0):
+        """
+        Returns one decay curve of a block as a read-only view. For image
+        blocks, `curve` is the flat pixel index.
+        """
+        data = self.blocks[block]
+        return data.reshape(-1, data.shape[-1])[curve]
+
+    def data(self, block=0, curve=0, **kwargs):
+        """
+        Returns a ``data_from_SDT`` object for one decay curve. Keyword
+        arguments are passed to ``data_from_SDT``.
+        """
+        return data_from_SDT(self, block=block, curve=curve, **kwargs)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __deepcopy__(self, memo):
+        # the file is read-only, so copies of data objects can share it
+        return self
+
+
+class data_from_SDT(data_from_SPCM):
+    """
+    Data object created from one decay curve of a Becker & Hickl .sdt file.
+    Has the methods of ``data_from_SPCM`` (``dark_subtract``, ``interp``,
+    ``smooth``, etc.).
+
+    Unless the counts are weighed by the collection time, `y` is a read-only
+    view of the memory-mapped file; the methods of the object replace it with
+    new arrays rather than modifying it.
+
+    Parameters
+    ----------
+    sdt : string or SDTFile
+        The file path of interest, or an already opened file.
+
+    Optional Parameters
+    -------------------
+    block : integer
+        Index of the measurement block. Default is 0.
+    curve : integer
+        Index of the curve in the block (flat pixel index for images). Default
+        is 0.
+    key : string
+        an identifier of choice for the object. Default is `None`.
+    coll : float or None
+        Collection time in seconds. Default is None, in which case the
+        collection time stored in the file is used.
+    weigh_by_coll : boolean
+        If `True`, the signal values (y) are divided by the collection time to
+        yield counts-per-second units. Default is `True`.
+    pulse_power, cw_power, wavelength : float
+        See ``data_from_SPCM``.
+    """
+
+    def __init__(self, sdt, block=0, curve=0, key=None, coll=None,
+                 weigh_by_coll=True, pulse_power=None, cw_power=None,
+                 wavelength=None):
+
+        if not isinstance(sdt, SDTFile):
+            sdt = SDTFile(sdt)
+        self.sdt = sdt
+        self.filename = sdt.filename
+        self.block = block
+        self.curve = curve
+        self.time_unit = 's'
+        self.key = key
+        self.weigh_by_coll = weigh_by_coll
+        self.skip_h = None; self.skip_f = None
+        self.header = sdt.header
+        self.sys_par = sdt.sys_par
+
+        self.dark_subtracted=False
+        self.weighed_by_coll = False
+
+        self.coll = sdt.collection_time(block) if coll is None else coll
+        self.x = sdt.times(block)
+        self.y = sdt.decay(block, curve)
+
+        if weigh_by_coll:
+            self.y = self.y / self.coll
+            self.weighed_by_coll =True
+
+        self.pulse_power = pulse_power
+        self.cw_power = cw_power
+        self.wavelength = wavelength
@@ -0,0 +1,186 @@
+"""
+Streaming reader for time-tagged (TTTR) photon streams of Becker & Hickl
+SPC-130/140/150/830 modules in FIFO mode (.spc files), which histograms the
+photon micro-times into TRPL traces with bounded memory.
+"""
+
+import numpy as np
+
+from ._lib import data_from_SPCM
+
+__all__ = ['read_spc_chunks', 'data_from_TTTR']
+
+
+_MT_MASK = 0xFFF            # macro time, bits 0-11
+_ROUT_SHIFT = 12            # routing channel, bits 12-15
+_ADC_SHIFT = 16             # ADC value (micro time), bits 16-27
+_MARK = 1 << 28
+_GAP = 1 << 29
+_MTOV = 1 << 30             # macro time overflow
+_INVALID = 1 << 31
+_OVF_COUNT = 0x0FFFFFFF     # overflow count of invalid + MTOV records
+
+
+def read_spc_chunks(filename, chunk_size=2**20, macro_clock=None,
+                    invert=True):
+    """
+    Iterates over the photons of a Becker & Hickl FIFO (.spc) file in chunks
+    of a fixed number of records, reading the file through a memory map so
+    that only one chunk is decoded in memory at a time.
+
+    Parameters
+    ----------
+    filename : string
+        The file path of interest.
+
+    Optional Parameters
+    -------------------
+    chunk_size : integer
+        Number of 4-byte records per chunk. Default is 2**20 (4 MB).
+    macro_clock : float or None
+        Macro-time clock period in seconds. Default is None, in which case it
+        is read from the first record of the file.
+    invert : boolean
+        Whether the ADC value is inverted (``4095 - ADC``) so that micro times
+        increase with the delay after the laser pulse, as in the reversed
+        start-stop mode of the SPC modules. Default is True.
+
+    Yields
+    ------
+    chunk : dictionary
+        'macro' : macro times of the photons, in seconds; 'micro' : micro-time
+        ADC channels (0-4095); 'rout' : routing channels; 'gap' : whether
+        data were lost before each photon.
+    """
+    records = np.memmap(filename, dtype='<u4', mode='r')
+    header = int(records[0])
+    if macro_clock is None:
+        macro_clock = (header & 0xFFFFFF) * 0.1e-9
+
+    overflows = 0
+    for start in range(1, len(records), chunk_size):
+        words = np.array(records[start:start + chunk_size], dtype=np.uint32)
+
+        invalid = (words & _INVALID) != 0
+        mtov = (words & _MTOV) != 0
+        counter = invalid & mtov
+        # overflows before each record, carried across chunks
+        increments = np.where(counter, words & _OVF_COUNT,
+                              mtov).astype(np.int64)
+        cumulative = overflows + np.cumsum(increments)
+        overflows = cumulative[-1]
+
+        photons = ~invalid & ((words & _MARK) == 0)
+        words = words[photons]
+        macro = ((words & _MT_MASK) + (_MT_MASK + 1)
+                 * cumulative[photons]) * macro_clock
+        micro = ((words >> _ADC_SHIFT) & 0xFFF).astype(np.intp)
+        if invert:
+            micro = 4095 - micro
+
+        yield {'macro': macro,
+               'micro': micro,
+               'rout': ((words >> _ROUT_SHIFT) & 0xF).astype(np.intp),
+               'gap': (words & _GAP) != 0,
+               }
+
+
+class data_from_TTTR(data_from_SPCM):
+    """
+    Data object created by histogramming the photon micro times of a Becker &
+    Hickl FIFO (.spc) file. Has the methods of ``data_from_SPCM``
+    (``dark_subtract``, ``interp``, ``rebin``, ``smooth``, etc.).
+
+    The file is streamed in chunks (see ``read_spc_chunks``) and the
+    histogram is accumulated chunk by chunk, so files much larger than the
+    available memory can be read. Photons can be gated by macro time and
+    routing channel; the collection time is the duration of the gate.
+
+    Parameters
+    ----------
+    filename : string
+        The file path of interest.
+    micro_resolution : float
+        Width of one micro-time ADC channel in seconds, i.e. the TAC range
+        divided by the TAC gain and by 4096.
+
+    Optional Parameters
+    -------------------
+    key : string
+        an identifier of choice for the object. Default is `None`.
+    shift : integer
+        The micro times are binned into ``4096 >> shift`` bins, as the ADC
+        resolution setting of the SPCM software. Default is 0.
+    macro_range : tuple of floats or None
+        (start, stop) macro times in seconds between which photons are
+        histogrammed. Either may be None. Default is None, i.e. all photons.
+    channels : list of integers or None
+        Routing channels that are histogrammed. Default is None, i.e. all.
+    chunk_size : integer
+        Number of records decoded at a time. Default is 2**20.
+    macro_clock : float or None
+        See ``read_spc_chunks``.
+    invert : boolean
+        See ``read_spc_chunks``. Default is True.
+    weigh_by_coll : boolean
+        If `True`, the counts are divided by the collection time to yield
+        counts-per-second units. Default is `True`.
+    pulse_power, cw_power, wavelength : float
+        See ``data_from_SPCM``.
+    """
+
+    def __init__(self, filename, micro_resolution, key=None, shift=0,
+                 macro_range=None, channels=None, chunk_size=2**20,
+                 macro_clock=None, invert=True, weigh_by_coll=True,
+                 pulse_power=None, cw_power=None, wavelength=None):
+
+        self.filename = filename
+        self.time_unit = 's'
+        self.key = key
+        self.weigh_by_coll = weigh_by_coll
+        self.skip_h = None; self.skip_f = None
+        self.header = {}
+        self.sys_par = {}
+
+        self.dark_subtracted=False
+        self.weighed_by_coll = False
+
+        start, stop = macro_range if macro_range is not None else (None, None)
+        bins = 4096 >> shift
+        counts = np.zeros(bins, dtype=np.int64)
+        first = last = None
+        for chunk in read_spc_chunks(filename, chunk_size=chunk_size,
+                                     macro_clock=macro_clock, invert=invert):
+            macro = chunk['macro']
+            if len(macro) == 0:
+                continue
+            if first is None:
+                first = macro[0]
+            last = macro[-1] if stop is None else min(macro[-1], stop)
+            keep = np.ones(len(macro), dtype=bool)
+            if start is not None:
+                keep &= macro >= start
+            if stop is not None:
+                keep &= macro < stop
+            if channels is not None:
+                keep &= np.isin(chunk['rout'], channels)
+            counts += np.bincount(chunk['micro'][keep] >> shift,
+                                  minlength=bins)
+            # macro times increase monotonically along the file
+            if stop is not None and macro[-1] >= stop:
+                break
+
+        if first is None:
+            first = last = 0.
+        self.counts = counts
+        self.coll = max(last - (first if start is None else start), 0)
+        self.x = np.arange(bins) * micro_resolution * 2**shift
+        self.y = counts.astype(float)
+
+        if weigh_by_coll and self.coll > 0:
+            self.y /= self.coll
+            self.weighed_by_coll =True
+
+        self.pulse_power = pulse_power
+        self.cw_power = cw_power
+        self.wavelength = wavelength
@@ -0,0 +1,123 @@
+"""
+Polling watcher that reports data files appearing in a directory, e.g. the
+output folder of an instrument during a measurement campaign.
+"""
+
+import os
+import glob
+import time
+import threading
+
+__all__ = ['FolderWatcher']
+
+
+class FolderWatcher(object):
+    """
+    Watches a directory in a background thread and calls `callback` once for
+    every new file matching `pattern`, after the file has stopped changing.
+
+    The directory is polled (rather than relying on operating-system
+    notifications), so the watcher works on network drives and needs no
+    additional packages. A file counts as complete once its size and
+    modification time are unchanged for `settle` seconds.
+
+    Parameters
+    ----------
+    path : string
+        Directory to watch.
+    callback : function
+        Called as ``callback(filename)`` for each new file, in order of
+        modification time, from the watcher thread.
+
+    Optional Parameters
+    -------------------
+    pattern : string
+        Glob pattern of the files of interest. Default is '*.asc'.
+    interval : float
+        Polling interval in seconds. Default is 1.
+    settle : float
+        Time in seconds for which a file must be unchanged before it is
+        reported. Default is 1.
+    existing : boolean
+        Whether files already in the directory when the watcher is created are
+        reported. Default is False.
+    """
+
+    def __init__(self, path, callback, pattern='*.asc', interval=1.,
+                 settle=1., existing=False):
+        self.path = path
+        self.callback = callback
+        self.pattern = pattern
+        self.interval = interval
+        self.settle = settle
+
+        self.seen = set() if existing else set(self._scan())
+        self._pending = {}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _scan(self):
+        return glob.glob(os.path.join(self.path, self.pattern))
+
+    def poll(self):
+        """
+        Scans the directory once, calls `callback` for every new file that
+        has settled and returns their filenames.
+        """
+        now = time.time()
+        for filename in self._scan():
+            if filename in self.seen:
+                continue
+            try:
+                stat = os.stat(filename)
+            except OSError:
+                # removed or renamed since the scan
+                continue
+            state = (stat.st_size, stat.st_mtime_ns)
+            if filename not in self._pending \
+                    or self._pending[filename][0] != state:
+                self._pending[filename] = (state, now, stat.st_mtime)
+
+        ready = [filename for filename, (state, since, mtime)
+                 in self._pending.items() if now - since >= self.settle]
+        ready.sort(key=lambda filename: self._pending[filename][2])
+        for filename in ready:
+            del self._pending[filename]
+            self.seen.add(filename)
+            self.callback(filename)
+        return ready
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.poll()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """
+        Starts watching in a background (daemon) thread.
+        """
+        if self.running:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        """
+        Stops watching and waits for the watcher thread to finish.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1,4 +1,23 @@
 
 from ._lib import *
+from ._distribution import *
+from ._fourier import *
+from ._autofit import *
+from ._flim import *
+from ._phasor import *
+from ._checkpoint import *
+from ._batch import *
+from ._service import *
+from ._cluster import *
+from ._global import *
+from ._selection import *
+from ._surrogate import *
 
-__all__ = [ 'elementwise_diff', 'simulate_and_compare', 'sac_args', 'fit_leastsq']
\ No newline at end of file
+__all__ = [ 'elementwise_diff', 'simulate_and_compare', 'sac_args', 'fit_leastsq',
+           'log_tau_grid', 'LifetimeKernel', 'lifetime_distribution', 'FourierComparison',
+           'AutoFitter', 'fit_file', 'bin_cube', 'FLIMFitter',
+           'phasor', 'phasor_calibration', 'phasor_lifetimes', 'phasor_clusters',
+           'fit_DE', 'load_checkpoint', 'load_jobs', 'run_jobs',
+           'FitService', 'FitClient', 'Coordinator', 'FitWorker',
+           'GlobalFitter', 'compare_models', 'information_criteria',
+           'fit_surrogate']
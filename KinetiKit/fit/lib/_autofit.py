@@ -0,0 +1,364 @@
+"""
+Automatic fitting of data files as they appear in a directory
+
+Each new file is loaded and preprocessed with the ``data.lib`` tools and
+fitted on a worker pool, starting from the parameters of the last completed
+fit, so that a measurement series can be followed while it is acquired.
+
+"""
+import os
+import csv
+import copy
+import time
+import threading
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from KinetiKit import data, kit
+from ._lib import simulate_and_compare, sac_args, fit_leastsq
+from ._checkpoint import fit_DE
+from ._surrogate import fit_surrogate
+
+__all__ = ['AutoFitter', 'fit_file']
+
+
+def _fit_arrays(data_arrays, system, bounds, to, light=None, p0=None,
+                sac_kwargs={}, method='DE', fit_args={}, residuals=False):
+    # fits preprocessed data; the fit dictionary also holds the convergence
+    # diagnostics 'success', 'message' and 'nit' (None for 'LS'), and the
+    # 'residuals' of the best fit if requested
+    system = copy.deepcopy(system)
+    keys = list(bounds.keys())
+    lower, upper = np.array(list(bounds.values()), dtype=float).T
+    if p0 is None:
+        p0 = system.params()
+    x0 = np.clip([p0[key] for key in keys], lower, upper)
+    # a dictionary rather than dict_keys, which worker processes cannot
+    # receive
+    conditions = sac_args(dict.fromkeys(keys), system, data_arrays, to,
+                          light, **sac_kwargs)
+
+    errors, nit = None, None
+    if method == 'DE':
+        opt = fit_DE(simulate_and_compare, list(bounds.values()),
+                     args=conditions, x0=x0, **fit_args)
+        x, cost, nfev, nit = opt.x, opt.fun, opt.nfev, opt.nit
+        success, message = opt.success, opt.message
+    elif method == 'surrogate':
+        opt = fit_surrogate(simulate_and_compare, list(bounds.values()),
+                            args=conditions, x0=x0, **fit_args)
+        x, cost, nfev, nit = opt.x, opt.fun, opt.nfev, opt.nit
+        success, message = opt.success, opt.message
+    elif method == 'LS':
+        # residuals instead of the condensed cost
+        args = tuple(conditions[:-2]) + (False, conditions[-1])
+        x, perr, infodict = fit_leastsq(simulate_and_compare, x0, args)
+        cost, nfev = np.sum(infodict['fvec']**2), infodict['nfev']
+        errors = dict(zip(keys, perr))
+        success, message = infodict['ier'] in (1, 2, 3, 4), infodict['message']
+    else:
+        raise ValueError('Method must be \'DE\', \'surrogate\' or \'LS\'.')
+
+    if residuals:
+        residuals = simulate_and_compare(
+            x, *(tuple(conditions[:-2]) + (False, False)))
+    else:
+        residuals = None
+
+    return {'params': dict(zip(keys, x)),
+            'errors': errors,
+            'p0': dict(zip(keys, x0)),
+            'cost': cost,
+            'nfev': nfev,
+            'nit': nit,
+            'success': success,
+            'message': message,
+            'residuals': residuals,
+            }
+
+
+def fit_file(filename, system, bounds, to, light=None, p0=None, load_args={},
+             dark=None, preprocess=None, sac_kwargs={}, method='DE',
+             fit_args={}):
+    """
+    Loads, preprocesses and fits one data file.
+
+    Parameters
+    ----------
+    filename : string
+        The file path of interest.
+    system : object
+        System object, e.g. ``sim.systems.Mono()``. It is copied, so that the
+        same object can be shared by fits running concurrently.
+    bounds : dictionary
+        Boundaries of the varied parameters, as in the FitRates examples.
+    to : dictionary
+        Dictionary with time parameters. The data are interpolated onto its
+        time axis.
+
+    Optional Parameters
+    -------------------
+    light : object
+        Excitation object, see ``simulate_and_compare``.
+    p0 : dictionary or None
+        Starting values of the varied parameters. Default is None, in which
+        case the current parameters of `system` are used.
+    load_args : dictionary
+        Keyword arguments of ``data.lib.data_from_SPCM``.
+    dark : float, array, data object or None
+        Dark counts subtracted from the data. Default is None.
+    preprocess : function or None
+        Called as ``preprocess(data_object)`` after the dark subtraction and
+        before the interpolation onto `to`, e.g. to smooth the data.
+    sac_kwargs : dictionary
+        Keyword arguments of ``sac_args`` (e.g. `irf_args`, `roll_criterion`).
+    method : 'DE', 'surrogate' or 'LS'
+        'DE' runs differential evolution (``fit_DE``) with `p0` in the
+        initial population; 'surrogate' runs ``fit_surrogate``, a global
+        search with far fewer evaluations, for slow models; 'LS' runs
+        ``fit_leastsq`` from `p0`, which is faster but local, and returns
+        error estimates. Default is 'DE'.
+    fit_args : dictionary
+        Keyword arguments of ``fit_DE`` (e.g. `maxiter`, `popsize`, `tol`,
+        `checkpoint`) or ``fit_surrogate`` (e.g. `max_nfev`, `batch`,
+        `workers`). Ignored for 'LS'.
+
+    Returns
+    -------
+    result : dictionary
+        'filename', 'key', 'params' (fitted parameters), 'errors' (least-
+        squares errors or None), 'p0' (starting parameters), 'cost' (sum of
+        squared residuals), 'nfev' (number of cost evaluations), 'time'
+        (seconds spent loading and fitting) and the 'pulse_power',
+        'cw_power' and 'wavelength' of the data object.
+    """
+    time_start = time.time()
+    do = data.lib.data_from_SPCM(filename, **load_args)
+    if dark is not None:
+        do.dark_subtract(dark)
+    if preprocess is not None:
+        preprocess(do)
+    do.interp(to)
+
+    fit = _fit_arrays(do.y, system, bounds, to, light, p0, sac_kwargs, method,
+                      fit_args)
+
+    return {'filename': filename,
+            'key': do.key if do.key is not None
+                   else os.path.splitext(os.path.basename(filename))[0],
+            'params': fit['params'],
+            'errors': fit['errors'],
+            'p0': fit['p0'],
+            'cost': fit['cost'],
+            'nfev': fit['nfev'],
+            'time': time.time() - time_start,
+            'pulse_power': do.pulse_power,
+            'cw_power': do.cw_power,
+            'wavelength': do.wavelength,
+            }
+
+
+def _append_results(results_file, keys, results):
+    # one CSV row per fit, with a header if the file is new
+    header = ['filename', 'key', 'cost', 'nfev', 'time'] + keys \
+        + [key + '_error' for key in keys]
+    rows = []
+    for result in results:
+        errors = result['errors'] or {}
+        rows.append([result['filename'], result['key'], result['cost'],
+                     result['nfev'], result['time']]
+                    + [result['params'][key] for key in keys]
+                    + [errors.get(key, '') for key in keys])
+    new = not os.path.exists(results_file)
+    with open(results_file, 'a', newline='') as f:
+        writer = csv.writer(f)
+        if new:
+            writer.writerow(header)
+        writer.writerows(rows)
+
+
+class AutoFitter(object):
+    """
+    Watches a directory for new data files and fits each of them on a worker
+    pool, warm-started from the parameters of the last completed fit.
+
+    Files are detected with ``data.lib.FolderWatcher`` and fitted with
+    ``fit_file``. Results are collected in the `results` list, optionally
+    appended to a CSV file and a ``kit.ResultStore``, and passed to
+    `on_result`.
+
+    Parameters
+    ----------
+    path : string
+        Directory to watch.
+    system : object
+        System object; its current parameters start the first fit.
+    bounds : dictionary
+        Boundaries of the varied parameters.
+    to : dictionary
+        Dictionary with time parameters.
+
+    Optional Parameters
+    -------------------
+    light : object
+        Excitation object.
+    pattern : string
+        Glob pattern of the data files. Default is '*.asc'.
+    results_file : string or None
+        CSV file to which one row per fit is appended (filename, key, cost,
+        nfev, time, parameters and errors). Default is None.
+    store : string, ``kit.ResultStore`` or None
+        Database to which each fit is added, with the model class and the
+        bounds. A path is opened as a ``kit.ResultStore`` and closed by
+        ``stop``. Default is None.
+    on_result : function or None
+        Called as ``on_result(result)`` after each fit.
+    warm_start : boolean
+        Whether each fit starts from the parameters of the last completed
+        fit. Default is True.
+    workers : integer
+        Number of fits that run at the same time. Fits start from the result
+        of the last completed fit, so the default of 1 fits the files in
+        order, each starting from the result of the one before.
+    executor : 'thread' or 'process'
+        Type of the worker pool. Processes fit in parallel despite the GIL
+        but require picklable arguments. Default is 'thread'.
+    interval, settle : float
+        Polling interval and settling time of the watcher, in seconds.
+    verbose : boolean
+        Whether failed fits are printed; they are recorded in `errors`
+        either way. Default is True.
+    **kwargs
+        Passed to ``fit_file`` (`load_args`, `dark`, `preprocess`,
+        `sac_kwargs`, `method`, `fit_args`).
+    """
+
+    def __init__(self, path, system, bounds, to, light=None, pattern='*.asc',
+                 results_file=None, store=None, on_result=None,
+                 warm_start=True, workers=1, executor='thread', interval=1.,
+                 settle=1., verbose=True, **kwargs):
+
+        self.system = system
+        self.bounds = bounds
+        self.to = to
+        self.light = light
+        self.results_file = results_file
+        self.on_result = on_result
+        self.warm_start = warm_start
+        self.verbose = verbose
+        self.fit_kwargs = kwargs
+        self._own_store = isinstance(store, str)
+        self.store = kit.ResultStore(store) if self._own_store else store
+
+        params = system.params()
+        self.params = {key: params[key] for key in bounds}
+        self.workers = workers
+        self.results = []
+        self.errors = []
+        self._queue = collections.deque()
+        self._running = 0
+        self._done = threading.Condition()
+
+        if executor == 'thread':
+            self._pool = concurrent.futures.ThreadPoolExecutor(workers)
+        elif executor == 'process':
+            self._pool = concurrent.futures.ProcessPoolExecutor(workers)
+        else:
+            raise ValueError('Executor must be \'thread\' or \'process\'.')
+
+        self.watcher = data.lib.FolderWatcher(path, self.submit, pattern,
+                                              interval=interval,
+                                              settle=settle)
+
+    def submit(self, filename):
+        """
+        Queues the fit of one file. Fits start when a worker is free, from
+        the latest fitted parameters at that time.
+        """
+        with self._done:
+            self._queue.append(filename)
+        self._dispatch()
+
+    def _dispatch(self):
+        with self._done:
+            while self._queue and self._running < self.workers:
+                filename = self._queue.popleft()
+                future = self._pool.submit(fit_file, filename, self.system,
+                                           self.bounds, self.to, self.light,
+                                           p0=dict(self.params),
+                                           **self.fit_kwargs)
+                future.filename = filename
+                self._running += 1
+                future.add_done_callback(self._collect)
+
+    def _collect(self, future):
+        try:
+            result = future.result()
+        except Exception as error:
+            if self.verbose:
+                print('Fit of %s failed: %s' % (future.filename, error))
+            result = None
+        with self._done:
+            if result is None:
+                self.errors.append((future.filename, future.exception()))
+            else:
+                if self.warm_start:
+                    self.params = dict(result['params'])
+                self.results.append(result)
+                if self.results_file is not None:
+                    _append_results(self.results_file,
+                                    list(self.bounds.keys()), [result])
+                if self.store is not None:
+                    self.store.add_many([dict(
+                        result, model=getattr(self.system, 'class_name',
+                                              type(self.system).__name__),
+                        bounds={key: tuple(bound)
+                                for key, bound in self.bounds.items()})])
+            self._running -= 1
+            self._done.notify_all()
+        if result is not None and self.on_result is not None:
+            self.on_result(result)
+        self._dispatch()
+
+    def start(self):
+        """
+        Starts watching the directory.
+        """
+        self.watcher.start()
+
+    def wait(self, timeout=None):
+        """
+        Waits until all queued fits are complete. Returns False if `timeout`
+        (in seconds) elapsed first.
+        """
+        with self._done:
+            return self._done.wait_for(
+                lambda: not self._queue and self._running == 0, timeout)
+
+    def stop(self, wait=True):
+        """
+        Stops watching the directory and shuts down the worker pool, by
+        default after the queued fits are complete. Otherwise, queued fits
+        that have not started are discarded. A store opened from a path is
+        closed, so fits that are still running then are not added to it.
+        """
+        self.watcher.stop()
+        if wait:
+            self.wait()
+        else:
+            with self._done:
+                self._queue.clear()
+        self._pool.shutdown(wait=wait)
+        if self._own_store:
+            with self._done:
+                store, self.store = self.store, None
+            store.close()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,416 @@
+"""
+Batch fitting driven by job files
+
+A job file (JSON, or TOML with Python 3.11+ or the ``tomli`` package)
+replaces the editable section of the FitRates example scripts: it lists the
+data files and the model, bounds, time, excitation, IRF and comparison
+settings of one or more jobs. All the files of all the jobs are fitted with
+``fit_file`` on a process pool, and the results are written to CSV files in
+a results directory and, optionally, to a ``kit.ResultStore``. The
+``kinetikit-fit`` command runs job files from the command line.
+
+A job file holds a single job, or a list of 'jobs' with shared 'defaults'::
+
+    {"defaults": {"model": "Biexp",
+                  "time": {"N": 1000, "reprate": "80 MHz"},
+                  "irf": {"fwhm": "55 ps"},
+                  "load": {"skip_h": 154, "skip_f": 884, "coll": 900}},
+     "jobs": [{"name": "film_A",
+               "data": ["film_A/*.asc"],
+               "params": {"A1": 1, "tau1": "1 ns", "tau2": "3 ns"},
+               "bounds": {"tau1": ["0.1 ns", "5 ns"]}}]}
+
+Job entries
+-----------
+name : name of the job, used for the results files (default: the name of
+    the job file and the index of the job).
+data : glob pattern(s) of the data files, relative to the job file.
+load : arguments of ``data.lib.data_from_SPCM``.
+dark : arguments of ``data.lib.data_from_SPCM`` for a dark-count file given
+    as 'file', and the subtraction 'method' ('average' or 'elementwise').
+model : name of a class of ``sim.systems``; params : its initial parameters.
+bounds : (lower, upper) bounds of the varied parameters.
+time : arguments of ``sim.time.linear``; 'reprate' can replace 'period'.
+excitation : 'pulse' and 'cw' arguments of ``sim.lib.Excitation``, and
+    'power_from_filename' (pulse power read with ``data.lib.parse_filename``).
+irf : arguments of the IRF (`irf_args`).
+comparison : other arguments of ``sac_args`` (e.g. 'comparison', 'norm',
+    'roll_criterion', 'maxavgnum', 'limits', 'N_coarse').
+method : 'DE', 'surrogate' or 'LS'; fit : arguments of ``fit_DE`` (e.g.
+    'maxiter', 'seed', or 'budget' in seconds for predictable run times) or
+    ``fit_surrogate`` (e.g. 'max_nfev'); checkpoint : whether DE fits save
+    checkpoints in the results directory, from which interrupted fits resume.
+
+Values may be given as strings with a unit of ``KinetiKit.units``, e.g.
+"45 nW" or "55 ps".
+
+"""
+import os
+import re
+import sys
+import copy
+import glob
+import json
+import time
+import argparse
+import concurrent.futures
+
+from KinetiKit import sim, data, kit
+from KinetiKit.units import units
+from ._autofit import fit_file, _append_results
+
+__all__ = ['load_jobs', 'run_jobs']
+
+
+_QUANTITY = re.compile(r'^\s*([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+                       r'\s*([^\W\d]\w*)?\s*$')
+_SECTIONS = ['load', 'dark', 'params', 'bounds', 'time', 'excitation',
+             'irf', 'comparison', 'fit']
+
+# options of jobs from other hosts (service clients, the coordinator of a
+# worker); the others, e.g. 'checkpoint' (a pickle file), 'cache_dir' or
+# 'callback', reach the file system or the Python objects of the host
+_LOAD_OPTIONS = {'key', 'time_unit', 'coll', 'metadata', 'weigh_by_coll',
+                 'pulse_power', 'cw_power', 'wavelength', 'delimiter',
+                 'unpack', 'skip_h', 'skip_f', 'autocrop'}
+_REMOTE_OPTIONS = {
+    'load': _LOAD_OPTIONS,
+    'dark': _LOAD_OPTIONS | {'file', 'method'},
+    'fit': {'strategy', 'maxiter', 'popsize', 'tol', 'atol', 'mutation',
+            'recombination', 'seed', 'init', 'updating', 'polish', 'budget',
+            'max_nfev', 'patience', 'stall_tol', 'batch', 'n_init', 'log',
+            'xi'},
+    }
+
+
+def _quantity(value):
+    # numbers with units in strings (e.g. '45 nW') are converted to floats
+    if isinstance(value, dict):
+        return {key: _quantity(val) for key, val in value.items()}
+    if isinstance(value, list):
+        return [_quantity(val) for val in value]
+    if isinstance(value, str):
+        match = _QUANTITY.match(value)
+        if match is not None and (match.group(2) is None
+                                  or match.group(2) in units):
+            return float(match.group(1)) * units.get(match.group(2), 1)
+    return value
+
+
+def _read(filename):
+    with open(filename, 'rb') as f:
+        if filename.lower().endswith('.toml'):
+            try:
+                import tomllib
+            except ImportError:
+                try:
+                    import tomli as tomllib
+                except ImportError:
+                    raise ImportError('Reading TOML job files requires '
+                                      'Python 3.11 or the tomli package.')
+            return tomllib.load(f)
+        return json.load(f)
+
+
+def load_jobs(filename):
+    """
+    Reads a job file and returns its jobs, as a list of dictionaries with
+    the entries described in the module documentation, the defaults merged
+    in, quantities converted to floats, and 'files', the sorted list of data
+    files matched by 'data'.
+    """
+    content = _read(filename)
+    folder = os.path.dirname(os.path.abspath(filename))
+    stem = os.path.splitext(os.path.basename(filename))[0]
+    defaults = content.get('defaults', {})
+    entries = content['jobs'] if 'jobs' in content else [content]
+
+    return [_prepare_job(entry, defaults, folder,
+                         stem if len(entries) == 1 else '%s_%i' % (stem, i + 1))
+            for i, entry in enumerate(entries)]
+
+
+def _prepare_job(entry, defaults, folder, name):
+    # merges the defaults, converts quantities and finds the data files
+    job = copy.deepcopy(defaults)
+    for key, value in entry.items():
+        if key in _SECTIONS and isinstance(value, dict):
+            # sections are merged with their defaults
+            job[key] = dict(job.get(key, {}), **value)
+        else:
+            job[key] = value
+    job.setdefault('name', name)
+    for key in _SECTIONS:
+        job[key] = _quantity(job.get(key, {}))
+    if 'model' not in job or not job['bounds']:
+        raise ValueError('Job %s needs a model and bounds.' % job['name'])
+
+    patterns = job.get('data', [])
+    if isinstance(patterns, str):
+        patterns = [patterns]
+    files = set()
+    for pattern in patterns:
+        files.update(glob.glob(os.path.join(folder, pattern)))
+    job['files'] = sorted(files)
+    if job.get('dark', {}).get('file') is not None:
+        job['dark']['file'] = os.path.join(folder, job['dark']['file'])
+    return job
+
+
+def _check_remote(job):
+    # refuses the options that jobs from other hosts may not set
+    for section, allowed in _REMOTE_OPTIONS.items():
+        refused = sorted(set(job.get(section) or {}) - allowed)
+        if refused:
+            raise ValueError('Options not allowed in %s: %s.'
+                             % (section, ', '.join(refused)))
+    if job.get('checkpoint'):
+        raise ValueError('Checkpoints are not allowed.')
+
+
+def _fit_task(job, filename, checkpoint=None):
+    # runs in the worker processes, so that only plain job dictionaries are
+    # pickled
+    system = getattr(sim.systems, job['model'])()
+    if job['params']:
+        system.update(**job['params'])
+
+    time_args = dict(job['time'])
+    if 'reprate' in time_args:
+        time_args['period'] = 1 / time_args.pop('reprate')
+    to = sim.time.linear(**time_args)
+
+    excitation = dict(job.get('excitation', {}))
+    from_filename = excitation.pop('power_from_filename', False)
+    light = None
+    if excitation or from_filename:
+        pulse = dict(excitation.get('pulse', {}))
+        pulse.setdefault('reprate', 1 / to['period'])
+        if from_filename:
+            power = data.lib.parse_filename(os.path.basename(filename))
+            if 'pulse_power' not in power:
+                raise ValueError('No power found in %s.' % filename)
+            pulse['power'] = power['pulse_power']
+        light = sim.lib.Excitation(pulse=pulse, cw=excitation.get('cw', {}),
+                                   **{key: val for key, val in excitation.items()
+                                      if key not in ('pulse', 'cw')})
+
+    dark, preprocess = None, None
+    if job.get('dark'):
+        dark_args = dict(job['dark'])
+        method = dark_args.pop('method', 'average')
+        dark_counts = data.lib.data_from_SPCM(dark_args.pop('file'),
+                                              **dark_args)
+        def preprocess(do):
+            do.dark_subtract(dark_counts, method=method)
+
+    sac_kwargs = dict(job['comparison'])
+    if job['irf']:
+        sac_kwargs['irf_args'] = job['irf']
+    fit_args = dict(job['fit'])
+    if checkpoint is not None:
+        fit_args['checkpoint'] = checkpoint
+
+    result = fit_file(filename, system, job['bounds'], to, light,
+                      load_args=job['load'], dark=dark, preprocess=preprocess,
+                      sac_kwargs=sac_kwargs, method=job.get('method', 'DE'),
+                      fit_args=fit_args)
+    if checkpoint is not None and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    return result
+
+
+def _record(job, result, output=None, store=None):
+    # appends a result to the results file of its job and to the store
+    keys = list(job['bounds'].keys())
+    if output is not None:
+        _append_results(os.path.join(output, job['name'] + '_results.csv'),
+                        keys, [result])
+    if store is not None:
+        store.add_many([dict(result, model=job['model'], sample=job['name'],
+                             bounds={key: tuple(job['bounds'][key])
+                                     for key in keys},
+                             metadata={'comparison': job['comparison'],
+                                       'irf': job['irf'],
+                                       'method': job.get('method', 'DE')})])
+
+
+def _pending_tasks(jobs, output, resume=False):
+    # (job, filename, checkpoint) of the files to fit, and the number of
+    # files skipped because they are in the results files already
+    tasks, skipped = [], 0
+    for job in jobs:
+        results_file = os.path.join(output, job['name'] + '_results.csv')
+        done = set()
+        if resume and os.path.exists(results_file):
+            done = set(kit.csv_to_dict(results_file, headertype='column')
+                       .get('filename', []))
+        for filename in job['files']:
+            if filename in done:
+                skipped += 1
+                continue
+            checkpoint = None
+            if job.get('checkpoint') and job.get('method', 'DE') == 'DE':
+                key = os.path.splitext(os.path.basename(filename))[0]
+                checkpoint = os.path.join(output, '%s_%s.ckpt'
+                                          % (job['name'], key))
+            tasks.append((job, filename, checkpoint))
+    return tasks, skipped
+
+
+def _throughput(summary, elapsed):
+    summary['fits'] = len(summary['results'])
+    summary['time'] = elapsed
+    summary['fit_time'] = sum(r['time'] for r in summary['results'])
+    summary['nfev'] = int(sum(r['nfev'] for r in summary['results']))
+    summary['fits_per_hour'] = summary['fits'] / elapsed * 3600
+    summary['evaluations_per_second'] = summary['nfev'] / elapsed
+    return summary
+
+
+def run_jobs(jobs, workers=None, output='results', store=None, resume=False,
+             verbose=True):
+    """
+    Fits the files of all `jobs` concurrently and writes the results.
+
+    Parameters
+    ----------
+    jobs : list of dictionaries
+        As returned by ``load_jobs``.
+
+    Optional Parameters
+    -------------------
+    workers : integer or None
+        Number of worker processes. Default is None, i.e. the number of CPUs;
+        0 fits the files one after the other in the current process.
+    output : string
+        Results directory, in which one '<job name>_results.csv' file per job
+        is appended to as fits complete. Default is 'results'.
+    store : string, ``kit.ResultStore`` or None
+        Results store to which the fits are also added, with the job name as
+        sample. Default is None.
+    resume : boolean
+        Whether files already listed in the results files are skipped, to
+        continue an interrupted campaign. Default is False.
+    verbose : boolean
+        Whether progress is printed. Default is True.
+
+    Returns
+    -------
+    summary : dictionary
+        'results' (list of ``fit_file`` results, with the 'job' name),
+        'errors' (list of (job name, filename, message)), 'skipped' (number
+        of files skipped), 'fits', 'time' (wall time in seconds),
+        'fit_time' (summed time of the fits), 'nfev' (summed number of cost
+        evaluations), 'fits_per_hour' and 'evaluations_per_second'.
+    """
+    time_start = time.time()
+    if not os.path.exists(output):
+        os.makedirs(output)
+    own_store = isinstance(store, str)
+    if own_store:
+        store = kit.ResultStore(store)
+
+    tasks, skipped = _pending_tasks(jobs, output, resume)
+    summary = {'results': [], 'errors': [], 'skipped': skipped}
+
+    def collect(job, filename, future):
+        try:
+            result = future.result()
+        except Exception as error:
+            summary['errors'].append((job['name'], filename, str(error)))
+            if verbose:
+                print('Fit of %s failed: %s' % (filename, error))
+            return
+        _record(job, result, output, store)
+        summary['results'].append(dict(result, job=job['name']))
+        if verbose:
+            print('[%i/%i] %s: %s (%.1f s)'
+                  % (len(summary['results']) + len(summary['errors']),
+                     len(tasks), job['name'], result['key'], result['time']))
+
+    try:
+        if workers == 0:
+            for job, filename, checkpoint in tasks:
+                future = concurrent.futures.Future()
+                try:
+                    future.set_result(_fit_task(job, filename, checkpoint))
+                except Exception as error:
+                    future.set_exception(error)
+                collect(job, filename, future)
+        else:
+            with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+                futures = {pool.submit(_fit_task, *task): task
+                           for task in tasks}
+                for future in concurrent.futures.as_completed(futures):
+                    job, filename, checkpoint = futures[future]
+                    collect(job, filename, future)
+    finally:
+        if own_store:
+            store.close()
+
+    return _throughput(summary, time.time() - time_start)
+
+
+def main(argv=None):
+    """
+    Entry point of the ``kinetikit-fit`` command.
+    """
+    parser = argparse.ArgumentParser(
+        prog='kinetikit-fit',
+        description='Fits the data files listed in JSON or TOML job files.')
+    parser.add_argument('jobfiles', nargs='+', help='job files')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number '
+                             'of CPUs; 0 fits in the current process)')
+    parser.add_argument('-o', '--output', default='results',
+                        help='results directory (default: results)')
+    parser.add_argument('-s', '--store', default=None,
+                        help='SQLite results store to add the fits to')
+    parser.add_argument('-r', '--resume', action='store_true',
+                        help='skip files already in the results files')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='list the files of each job without fitting')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='only print the final report')
+    parser.add_argument('-l', '--listen', default=None, metavar='HOST:PORT',
+                        help='hand the fits out to kinetikit-worker '
+                             'processes connecting to this address, instead '
+                             'of fitting them locally (a token is required '
+                             'unless HOST is a loopback address)')
+    parser.add_argument('--token', default=os.environ.get('KINETIKIT_TOKEN'),
+                        help='secret expected from the workers (default: '
+                             'the KINETIKIT_TOKEN environment variable)')
+    args = parser.parse_args(argv)
+
+    jobs = []
+    for jobfile in args.jobfiles:
+        jobs.extend(load_jobs(jobfile))
+    if args.dry_run:
+        for job in jobs:
+            print('%s: %s, %i files' % (job['name'], job['model'],
+                                        len(job['files'])))
+            for filename in job['files']:
+                print('    ' + filename)
+        return 0
+
+    if args.listen:
+        from ._cluster import Coordinator
+        summary = Coordinator(jobs, args.listen, output=args.output,
+                              store=args.store, resume=args.resume,
+                              verbose=not args.quiet, token=args.token).run()
+    else:
+        summary = run_jobs(jobs, workers=args.workers, output=args.output,
+                           store=args.store, resume=args.resume,
+                           verbose=not args.quiet)
+    print('%i fits (%i failed, %i skipped) in %.1f s: %.1f fits/hour, '
+          '%.0f evaluations/s, %.1f s of fitting per second of wall time.'
+          % (summary['fits'], len(summary['errors']), summary['skipped'],
+             summary['time'], summary['fits_per_hour'],
+             summary['evaluations_per_second'],
+             summary['fit_time'] / summary['time']))
+    return 1 if summary['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
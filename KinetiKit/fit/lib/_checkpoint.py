@@ -0,0 +1,396 @@
+"""
+Differential evolution with periodic checkpoints
+
+Long global fits (e.g. of the Hetero model) save the state of the optimizer
+to a file while they run, and restart from the last checkpoint after a crash,
+a kernel restart or a deliberate preemption, following the same trajectory
+as an uninterrupted run. Fits may also be given a wall-clock budget, a cap on
+the number of evaluations or a stall criterion, and then return the best
+result found so far, so that batch fits have predictable run times.
+
+"""
+import os
+import time
+import pickle
+import inspect
+import warnings
+import threading
+
+import numpy as np
+import scipy as sp
+import scipy.optimize
+try:
+    from scipy.optimize._differentialevolution import \
+        DifferentialEvolutionSolver
+except ImportError:
+    DifferentialEvolutionSolver = None
+
+__all__ = ['fit_DE', 'load_checkpoint']
+
+_VERSION = 1
+
+# private members of the scipy solver used for checkpoints; without them,
+# fit_DE falls back to the public differential_evolution
+_PRIVATE = ('__next__', '_result', '_nfev', '_scale_parameters',
+            '_random_population_index', 'population', 'population_energies',
+            'feasible', 'constraint_violation', 'scale',
+            'random_number_generator', 'limits', 'converged', 'maxiter')
+
+
+def load_checkpoint(filename):
+    """
+    Returns the content of a checkpoint file written by ``fit_DE``, a
+    dictionary with the generation 'nit', the number of evaluations 'nfev',
+    the best parameters 'x' and cost 'fun', the 'population' and its
+    'population_energies', the user 'state', the 'elapsed' fitting time in
+    seconds, and whether the evolution was 'done'.
+    """
+    with open(filename, 'rb') as f:
+        return pickle.load(f)
+
+
+def _spread(solver):
+    # standard deviation of the population, relative to the bounds, and of
+    # its costs, relative to the best cost
+    population = solver._scale_parameters(solver.population)
+    width = np.abs(solver.limits[1] - solver.limits[0])
+    energies = solver.population_energies[np.isfinite(
+        solver.population_energies)]
+    best = np.abs(solver.population_energies[0])
+    return (np.std(population, axis=0) / width,
+            np.std(energies) / best if best > 0 and energies.size
+            else np.inf)
+
+
+def _save_checkpoint(filename, solver, nit, elapsed, state, outcome=None,
+                     stall=None):
+    # `outcome` is the (message, warning flag, budget exhausted) of a
+    # finished evolution and `stall` the (best cost, generations without
+    # improvement)
+    checkpoint = {'version': _VERSION,
+                  'scipy': sp.__version__,
+                  'limits': solver.limits,
+                  'nit': nit,
+                  'nfev': solver._nfev,
+                  'x': solver.x,
+                  'fun': solver.population_energies[0],
+                  'population': solver._scale_parameters(solver.population),
+                  'population_energies': solver.population_energies,
+                  'internal': {'population': solver.population,
+                               'feasible': solver.feasible,
+                               'constraint_violation':
+                                   solver.constraint_violation,
+                               'scale': solver.scale,
+                               'rng': solver.random_number_generator,
+                               # shuffled in place when drawing samples
+                               'index': solver._random_population_index},
+                  'state': state,
+                  'stall': stall,
+                  'elapsed': elapsed,
+                  'done': outcome is not None,
+                  'outcome': outcome,
+                  }
+    temporary = '%s.%i.%i.tmp' % (filename, os.getpid(), threading.get_ident())
+    with open(temporary, 'wb') as f:
+        pickle.dump(checkpoint, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, filename)
+
+
+def _restore(solver, checkpoint):
+    # the internal state is only meaningful to the same scipy version
+    if checkpoint.get('scipy') != sp.__version__:
+        raise ValueError('The checkpoint was written with scipy %s and cannot '
+                         'be resumed with scipy %s.'
+                         % (checkpoint.get('scipy'), sp.__version__))
+    internal = checkpoint['internal']
+    if checkpoint.get('version') != _VERSION \
+            or not np.array_equal(checkpoint['limits'], solver.limits) \
+            or internal['population'].shape != solver.population.shape:
+        raise ValueError('The checkpoint does not match the bounds or the '
+                         'population size of the fit.')
+    solver.population = np.array(internal['population'])
+    solver.population_energies = np.array(checkpoint['population_energies'])
+    solver.feasible = np.array(internal['feasible'])
+    solver.constraint_violation = np.array(internal['constraint_violation'])
+    solver.scale = internal['scale']
+    solver.random_number_generator = internal['rng']
+    solver._random_population_index = np.array(internal['index'])
+    solver._nfev = checkpoint['nfev']
+
+
+def _solver(func, bounds, args, kwargs):
+    # scipy solver stepped by fit_DE, or None if its private members are
+    # missing in this scipy version
+    if DifferentialEvolutionSolver is None:
+        return None
+    parameters = inspect.signature(DifferentialEvolutionSolver).parameters
+    if 'seed' in kwargs and 'seed' not in parameters:
+        kwargs = dict(kwargs)
+        kwargs['rng'] = kwargs.pop('seed')
+    solver = DifferentialEvolutionSolver(func, bounds, args=args,
+                                         polish=False, **kwargs)
+    if all(hasattr(solver, name) for name in _PRIVATE):
+        return solver
+    if hasattr(solver, '__exit__'):
+        solver.__exit__(None, None, None)
+    return None
+
+
+def _fit_scipy(func, bounds, args, stop, callback, polish, budget, kwargs):
+    # public differential_evolution, without checkpoints, monitor, stall
+    # detection or evaluation cap; stop, budget and callback are checked
+    # after each generation
+    time_start = time.time()
+    outcome = {'nit': 0, 'message': None}
+    def scipy_callback(xk, convergence=None):
+        outcome['nit'] += 1
+        if stop is not None and (stop.is_set() if hasattr(stop, 'is_set')
+                                 else stop()):
+            outcome['message'] = 'Preempted.'
+            return True
+        if budget is not None and time.time() - time_start > budget:
+            outcome['message'] = 'Time budget exhausted.'
+            return True
+        if callback is not None:
+            return callback(sp.optimize.OptimizeResult(
+                x=xk, fun=func(xk, *args), nit=outcome['nit'],
+                message='in progress'))
+
+    result = sp.optimize.differential_evolution(
+        func, bounds, args=args, callback=scipy_callback, polish=polish,
+        **kwargs)
+    if outcome['message'] is not None:
+        result.message, result.success = outcome['message'], False
+    result.resumed = None
+    result.elapsed = time.time() - time_start
+    result.history = []
+    return result
+
+
+def fit_DE(func, bounds, args=(), checkpoint=None, interval=60., resume=True,
+           state=None, stop=None, callback=None, polish=True, budget=None,
+           max_nfev=None, patience=None, stall_tol=1e-4, monitor=None,
+           **kwargs):
+    """
+    Minimizes `func` by differential evolution, like
+    ``scipy.optimize.differential_evolution``, while saving the state of the
+    optimizer to a checkpoint file.
+
+    The checkpoint holds the population and its costs, the best parameters,
+    the number of generations and evaluations and the state of the random
+    number generator, so that a fit resumed from it follows exactly the
+    trajectory of an uninterrupted fit with the same seed. It can only be
+    resumed with the scipy version that wrote it.
+
+    Checkpoints rely on private members of the scipy solver. If they are
+    missing in the installed scipy version, a warning is issued and the fit
+    runs ``scipy.optimize.differential_evolution`` without checkpoints,
+    `monitor`, `patience` or `max_nfev`; `stop`, `budget` and `callback` are
+    still checked after each generation.
+
+    Parameters
+    ----------
+    func : function
+        Cost function, called as ``func(x, *args)``, e.g.
+        ``simulate_and_compare``.
+    bounds : sequence or dictionary
+        (lower, upper) bounds of the parameters, or a dictionary of them as
+        in the FitRates examples.
+
+    Optional Parameters
+    -------------------
+    args : tuple
+        Extra arguments of `func`, e.g. the output of ``sac_args``.
+    checkpoint : string or None
+        Checkpoint file. Default is None (no checkpoints).
+    interval : float
+        Minimum time in seconds between checkpoints. Default is 60; 0 saves
+        a checkpoint after every generation.
+    resume : boolean
+        Whether the fit restarts from `checkpoint` if the file exists.
+        Default is True.
+    state : dictionary or None
+        Additional picklable data saved with each checkpoint, e.g. caches
+        used to warm-start the cost function. When the fit is resumed, the
+        dictionary is updated in place with the saved data.
+    stop : threading.Event, function or None
+        Checked after each generation; if set (or if ``stop()`` returns
+        True), a checkpoint is saved and the fit returns without polishing,
+        with `success` False. Used to preempt long fits.
+    callback : function or None
+        Called as ``callback(result)`` after each generation with the
+        intermediate result; the fit stops if it returns True.
+    polish : boolean
+        Whether the best solution is refined with ``scipy.optimize.minimize``
+        (L-BFGS-B) at the end. Default is True.
+    budget : float or None
+        Wall-clock budget in seconds, including the time before a restart.
+        The fit returns the best solution found so far, without polishing,
+        when the next generation would likely exceed the budget (from the
+        average duration of the generations). Default is None.
+    max_nfev : integer or None
+        Maximum number of cost evaluations, checked after each generation;
+        the fit then returns the best solution found so far, without
+        polishing. Default is None.
+    patience : integer or None
+        Number of generations after which the fit stops if the best cost has
+        not decreased by more than `stall_tol` (relative). Default is None
+        (no stall detection).
+    stall_tol : float
+        Relative decrease of the best cost below which a generation counts
+        as stalled. Default is 1e-4.
+    monitor : function or None
+        Called after each generation as ``monitor(progress)``, with a
+        dictionary of the generation 'nit', 'nfev', 'elapsed' time, best
+        'fun' and 'x', the 'spread' of each parameter in the population
+        (standard deviation relative to the width of its bounds) and the
+        'energy_spread' (standard deviation of the population costs relative
+        to the best cost). The fit stops if it returns True.
+    **kwargs
+        Arguments of ``differential_evolution`` (`maxiter`, `popsize`, `tol`,
+        `seed`, `workers`, etc.). A `seed` is required for a resumed fit to
+        reproduce an uninterrupted one.
+
+    Returns
+    -------
+    result : OptimizeResult
+        As returned by ``differential_evolution``, with the additional
+        attributes 'resumed' (the generation from which the fit was resumed,
+        or None), 'elapsed' (fitting time in seconds, including the time
+        before the last restart) and 'history' (list of the `monitor`
+        progress dictionaries of the generations run since the last
+        restart).
+    """
+    if isinstance(bounds, dict):
+        bounds = list(bounds.values())
+    time_start = time.time()
+    solver = _solver(func, bounds, args, kwargs)
+    if solver is None:
+        warnings.warn('The differential evolution solver of scipy %s lacks '
+                      'the members used for checkpoints; fitting without '
+                      'checkpoints, monitor or stall detection.'
+                      % sp.__version__, RuntimeWarning)
+        return _fit_scipy(func, bounds, args, stop, callback, polish, budget,
+                          kwargs)
+
+    with solver:
+        nit, elapsed, resumed, done = 0, 0., None, False
+        message, warning = 'Optimization terminated successfully.', False
+        best, stalled, exhausted = np.inf, 0, False
+        if resume and checkpoint is not None and os.path.exists(checkpoint):
+            saved = load_checkpoint(checkpoint)
+            _restore(solver, saved)
+            nit = resumed = saved['nit']
+            elapsed, done = saved['elapsed'], saved['done']
+            if saved.get('stall') is not None:
+                best, stalled = saved['stall']
+            if state is not None and saved['state'] is not None:
+                state.update(saved['state'])
+            if done:
+                message, warning = saved['outcome'][:2]
+                exhausted = saved['outcome'][2:] == (True,)
+
+        def save(outcome=None):
+            _save_checkpoint(checkpoint, solver, nit,
+                             elapsed + time.time() - time_start, state,
+                             outcome, (best, stalled))
+        last_save = time.time()
+        history, generations = [], 0
+
+        try:
+            while not done:
+                if nit >= solver.maxiter:
+                    message = 'Maximum number of iterations has been exceeded.'
+                    warning = True
+                    break
+                try:
+                    next(solver)
+                except StopIteration:
+                    message = 'Maximum number of function evaluations has ' \
+                              'been exceeded.'
+                    warning = True
+                    break
+                nit += 1
+                generations += 1
+                fitting_time = elapsed + time.time() - time_start
+
+                fun = solver.population_energies[0]
+                if fun < best - stall_tol * abs(best) or not np.isfinite(best):
+                    best, stalled = fun, 0
+                else:
+                    stalled += 1
+
+                if checkpoint is not None \
+                        and time.time() - last_save >= interval:
+                    save()
+                    last_save = time.time()
+
+                if stop is not None and (stop.is_set() if hasattr(stop, 'is_set')
+                                         else stop()):
+                    if checkpoint is not None:
+                        save()
+                    result = solver._result(nit=nit, warning_flag=True,
+                                            message='Preempted.')
+                    result.resumed = resumed
+                    result.elapsed = elapsed + time.time() - time_start
+                    result.history = history
+                    return result
+
+                if callback is not None:
+                    intermediate = solver._result(nit=nit,
+                                                  message='in progress')
+                    if callback(intermediate):
+                        message = 'callback function requested stop early'
+                        warning = True
+                        break
+                if monitor is not None:
+                    spread, energy_spread = _spread(solver)
+                    progress = {'nit': nit, 'nfev': solver._nfev,
+                                'elapsed': fitting_time, 'fun': fun,
+                                'x': solver.x, 'spread': spread,
+                                'energy_spread': energy_spread}
+                    history.append(progress)
+                    if monitor(progress):
+                        message = 'monitor function requested stop early'
+                        warning = True
+                        break
+                if solver.converged():
+                    break
+                if patience is not None and stalled >= patience:
+                    message = 'Best cost stalled for %i generations.' \
+                              % stalled
+                    break
+                if max_nfev is not None and solver._nfev >= max_nfev:
+                    message = 'Maximum number of evaluations reached.'
+                    warning = exhausted = True
+                    break
+                if budget is not None:
+                    per_generation = (time.time() - time_start) / generations
+                    if fitting_time + per_generation > budget:
+                        message = 'Time budget exhausted.'
+                        warning = exhausted = True
+                        break
+        except KeyboardInterrupt:
+            if checkpoint is not None:
+                save()
+            raise
+
+        if checkpoint is not None:
+            # resuming a finished fit only repeats the polishing
+            save((message, warning, exhausted))
+
+        result = solver._result(nit=nit, message=message, warning_flag=warning)
+
+    if polish and not exhausted:
+        polished = sp.optimize.minimize(func, np.copy(result.x), args=args,
+                                        method='L-BFGS-B', bounds=bounds)
+        result.nfev += polished.nfev
+        if polished.fun < result.fun and polished.success \
+                and np.all(polished.x >= solver.limits[0]) \
+                and np.all(polished.x <= solver.limits[1]):
+            result.x, result.fun = polished.x, polished.fun
+            result.jac = polished.jac
+    result.resumed = resumed
+    result.elapsed = elapsed + time.time() - time_start
+    result.history = history
+    return result
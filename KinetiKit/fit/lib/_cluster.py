@@ -0,0 +1,605 @@
+"""
+Distribution of batch fits over several machines
+
+A ``Coordinator`` holds the fits of a list of jobs (see ``load_jobs``), one
+per data file, and hands them out over TCP to ``FitWorker`` processes on any
+number of hosts, each of which fits several files at a time on its own
+process pool. Workers and the coordinator send each other heartbeats; the
+fits of a worker that disconnects or falls silent are handed to other
+workers, and a worker that loses the coordinator reconnects. Results are collected by the
+coordinator into the results directory and store, as with ``run_jobs``.
+
+Messages are JSON objects preceded by their length (4 bytes, big-endian).
+The data files (and dark-count files) are sent with the fits by default, so
+that workers do not need access to the file system of the coordinator.
+
+"""
+import os
+import sys
+import hmac
+import json
+import time
+import base64
+import socket
+import ipaddress
+import struct
+import shutil
+import argparse
+import tempfile
+import threading
+import collections
+import concurrent.futures
+
+import numpy as np
+
+from KinetiKit import kit
+from ._batch import _check_remote, _fit_task, _record, _pending_tasks, \
+    _throughput
+
+__all__ = ['Coordinator', 'FitWorker']
+
+# limits on workers that have not presented their token yet
+_HANDSHAKE_TIMEOUT = 10.
+_HELLO_SIZE = 1 << 16
+
+
+def _send(sock, message, lock=None):
+    body = json.dumps(message, default=_plain).encode()
+    if lock is None:
+        sock.sendall(struct.pack('>I', len(body)) + body)
+    else:
+        with lock:
+            sock.sendall(struct.pack('>I', len(body)) + body)
+
+
+def _receive(sock, limit=None):
+    # returns None when the connection is closed
+    header = _read_exactly(sock, 4)
+    if header is None:
+        return None
+    size = struct.unpack('>I', header)[0]
+    if limit is not None and size > limit:
+        raise ValueError('Message of %i bytes exceeds %i.' % (size, limit))
+    body = _read_exactly(sock, size)
+    return None if body is None else json.loads(body)
+
+
+def _read_exactly(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _plain(value):
+    # numpy values in results
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    raise TypeError('%r is not JSON serializable.' % (value,))
+
+
+def _parse_address(address):
+    if isinstance(address, str):
+        host, port = address.rsplit(':', 1)
+        return host, int(port)
+    return tuple(address)
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == 'localhost'
+
+
+class _Connection(object):
+
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.lock = threading.Lock()
+        self.name = '%s:%i' % address[:2]
+        self.slots = 0
+        self.tasks = set()
+        self.last_seen = time.time()
+        self.fits = 0
+        self.lost = threading.Event()
+
+
+class Coordinator(object):
+    """
+    Hands out the fits of `jobs` to ``FitWorker`` processes over TCP and
+    collects their results.
+
+    Parameters
+    ----------
+    jobs : list of dictionaries
+        As returned by ``load_jobs``.
+
+    Optional Parameters
+    -------------------
+    address : tuple or string
+        (host, port) or 'host:port' on which workers are accepted. Port 0
+        picks a free port (see `address` after ``start``). Default is
+        ('127.0.0.1', 8766), i.e. workers on the same machine only; use e.g.
+        ('0.0.0.0', 8766), with a `token`, for workers on other hosts.
+    output, store, resume, verbose
+        See ``run_jobs``.
+    heartbeat : float
+        Interval in seconds at which workers and the coordinator send
+        heartbeats. Default is 5.
+    timeout : float
+        Time in seconds after which a silent worker is considered lost, and
+        after which workers consider a silent coordinator lost. Default is
+        30.
+    retries : integer
+        Number of times the fit of a file is handed out again after the loss
+        of its worker. Default is 2.
+    send_data : boolean
+        Whether the data files are sent to the workers. If False, workers
+        read them from the same paths, e.g. on a shared drive. Default is
+        True.
+    token : string or None
+        Secret that workers must present. Required unless `address` is a
+        loopback address, since workers receive the data files and send
+        results that are recorded. Default is None.
+    """
+
+    def __init__(self, jobs, address=('127.0.0.1', 8766), output='results',
+                 store=None, resume=False, verbose=True, heartbeat=5.,
+                 timeout=30., retries=2, send_data=True, token=None):
+        self.address = _parse_address(address)
+        if token is None and not _is_loopback(self.address[0]):
+            raise ValueError('A token is required to accept workers on %s, '
+                             'which is not a loopback address.'
+                             % self.address[0])
+        self.output = output
+        self.verbose = verbose
+        self.heartbeat = heartbeat
+        self.timeout = timeout
+        self.retries = retries
+        self.send_data = send_data
+        self.token = token
+        if not os.path.exists(output):
+            os.makedirs(output)
+        self._own_store = isinstance(store, str)
+        self.store = kit.ResultStore(store) if self._own_store else store
+
+        tasks, skipped = _pending_tasks(jobs, output, resume)
+        # checkpoints are local to the machine of each fit
+        self._tasks = {i: (job, filename) for i, (job, filename, checkpoint)
+                       in enumerate(tasks)}
+        self._queue = collections.deque(self._tasks)
+        self._attempts = collections.Counter()
+        self._connections = []
+        self._finished = set()
+        self.summary = {'results': [], 'errors': [], 'skipped': skipped,
+                        'retries': 0, 'workers': {}}
+        self._changed = threading.Condition()
+        self._closed = False
+        self._time_start = None
+
+    def start(self):
+        """
+        Starts accepting workers in background threads.
+        """
+        self._time_start = time.time()
+        self._server = socket.create_server(self.address)
+        # accept() returns regularly to notice ``stop``
+        self._server.settimeout(0.5)
+        self.address = self._server.getsockname()[:2]
+        self._threads = [threading.Thread(target=self._accept, daemon=True),
+                         threading.Thread(target=self._monitor, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def _accept(self):
+        while not self._closed:
+            try:
+                sock, address = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            # until the worker has presented its token
+            sock.settimeout(_HANDSHAKE_TIMEOUT)
+            threading.Thread(target=self._serve, args=(sock, address),
+                             daemon=True).start()
+
+    def _authorized(self, token):
+        if self.token is None:
+            return True
+        # constant-time comparison, not to leak the token through timing
+        return isinstance(token, str) \
+            and hmac.compare_digest(token.encode(), self.token.encode())
+
+    def _serve(self, sock, address):
+        connection = _Connection(sock, address)
+        try:
+            hello = _receive(sock, _HELLO_SIZE)
+            if not isinstance(hello, dict) or hello.get('type') != 'hello' \
+                    or not self._authorized(hello.get('token')):
+                _send(sock, {'type': 'shutdown', 'reason': 'refused'})
+                return
+            sock.settimeout(None)
+            connection.name = hello.get('name', connection.name)
+            connection.slots = int(hello.get('slots', 1))
+            _send(sock, {'type': 'welcome', 'heartbeat': self.heartbeat,
+                         'timeout': self.timeout})
+            threading.Thread(target=self._beat, args=(connection,),
+                             daemon=True).start()
+            with self._changed:
+                self._connections.append(connection)
+            if self.verbose:
+                print('Worker %s joined with %i slots.'
+                      % (connection.name, connection.slots))
+            self._dispatch()
+            while True:
+                message = _receive(sock)
+                if message is None:
+                    break
+                connection.last_seen = time.time()
+                if message['type'] in ('result', 'error'):
+                    self._collect(connection, message)
+        except (OSError, ValueError):
+            pass
+        finally:
+            connection.lost.set()
+            sock.close()
+            self._lose(connection)
+
+    def _beat(self, connection):
+        # lets the worker notice a coordinator that is gone
+        while not connection.lost.wait(self.heartbeat):
+            try:
+                _send(connection.sock, {'type': 'heartbeat'}, connection.lock)
+            except OSError:
+                return
+
+    def _lose(self, connection):
+        # fits of a lost worker are handed out again, up to `retries` times
+        with self._changed:
+            if connection not in self._connections:
+                return
+            self._connections.remove(connection)
+            for task in connection.tasks:
+                job, filename = self._tasks[task]
+                if self._attempts[task] > self.retries:
+                    self._fail(task, 'Worker %s lost %i times.'
+                               % (connection.name, self._attempts[task]))
+                else:
+                    self.summary['retries'] += 1
+                    self._queue.appendleft(task)
+            connection.tasks.clear()
+            if self.verbose and not self._closed:
+                print('Worker %s lost.' % connection.name)
+        self._dispatch()
+
+    def _monitor(self):
+        while not self._closed:
+            time.sleep(min(self.heartbeat, self.timeout) / 2)
+            now = time.time()
+            with self._changed:
+                silent = [c for c in self._connections
+                          if now - c.last_seen > self.timeout]
+            for connection in silent:
+                # unblocks the reader thread, which hands the fits out again
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _message(self, task):
+        job, filename = self._tasks[task]
+        message = {'type': 'task', 'task': task, 'filename': filename,
+                   'job': {key: value for key, value in job.items()
+                           if key not in ('files', 'checkpoint')}}
+        if self.send_data:
+            files = [filename]
+            if job.get('dark', {}).get('file') is not None:
+                files.append(job['dark']['file'])
+            message['data'] = {}
+            for path in files:
+                with open(path, 'rb') as f:
+                    message['data'][path] = base64.b64encode(f.read()).decode()
+        return message
+
+    def _next(self):
+        # assigns the next queued fit to a worker with a free slot
+        with self._changed:
+            for connection in self._connections:
+                if self._queue and len(connection.tasks) < connection.slots:
+                    task = self._queue.popleft()
+                    self._attempts[task] += 1
+                    connection.tasks.add(task)
+                    return connection, task
+        return None, None
+
+    def _dispatch(self):
+        # the files are read and sent without holding the lock, so that a
+        # slow worker does not hold up the others
+        while True:
+            connection, task = self._next()
+            if connection is None:
+                return
+            try:
+                message = self._message(task)
+            except OSError as error:
+                with self._changed:
+                    # unless the worker was lost meanwhile
+                    if task in connection.tasks:
+                        connection.tasks.discard(task)
+                        self._fail(task, str(error))
+                continue
+            try:
+                _send(connection.sock, message, connection.lock)
+            except OSError:
+                # handed out again by the reader, which the shutdown unblocks
+                with self._changed:
+                    connection.slots = 0
+                try:
+                    connection.sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+    def _fail(self, task, error):
+        job, filename = self._tasks[task]
+        self.summary['errors'].append((job['name'], filename, error))
+        self._finished.add(task)
+        if self.verbose:
+            print('Fit of %s failed: %s' % (filename, error))
+        self._changed.notify_all()
+
+    def _collect(self, connection, message):
+        task = message['task']
+        with self._changed:
+            if task not in connection.tasks or task in self._finished:
+                return
+            connection.tasks.discard(task)
+            job, filename = self._tasks[task]
+            if message['type'] == 'error':
+                self._fail(task, message['error'])
+            else:
+                result = dict(message['result'], filename=filename)
+                _record(job, result, self.output, self.store)
+                connection.fits += 1
+                self.summary['workers'][connection.name] = connection.fits
+                self.summary['results'].append(dict(result, job=job['name'],
+                                                    worker=connection.name))
+                self._finished.add(task)
+                if self.verbose:
+                    print('[%i/%i] %s: %s on %s (%.1f s)'
+                          % (len(self._finished), len(self._tasks),
+                             job['name'], result['key'], connection.name,
+                             result['time']))
+                self._changed.notify_all()
+        self._dispatch()
+
+    @property
+    def done(self):
+        return len(self._finished) == len(self._tasks)
+
+    def wait(self, timeout=None):
+        """
+        Waits until all fits are finished. Returns False if `timeout` (in
+        seconds) elapsed first.
+        """
+        with self._changed:
+            return self._changed.wait_for(lambda: self.done, timeout)
+
+    def stop(self):
+        """
+        Tells the workers to exit, stops accepting workers and returns the
+        summary (see ``run_jobs``), with the number of fits of each worker in
+        'workers' and the number of fits handed out again in 'retries'.
+        """
+        with self._changed:
+            self._closed = True
+            connections = list(self._connections)
+        for connection in connections:
+            try:
+                _send(connection.sock, {'type': 'shutdown'}, connection.lock)
+            except OSError:
+                pass
+        for thread in self._threads:
+            thread.join()
+        self._server.close()
+        if self._own_store:
+            self.store.close()
+        return _throughput(self.summary, time.time() - self._time_start)
+
+    def run(self, timeout=None):
+        """
+        Starts the coordinator, waits until all fits are finished (or until
+        `timeout`) and returns the summary.
+        """
+        self.start()
+        if self.verbose:
+            print('Waiting for workers on %s:%i (%i fits).'
+                  % (self.address[0], self.address[1], len(self._tasks)))
+        try:
+            self.wait(timeout)
+        finally:
+            summary = self.stop()
+        return summary
+
+
+class FitWorker(object):
+    """
+    Fits the files handed out by a ``Coordinator`` on a local process pool.
+
+    Parameters
+    ----------
+    address : tuple or string
+        (host, port) or 'host:port' of the coordinator.
+
+    Optional Parameters
+    -------------------
+    workers : integer or None
+        Number of files fitted at the same time. Default is None, i.e. the
+        number of CPUs.
+    name : string or None
+        Name of the worker in the summary. Default is the host name and the
+        process id.
+    token : string or None
+        Secret expected by the coordinator.
+    connect_timeout : float
+        Time in seconds during which the worker retries to connect, e.g.
+        while the coordinator starts or after the connection was lost.
+        Default is 60.
+
+    Jobs are only fitted with options that do not reach the file system of
+    the worker, see ``FitService.submit``.
+    """
+
+    def __init__(self, address, workers=None, name=None, token=None,
+                 connect_timeout=60.):
+        self.address = _parse_address(address)
+        self.workers = workers or os.cpu_count() or 1
+        self.name = name or '%s-%i' % (socket.gethostname(), os.getpid())
+        self.token = token
+        self.connect_timeout = connect_timeout
+        self.fits = 0
+
+    def _connect(self):
+        deadline = time.time() + self.connect_timeout
+        while True:
+            try:
+                return socket.create_connection(self.address, timeout=10)
+            except OSError:
+                if time.time() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def run(self):
+        """
+        Connects to the coordinator and fits the files it hands out until it
+        tells the worker to exit. If the connection is lost, or the
+        coordinator falls silent, the worker connects again, and returns if
+        the coordinator cannot be reached within `connect_timeout`.
+        """
+        sock = self._connect()
+        while self._session(sock):
+            try:
+                sock = self._connect()
+            except OSError:
+                return
+
+    def _session(self, sock):
+        # fits the files handed out over one connection; returns True if
+        # the connection was lost rather than closed by the coordinator
+        lock = threading.Lock()
+        _send(sock, {'type': 'hello', 'name': self.name,
+                     'slots': self.workers, 'token': self.token}, lock)
+        welcome = _receive(sock)
+        if welcome is None or welcome['type'] != 'welcome':
+            sock.close()
+            raise ConnectionError('The coordinator refused the worker.')
+        # heartbeats of the coordinator arrive well within its timeout
+        sock.settimeout(welcome.get('timeout'))
+
+        stop = threading.Event()
+        def beat():
+            while not stop.wait(welcome['heartbeat']):
+                try:
+                    _send(sock, {'type': 'heartbeat'}, lock)
+                except OSError:
+                    return
+        threading.Thread(target=beat, daemon=True).start()
+
+        folder = tempfile.mkdtemp(prefix='kinetikit_')
+        pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        try:
+            while True:
+                try:
+                    message = _receive(sock)
+                except OSError:
+                    return True
+                if message is None:
+                    return True
+                if message['type'] == 'shutdown':
+                    return False
+                if message['type'] == 'task':
+                    self._submit(pool, message, folder, sock, lock)
+        finally:
+            stop.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            sock.close()
+            shutil.rmtree(folder, ignore_errors=True)
+
+    def _submit(self, pool, message, folder, sock, lock):
+        job, filename = message['job'], message['filename']
+        try:
+            _check_remote(job)
+        except ValueError as error:
+            _send(sock, {'type': 'error', 'task': message['task'],
+                         'error': str(error)}, lock)
+            return
+        task_folder = None
+        if message.get('data'):
+            # local copies of the files, with their original names
+            task_folder = os.path.join(folder, str(int(message['task'])))
+            os.makedirs(task_folder, exist_ok=True)
+            paths = {}
+            for i, (path, content) in enumerate(message['data'].items()):
+                local = os.path.join(task_folder, str(i))
+                os.makedirs(local)
+                local = os.path.join(local, os.path.basename(path))
+                with open(local, 'wb') as f:
+                    f.write(base64.b64decode(content))
+                paths[path] = local
+            filename = paths[filename]
+            if job.get('dark', {}).get('file') in paths:
+                job = dict(job, dark=dict(job['dark'],
+                                          file=paths[job['dark']['file']]))
+
+        def done(future):
+            try:
+                reply = {'type': 'result', 'task': message['task'],
+                         'result': future.result()}
+                self.fits += 1
+            except Exception as error:
+                reply = {'type': 'error', 'task': message['task'],
+                         'error': str(error)}
+            if task_folder is not None:
+                shutil.rmtree(task_folder, ignore_errors=True)
+            try:
+                _send(sock, reply, lock)
+            except OSError:
+                pass
+        pool.submit(_fit_task, job, filename).add_done_callback(done)
+
+
+def main(argv=None):
+    """
+    Entry point of the ``kinetikit-worker`` command.
+    """
+    parser = argparse.ArgumentParser(
+        prog='kinetikit-worker',
+        description='Fits the files handed out by a kinetikit-fit '
+                    'coordinator (kinetikit-fit --listen).')
+    parser.add_argument('address', help='host:port of the coordinator')
+    parser.add_argument('-w', '--workers', type=int, default=None,
+                        help='number of worker processes (default: number '
+                             'of CPUs)')
+    parser.add_argument('--name', default=None, help='name of the worker')
+    parser.add_argument('--token', default=os.environ.get('KINETIKIT_TOKEN'),
+                        help='secret expected by the coordinator (default: '
+                             'the KINETIKIT_TOKEN environment variable)')
+    args = parser.parse_args(argv)
+
+    worker = FitWorker(args.address, workers=args.workers, name=args.name,
+                       token=args.token)
+    worker.run()
+    print('%s finished after %i fits.' % (worker.name, worker.fits))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,313 @@
+"""
+Lifetime-distribution analysis
+
+Fits time-resolved traces with a continuous distribution of lifetimes (an
+inverse Laplace transform) instead of a few discrete exponentials. The
+IRF-convolved exponential kernel is built once for a given time axis and
+reused for every trace that is fitted against it.
+
+"""
+import numpy as np
+import scipy as sp
+import scipy.optimize
+
+from KinetiKit import sim
+from KinetiKit.units import ps, ns
+import KinetiKit.kit as kin_kit
+
+__all__ = ['log_tau_grid', 'LifetimeKernel', 'lifetime_distribution']
+
+
+def log_tau_grid(tau_min=10 * ps, tau_max=10 * ns, num=100):
+    """
+    Returns a logarithmically spaced array of lifetimes.
+
+    Parameters
+    ----------
+    tau_min : float
+        Shortest lifetime of the grid, in seconds. Default is 10 ps.
+    tau_max : float
+        Longest lifetime of the grid, in seconds. Default is 10 ns.
+    num : integer
+        Number of lifetimes in the grid. Default is 100.
+    """
+    return np.logspace(np.log10(tau_min), np.log10(tau_max), num)
+
+
+class LifetimeKernel(object):
+    """
+    Precomputed kernel of IRF-convolved, periodic exponential decays used to
+    fit lifetime distributions.
+
+    Each column of the kernel is the steady-state decay of a single lifetime
+    excited once per `to['period']`, convolved with the IRF and normalized to
+    a maximum of one. The kernel and its factorizations are computed once at
+    construction, so fitting many traces only costs a few small matrix
+    operations per trace.
+
+    Parameters
+    ----------
+    to : dictionary
+        Dictionary with time parameters, as output by ``sim.time.linear``.
+
+    Optional Parameters
+    -------------------
+    taus : 1-D array
+        Lifetimes of the kernel columns. Default is None, in which case
+        ``log_tau_grid(tau_min, tau_max, num)`` is used.
+    tau_min, tau_max, num : float, float, integer
+        See ``log_tau_grid``. Ignored if `taus` is given.
+    irf_args : dictionary or None
+        Arguments for constructing the Instrument Response Function. See
+        ``sim.lib.build_irf``. If None, the kernel is not convolved.
+    onset : float
+        Time at which the exponentials start. Data should be aligned so that
+        their rise coincides with the rise of the kernel (see ``align``).
+        Default is 0.5 ns.
+    offset : boolean
+        Whether a constant background column is appended to the kernel. The
+        background amplitude is not regularized. Default is True.
+    """
+
+    def __init__(self, to, taus=None, tau_min=10 * ps, tau_max=10 * ns,
+                 num=100, irf_args={'fwhm': 55 * ps}, onset=0.5 * ns,
+                 offset=True):
+
+        self.to = to
+        self.t = to['array'][::to['subsample']]
+        self.period = to['period']
+        if taus is None:
+            taus = log_tau_grid(tau_min, tau_max, num)
+        self.taus = np.asarray(taus, dtype=float)
+        self.irf_args = irf_args
+        self.onset = onset
+        self.offset = offset
+
+        self.matrix = self._build_matrix()
+        self._factorized = {}
+
+    @property
+    def shape(self):
+        return self.matrix.shape
+
+    def _build_matrix(self):
+        t = self.t
+        dt = (t - self.onset) % self.period
+        # steady state of a decay excited once per period
+        decays = np.exp(-dt[np.newaxis] / self.taus[:, np.newaxis]) \
+            / (1 - np.exp(-self.period / self.taus[:, np.newaxis]))
+        if self.irf_args is not None:
+            decays = sim.lib.convolve_irf(decays, t, self.irf_args)
+        decays = kin_kit.normalized(decays, alert=False)
+        if self.offset:
+            decays = np.vstack((decays, np.ones(len(t))))
+        return decays.T
+
+    def _regularizer(self, order):
+        ntau = len(self.taus)
+        if order == 0:
+            L = np.eye(ntau)
+        elif order in [1, 2]:
+            L = np.diff(np.eye(ntau), n=order, axis=0)
+        else:
+            raise ValueError('Regularization order must be 0, 1 or 2.')
+        if self.offset:
+            L = np.hstack((L, np.zeros((L.shape[0], 1))))
+        return L
+
+    def _factorize(self, alpha, order):
+        """
+        Returns the orthogonal projection and triangular factor of the
+        Tikhonov-augmented kernel, cached by `alpha` and `order`.
+        """
+        key = (float(alpha), order)
+        if key not in self._factorized:
+            A = self.matrix
+            if alpha > 0:
+                A = np.vstack((A, np.sqrt(alpha) * self._regularizer(order)))
+            Q, R = np.linalg.qr(A, mode='reduced')
+            self._factorized[key] = (Q[:self.matrix.shape[0]].T, R)
+        return self._factorized[key]
+
+    def align(self, data_arrays, avgnum=3):
+        """
+        Returns data arrays rolled so that their steepest rise coincides with
+        the steepest rise of the kernel. See ``kit.align_by_steep``.
+        """
+        ref = self.matrix[:, :len(self.taus)].mean(axis=-1)
+        difs = ref - np.roll(ref, 2 * avgnum)
+        steep_idx = (np.argmax(difs) - avgnum) % len(ref)
+        return kin_kit.align_by_steep(data_arrays, self.t, avgnum=avgnum,
+                                      value=self.t[steep_idx])
+
+    def fit_nnls(self, data_arrays, alpha=1e-2, order=2, norm=True):
+        """
+        Fits a non-negative lifetime distribution to one or many traces by
+        Tikhonov-regularized non-negative least squares.
+
+        The augmented kernel is factorized as QR once per (`alpha`, `order`),
+        so that every trace reduces to a small square NNLS problem of the size
+        of the lifetime grid.
+
+        Parameters
+        ----------
+        data_arrays : 1-D or 2-D array
+            Trace(s) on the time axis of the kernel, already aligned.
+        alpha : float
+            Regularization strength. Default is 1e-2.
+        order : 0, 1 or 2
+            Order of the finite-difference regularization operator: 0
+            penalizes amplitudes, 1 slopes and 2 curvature of the distribution.
+            Default is 2.
+        norm : boolean
+            Whether each trace is normalized to its maximum before fitting.
+            Default is True.
+
+        Returns
+        -------
+        result : dictionary
+            See ``lifetime_distribution``.
+        """
+        Y = self._prepare(data_arrays, norm)
+        Qt, R = self._factorize(alpha, order)
+        QtY = Y @ Qt.T
+
+        coefs = np.empty((len(Y), R.shape[1]))
+        for i, qty in enumerate(QtY):
+            coefs[i] = sp.optimize.nnls(R, qty)[0]
+
+        return self._result(coefs, Y, data_arrays)
+
+    def fit_maxent(self, data_arrays, alpha=1e-2, model=None, norm=True,
+                   maxiter=500):
+        """
+        Fits a lifetime distribution to one or many traces by maximum entropy,
+        i.e. minimizing ``|K x - y|^2 - alpha S(x)`` with the Shannon-Jaynes
+        entropy ``S(x) = sum(x - m - x log(x/m))``.
+
+        Gradients use the precomputed ``K^T K`` and ``K^T y``, so each
+        iteration costs operations on the lifetime grid only.
+
+        Parameters
+        ----------
+        data_arrays : 1-D or 2-D array
+            Trace(s) on the time axis of the kernel, already aligned.
+        alpha : float
+            Entropy weight. Default is 1e-2.
+        model : 1-D array or None
+            Prior distribution `m`. Default is None, which uses a flat prior.
+        norm : boolean
+            Whether each trace is normalized to its maximum before fitting.
+            Default is True.
+        maxiter : integer
+            Maximum number of L-BFGS-B iterations per trace. Default is 500.
+
+        Returns
+        -------
+        result : dictionary
+            See ``lifetime_distribution``.
+        """
+        Y = self._prepare(data_arrays, norm)
+        K = self.matrix
+        ntau = len(self.taus)
+        KtK = K.T @ K
+        KtY = Y @ K
+
+        if model is None:
+            model = np.full(ntau, 1. / ntau)
+        model = np.asarray(model, dtype=float)
+        ent = np.zeros(K.shape[1], dtype=bool); ent[:ntau] = True
+        bounds = [(1e-12, None)] * ntau
+        if self.offset:
+            bounds += [(None, None)]
+        x0 = np.concatenate((model, [0.])) if self.offset else model.copy()
+
+        def cost(x, kty, yty):
+            xe = x[ent]
+            S = np.sum(xe - model - xe * np.log(xe / model))
+            chi2 = x @ KtK @ x - 2 * x @ kty + yty
+            grad = 2 * (KtK @ x - kty)
+            grad[ent] += alpha * np.log(xe / model)
+            return chi2 - alpha * S, grad
+
+        coefs = np.empty((len(Y), K.shape[1]))
+        for i, y in enumerate(Y):
+            opt = sp.optimize.minimize(cost, x0, args=(KtY[i], y @ y),
+                                       jac=True, method='L-BFGS-B',
+                                       bounds=bounds,
+                                       options={'maxiter': maxiter})
+            coefs[i] = opt.x
+
+        return self._result(coefs, Y, data_arrays)
+
+    def fit(self, data_arrays, method='nnls', **kwargs):
+        """
+        Fits a lifetime distribution with `method` ('nnls' or 'maxent').
+        Keyword arguments are passed to ``fit_nnls`` or ``fit_maxent``.
+        """
+        if method == 'nnls':
+            return self.fit_nnls(data_arrays, **kwargs)
+        elif method == 'maxent':
+            return self.fit_maxent(data_arrays, **kwargs)
+        else:
+            raise ValueError('Method must be \'nnls\' or \'maxent\'.')
+
+    def _prepare(self, data_arrays, norm):
+        Y = kin_kit.make_2d(np.asarray(data_arrays, dtype=float))
+        if Y.shape[-1] != self.matrix.shape[0]:
+            raise ValueError('Data arrays must have the length of the kernel '
+                             'time axis (%i).' % self.matrix.shape[0])
+        if norm:
+            Y = kin_kit.normalized(Y, alert=False)
+        return Y
+
+    def _result(self, coefs, Y, data_arrays):
+        ntau = len(self.taus)
+        fits = coefs @ self.matrix.T
+        squeeze = np.ndim(data_arrays) == 1
+        result = {'taus': self.taus,
+                  'amplitudes': coefs[:, :ntau],
+                  'offset': coefs[:, ntau] if self.offset
+                            else np.zeros(len(coefs)),
+                  'fits': fits,
+                  'residual': np.sum((fits - Y)**2, axis=-1),
+                  }
+        if squeeze:
+            result = {key: (val[0] if key != 'taus' else val)
+                      for key, val in result.items()}
+        return result
+
+
+def lifetime_distribution(data_arrays, to, method='nnls', align=False,
+                          kernel_args={}, **kwargs):
+    """
+    Shortcut that builds a ``LifetimeKernel`` and fits one or many traces.
+    When fitting repeatedly on the same time axis, create the kernel once
+    and call its ``fit`` method instead.
+
+    Parameters
+    ----------
+    data_arrays : 1-D or 2-D array
+        Trace(s) interpolated onto the time axis of `to`.
+    to : dictionary
+        Dictionary with time parameters.
+    method : 'nnls' or 'maxent'
+        Inversion method. Default is 'nnls'.
+    align : boolean
+        Whether the data are aligned to the kernel before fitting. Default is
+        False.
+    kernel_args : dictionary
+        Keyword arguments of ``LifetimeKernel``.
+
+    Returns
+    -------
+    result : dictionary
+        'taus' : the lifetime grid; 'amplitudes' : distribution amplitudes
+        per trace; 'offset' : background per trace; 'fits' : reconstructed
+        traces; 'residual' : sum of squared residuals per trace. The leading
+        trace axis is dropped if `data_arrays` is 1-D.
+    """
+    kernel = LifetimeKernel(to, **kernel_args)
+    if align:
+        data_arrays = kernel.align(data_arrays)
+    return kernel.fit(data_arrays, method=method, **kwargs)
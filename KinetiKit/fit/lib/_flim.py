@@ -0,0 +1,507 @@
+"""
+Pixel-wise fitting of fluorescence-lifetime images (FLIM)
+
+A FLIM measurement is a cube of decay histograms (rows x columns x time
+bins). Pixels are fitted in vectorized batches of rows: either against a
+precomputed basis of IRF-convolved exponentials, where every pixel costs a
+few matrix products, or with a ``FunctionModel`` system, whose parameters are
+refined for all pixels of a batch at once. Batches are distributed over a
+process pool and only a few batches are held in memory at a time, so cubes
+may be memory maps (e.g. image blocks of ``data.lib.SDTFile``).
+
+"""
+import os
+import copy
+import itertools
+import concurrent.futures
+
+import numpy as np
+import scipy as sp
+import scipy.optimize
+
+from KinetiKit import sim
+import KinetiKit.kit as kin_kit
+from KinetiKit.units import ps
+from ._distribution import LifetimeKernel, log_tau_grid
+
+__all__ = ['bin_cube', 'FLIMFitter']
+
+
+def bin_cube(cube, size=1, mode='neighbor'):
+    """
+    Spatially bins a FLIM cube.
+
+    Parameters
+    ----------
+    cube : 3-D array
+        Decay histograms, of shape (rows, columns, time bins).
+    size : integer
+        With 'neighbor' binning, each pixel is replaced by the sum of the
+        square of ``(2 size + 1)**2`` pixels centered on it (truncated at the
+        edges of the image), which keeps the image size. With 'block'
+        binning, blocks of ``size x size`` pixels are summed into one pixel,
+        and incomplete blocks at the edges are discarded. Default is 1.
+    mode : 'neighbor' or 'block'
+        Default is 'neighbor'.
+
+    Returns
+    -------
+    binned : 3-D array
+        Binned cube.
+    """
+    cube = np.asarray(cube, dtype=float)
+    if size == 0 or (size == 1 and mode == 'block'):
+        return cube
+    if mode == 'block':
+        rows, cols = cube.shape[0] // size, cube.shape[1] // size
+        cube = cube[:rows * size, :cols * size]
+        return cube.reshape(rows, size, cols, size, -1).sum(axis=(1, 3))
+    elif mode == 'neighbor':
+        # box sums from a summed-area table
+        table = np.zeros((cube.shape[0] + 1, cube.shape[1] + 1,
+                          cube.shape[2]))
+        table[1:, 1:] = cube.cumsum(axis=0).cumsum(axis=1)
+        r = np.arange(cube.shape[0])
+        c = np.arange(cube.shape[1])
+        r0 = np.clip(r - size, 0, None)[:, np.newaxis]
+        r1 = np.clip(r + size + 1, None, cube.shape[0])[:, np.newaxis]
+        c0 = np.clip(c - size, 0, None)[np.newaxis]
+        c1 = np.clip(c + size + 1, None, cube.shape[1])[np.newaxis]
+        return table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]
+    else:
+        raise ValueError('Binning mode must be \'neighbor\' or \'block\'.')
+
+
+def _steep_index(y, avgnum):
+    # same criterion as kit.align_by_steep
+    difs = y - np.roll(y, 2 * avgnum, axis=-1)
+    difs[..., -1] = 0
+    return np.argmax(np.roll(difs, -avgnum, axis=-1), axis=-1)
+
+
+class FLIMFitter(object):
+    """
+    Fits every pixel of FLIM cubes on the time axis of `to`.
+
+    The time axis of the cube must match that of `to` (see
+    ``data.lib.rebin`` to reduce the number of time bins). The data are not
+    aligned pixel by pixel: the model is shifted once, by the (sub-point)
+    shift that best fits the summed decay of the image.
+
+    Parameters
+    ----------
+    to : dictionary
+        Dictionary with time parameters.
+
+    Optional Parameters
+    -------------------
+    irf_args : dictionary
+        Arguments for constructing the Instrument Response Function. See
+        ``sim.lib.build_irf``.
+    spatial_bin : integer
+        Size of the spatial binning of the cube before fitting, see
+        ``bin_cube``. Default is 0 (no binning).
+    bin_mode : 'neighbor' or 'block'
+        See ``bin_cube``. Default is 'neighbor'.
+    min_counts : float
+        Pixels with fewer counts (after binning) are not fitted, and their
+        maps are NaN. Default is 0.
+    chunk_size : integer
+        Approximate number of pixels fitted in one batch. Default is 1024.
+    workers : integer or None
+        Number of processes. Default is 1, which fits in the calling process;
+        None lets ``concurrent.futures`` decide.
+    avgnum : integer
+        Number of points defining the steepest rise, see
+        ``kit.align_by_steep``. Default is 3.
+    """
+
+    def __init__(self, to, irf_args={'fwhm': 55 * ps}, spatial_bin=0,
+                 bin_mode='neighbor', min_counts=0, chunk_size=1024,
+                 workers=1, avgnum=3):
+        self.to = to
+        self.t = to['array'][::to['subsample']]
+        self.irf_args = irf_args
+        self.spatial_bin = spatial_bin
+        self.bin_mode = bin_mode
+        self.min_counts = min_counts
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.avgnum = avgnum
+
+    #--- batches
+
+    def _row_blocks(self, cube):
+        if self.bin_mode == 'block' and self.spatial_bin > 1:
+            unit = self.spatial_bin
+            rows = cube.shape[0] // unit
+            cols = cube.shape[1] // unit
+        else:
+            unit = 1
+            rows, cols = cube.shape[:2]
+        step = max(1, self.chunk_size // max(cols, 1))
+        halo = self.spatial_bin if self.bin_mode == 'neighbor' else 0
+        for start in range(0, rows, step):
+            stop = min(start + step, rows)
+            lo = max(start * unit - halo, 0)
+            hi = min(stop * unit + halo, cube.shape[0])
+            yield start, stop, lo, hi, start * unit - lo
+
+    def _chunk(self, cube, lo, hi, skip, rows):
+        block = bin_cube(cube[lo:hi], self.spatial_bin, self.bin_mode)
+        if self.bin_mode == 'neighbor':
+            block = block[skip:skip + rows]
+        return block
+
+    def _total_decay(self, cube):
+        total = np.zeros(cube.shape[-1])
+        for start in range(0, cube.shape[0], 64):
+            total += np.asarray(cube[start:start + 64], dtype=float) \
+                .sum(axis=(0, 1))
+        return total
+
+    def _check(self, cube):
+        if cube.shape[-1] != len(self.t):
+            raise ValueError('The cube must have the number of time bins of '
+                             'the time axis (%i).' % len(self.t))
+
+    def _fit_shift(self, total, reference, residual):
+        """
+        Returns the time by which the model must be shifted to match the
+        summed decay `total`: first by the steepest rise of `total` and of
+        the unshifted model curve `reference`, then by minimizing
+        ``residual(shift)`` (the residual of a fit of `total`) within a few
+        points of that estimate.
+        """
+        n = len(self.t)
+        dt = self.t[1] - self.t[0]
+        guess = (_steep_index(total, self.avgnum)
+                 - _steep_index(reference, self.avgnum) + n // 2) % n - n // 2
+        steps = guess + np.arange(-4, 5)
+        best = steps[np.argmin([residual(step * dt) for step in steps])]
+        opt = sp.optimize.minimize_scalar(residual, method='bounded',
+                                          bounds=((best - 1) * dt,
+                                                  (best + 1) * dt),
+                                          options={'xatol': 1e-3 * dt})
+        return opt.x
+
+    def _map(self, cube, func, args):
+        """
+        Applies ``func(fitter, Y, *args)`` to batches of pixels (one row per
+        pixel) and assembles the returned dictionaries of per-pixel arrays
+        into maps.
+        """
+        blocks = list(self._row_blocks(cube))
+        maps = {}
+        pool = None
+        if self.workers != 1:
+            pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+
+        def prepare(block):
+            start, stop, lo, hi, skip = block
+            Y = self._chunk(cube, lo, hi, skip, stop - start)
+            shape = Y.shape[:2]
+            Y = Y.reshape(-1, Y.shape[-1])
+            counts = Y.sum(axis=-1)
+            mask = counts >= max(self.min_counts, 1e-300)
+            return start, stop, shape, counts, mask, Y[mask]
+
+        def store(start, stop, shape, counts, mask, result):
+            if not maps:
+                rows = blocks[-1][1]
+                maps['counts'] = np.zeros((rows, shape[1]))
+                maps['mask'] = np.zeros((rows, shape[1]), dtype=bool)
+                for key, val in result.items():
+                    maps[key] = np.full((rows, shape[1]) + val.shape[1:],
+                                        np.nan)
+            maps['counts'][start:stop] = counts.reshape(shape)
+            maps['mask'][start:stop] = mask.reshape(shape)
+            for key, val in result.items():
+                full = np.full((len(mask),) + val.shape[1:], np.nan)
+                full[mask] = val
+                maps[key][start:stop] = full.reshape(shape + val.shape[1:])
+
+        try:
+            if pool is None:
+                for block in blocks:
+                    start, stop, shape, counts, mask, Y = prepare(block)
+                    store(start, stop, shape, counts, mask,
+                          func(self, Y, *args))
+            else:
+                # a bounded number of batches in flight at any time
+                pending = {}
+                queue = iter(blocks)
+                limit = 2 * (self.workers or os.cpu_count() or 1)
+                while True:
+                    for block in itertools.islice(queue,
+                                                  limit - len(pending)):
+                        prepared = prepare(block)
+                        future = pool.submit(func, self, prepared[-1], *args)
+                        pending[future] = prepared[:-1]
+                    if not pending:
+                        break
+                    done, _ = concurrent.futures.wait(
+                        pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                    for future in done:
+                        store(*pending.pop(future), future.result())
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        return maps
+
+    #--- precomputed basis
+
+    def fit_basis(self, cube, taus=None, components=1, offset=True,
+                  onset=None):
+        """
+        Fits every pixel with a sum of `components` exponential decays and an
+        optional constant background, by exhaustive search over a grid of
+        lifetimes.
+
+        For every combination of lifetimes of the grid, the least-squares
+        amplitudes are linear, so the IRF-convolved decays are orthogonalized
+        once and each pixel's residual for all combinations follows from one
+        matrix product. For a single component, the lifetime is refined
+        between grid points by parabolic interpolation of the residuals.
+
+        Parameters
+        ----------
+        cube : 3-D array
+            Decay histograms, of shape (rows, columns, time bins).
+        taus : 1-D array or None
+            Lifetime grid. Default is None, which uses ``log_tau_grid(num=
+            60)`` for one component and ``log_tau_grid(num=30)`` for two.
+        components : 1 or 2
+            Number of exponential components. Default is 1.
+        offset : boolean
+            Whether a constant background is fitted. Default is True.
+        onset : float or None
+            Onset time of the decays, see ``LifetimeKernel``. Default is None,
+            in which case it is fitted to the summed decay of the image.
+
+        Returns
+        -------
+        maps : dictionary
+            'tau' and 'amplitude' : lifetimes and amplitudes (of decays
+            normalized to a maximum of one) per pixel, with a trailing
+            component axis; 'tau_mean' : amplitude-weighted lifetime;
+            'offset' : background; 'chi2' : sum of squared residuals;
+            'counts' : total counts; 'mask' : whether the pixel was fitted.
+            Maps have the (binned) image shape. 'onset' : the onset time.
+        """
+        self._check(cube)
+        if taus is None:
+            taus = log_tau_grid(num=60 if components == 1 else 30)
+        if onset is None:
+            total = self._total_decay(cube)
+            reference = self._basis(taus, 1, offset, 0)['D'].mean(axis=-1)
+            onset = self._fit_shift(total, reference, lambda shift:
+                _fit_basis_chunk(self, total[np.newaxis], self._basis(
+                    taus, 1, offset, shift))['chi2'][0])
+
+        maps = self._map(cube, _fit_basis_chunk,
+                         (self._basis(taus, components, offset, onset),))
+        maps['onset'] = onset
+        return maps
+
+    def _basis(self, taus, components, offset, onset):
+        kernel = LifetimeKernel(self.to, taus=taus, irf_args=self.irf_args,
+                                onset=onset, offset=False)
+        D = kernel.matrix
+        combos = list(itertools.combinations(range(len(taus)), components))
+        Qs, Rinvs = [], []
+        for combo in combos:
+            A = D[:, combo]
+            if offset:
+                A = np.hstack((A, np.ones((len(A), 1))))
+            Q, R = np.linalg.qr(A)
+            Qs.append(Q)
+            Rinvs.append(np.linalg.inv(R))
+        return {'taus': np.asarray(taus, dtype=float),
+                'combos': np.array(combos),
+                'D': D,
+                'Q': np.stack(Qs),        # combos x time x columns
+                'Rinv': np.stack(Rinvs),  # combos x columns x columns
+                'offset': offset}
+
+    #--- FunctionModel systems
+
+    def fit_model(self, cube, system, bounds, offset=True, shift=None,
+                  max_iter=30, tol=1e-8):
+        """
+        Fits every pixel with a ``FunctionModel`` system (e.g.
+        ``sim.systems.Biexp``), convolved with the IRF and scaled by a
+        least-squares amplitude, plus an optional constant background.
+
+        The parameters in `bounds` are refined by Levenberg-Marquardt steps
+        taken for all pixels of a batch at once: the system is evaluated with
+        one parameter value per pixel (its ``PLsig`` must broadcast over
+        parameter arrays of shape (pixels, 1), as do the built-in models),
+        the Jacobian is estimated by finite differences, and the damped
+        normal equations are solved for all pixels together. Amplitude and
+        background are eliminated by linear least squares at every step.
+
+        Parameters
+        ----------
+        cube : 3-D array
+            Decay histograms, of shape (rows, columns, time bins).
+        system : FunctionModel
+            System whose current parameters start every pixel's fit.
+        bounds : dictionary
+            Boundaries of the fitted parameters.
+        offset : boolean
+            Whether a constant background is fitted. Default is True.
+        shift : float or None
+            Time by which the model is shifted forward to match the data.
+            Default is None, in which case it is fitted to the summed decay
+            of the image.
+        max_iter : integer
+            Maximum number of iterations. Default is 30.
+        tol : float
+            Relative decrease of the residual below which a pixel stops
+            iterating. Default is 1e-8.
+
+        Returns
+        -------
+        maps : dictionary
+            One map per key of `bounds`, 'amplitude', 'offset', 'chi2'
+            (sum of squared residuals), 'counts' and 'mask'; 'shift' : the
+            shift of the model.
+        """
+        self._check(cube)
+        if system.populations is not None:
+            raise ValueError('Only FunctionModel systems can be fitted '
+                             'pixel-wise.')
+        system = copy.deepcopy(system)
+        model = {'system': system,
+                 'keys': list(bounds.keys()),
+                 'bounds': np.array(list(bounds.values()), dtype=float),
+                 'p0': np.array([system.params()[key] for key in bounds],
+                                dtype=float),
+                 'offset': offset, 'max_iter': max_iter, 'tol': tol,
+                 'shift': 0}
+        if shift is None:
+            total = self._total_decay(cube)
+            reference = _model_curves(self, model, model['p0'][np.newaxis])[0]
+
+            def residual(shift):
+                trial = dict(model, shift=shift)
+                return _fit_model_chunk(self, total[np.newaxis],
+                                        trial)['chi2'][0]
+
+            shift = self._fit_shift(total, reference, residual)
+
+        model['shift'] = shift
+        maps = self._map(cube, _fit_model_chunk, (model,))
+        maps['shift'] = shift
+        return maps
+
+
+def _fit_basis_chunk(fitter, Y, basis):
+    taus, combos, Q = basis['taus'], basis['combos'], basis['Q']
+    proj = np.einsum('pt,ktc->pkc', Y, Q)
+    chi2 = np.sum(Y**2, axis=-1)[:, np.newaxis] - np.sum(proj**2, axis=-1)
+    best = np.argmin(chi2, axis=-1)
+    pix = np.arange(len(Y))
+    coefs = np.einsum('pcd,pd->pc', basis['Rinv'][best], proj[pix, best])
+    n = combos.shape[1]
+
+    tau = taus[combos[best]]
+    if n == 1 and len(taus) > 2:
+        # parabolic refinement on the logarithmic grid
+        k = np.clip(best, 1, len(taus) - 2)
+        c0, c1, c2 = chi2[pix, k - 1], chi2[pix, k], chi2[pix, k + 1]
+        curv = c0 - 2 * c1 + c2
+        delta = np.where(curv > 0, 0.5 * (c0 - c2) / np.where(curv > 0,
+                                                               curv, 1), 0)
+        delta = np.clip(delta, -1, 1)
+        step = np.log(taus[k + 1] / taus[k])
+        tau = np.where((best > 0) & (best < len(taus) - 1),
+                       taus[k] * np.exp(delta * step), taus[best])[:, None]
+
+    amplitude = coefs[:, :n]
+    weights = np.where(amplitude.sum(axis=-1) != 0, amplitude.sum(axis=-1), 1)
+    return {'tau': tau,
+            'amplitude': amplitude,
+            'tau_mean': np.sum(amplitude * tau, axis=-1) / weights,
+            'offset': coefs[:, n] if basis['offset'] else np.zeros(len(Y)),
+            'chi2': chi2[pix, best]}
+
+
+def _model_curves(fitter, model, P):
+    system = model['system']
+    system.update(**{key: P[:, i:i + 1]
+                     for i, key in enumerate(model['keys'])})
+    pl, converged = sim.lib.simulate_func(system, fitter.t)
+    pl = np.broadcast_to(pl, (len(P), len(fitter.t)))
+    curves = sim.lib.convolve_irf(np.array(pl, dtype=float), fitter.t,
+                                  fitter.irf_args)
+    if model['shift'] != 0:
+        curves = kin_kit.fractional_roll(curves, fitter.t, model['shift'])
+    return curves
+
+
+def _linear_residuals(Y, M, offset):
+    # least-squares amplitude (and background) of each model curve
+    if offset:
+        n = M.shape[-1]
+        Mm, Ym = M.mean(axis=-1), Y.mean(axis=-1)
+        Mc, Yc = M - Mm[:, None], Y - Ym[:, None]
+        den = np.sum(Mc**2, axis=-1)
+        amp = np.sum(Mc * Yc, axis=-1) / np.where(den > 0, den, 1)
+        off = Ym - amp * Mm
+    else:
+        den = np.sum(M**2, axis=-1)
+        amp = np.sum(M * Y, axis=-1) / np.where(den > 0, den, 1)
+        off = np.zeros(len(Y))
+    return Y - amp[:, None] * M - off[:, None], amp, off
+
+
+def _fit_model_chunk(fitter, Y, model):
+    lower, upper = model['bounds'].T
+    P = np.tile(model['p0'], (len(Y), 1))
+    npar = P.shape[1]
+    resid, amp, off = _linear_residuals(Y, _model_curves(fitter, model, P),
+                                        model['offset'])
+    chi2 = np.sum(resid**2, axis=-1)
+    damping = np.full(len(Y), 1e-3)
+    active = np.ones(len(Y), dtype=bool)
+
+    for iteration in range(model['max_iter']):
+        if not active.any():
+            break
+        idx = np.nonzero(active)[0]
+        Pa, ra = P[idx], resid[idx]
+        J = np.empty((len(idx), len(fitter.t), npar))
+        for i in range(npar):
+            h = 1e-6 * np.maximum(np.abs(Pa[:, i]), 1e-30)
+            Ph = Pa.copy(); Ph[:, i] += h
+            rh = _linear_residuals(Y[idx], _model_curves(fitter, model, Ph),
+                                   model['offset'])[0]
+            J[:, :, i] = (rh - ra) / h[:, None]
+        JtJ = np.einsum('pti,ptj->pij', J, J)
+        Jtr = np.einsum('pti,pt->pi', J, ra)
+        diag = np.einsum('pii->pi', JtJ)
+        A = JtJ + damping[idx, None, None] * np.einsum(
+            'pi,ij->pij', np.where(diag > 0, diag, 1), np.eye(npar))
+        step = np.linalg.solve(A, -Jtr[..., None])[..., 0]
+        Pn = np.clip(Pa + step, lower, upper)
+        rn, an, on = _linear_residuals(Y[idx], _model_curves(fitter, model,
+                                                             Pn),
+                                       model['offset'])
+        cn = np.sum(rn**2, axis=-1)
+
+        better = cn < chi2[idx]
+        small = better & (chi2[idx] - cn <= model['tol'] * chi2[idx])
+        good = idx[better]
+        P[good], resid[good], chi2[good] = Pn[better], rn[better], cn[better]
+        amp[good], off[good] = an[better], on[better]
+        damping[good] /= 10
+        damping[idx[~better]] *= 10
+        # pixels stop when the residual no longer decreases
+        active[idx[small]] = False
+        active[idx[damping[idx] > 1e10]] = False
+
+    result = {key: P[:, i] for i, key in enumerate(model['keys'])}
+    result.update({'amplitude': amp, 'offset': off, 'chi2': chi2})
+    return result
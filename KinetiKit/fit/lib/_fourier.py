@@ -0,0 +1,177 @@
+"""
+Frequency-domain comparison of data and simulation
+
+Both the simulated and the measured signals are periodic over the laser
+period, so IRF convolution and alignment are a multiplication and a phase
+ramp on their Fourier coefficients. Comparing the two on a truncated set of
+harmonics avoids the time-domain convolution and alignment at every cost
+evaluation.
+
+"""
+import numpy as np
+
+from KinetiKit import sim
+from KinetiKit.units import ps
+import KinetiKit.kit as kin_kit
+from KinetiKit.kit._alignment import _cross_spectrum_peak
+
+__all__ = ['FourierComparison']
+
+
+class FourierComparison(object):
+    """
+    Experimental data prepared for comparison with simulations in the Fourier
+    domain. Pass an instance in place of `data_arrays` to
+    ``simulate_and_compare`` (or ``sac_args``) to evaluate the cost on the
+    lowest harmonics of the laser repetition rate.
+
+    The data spectra and the IRF spectrum are computed once. For each
+    simulation, the unconvolved PL is transformed, multiplied by the IRF
+    spectrum, shifted onto the data by the sub-point shift that maximizes
+    their cross-correlation, and scaled by its least-squares amplitude. The
+    residual is the band-limited difference of the spectra, weighted so that
+    its sum of squares equals the time-domain sum of squares of the
+    band-limited traces (Parseval's theorem).
+
+    The `comparison`, `absolute`, `limits`, `roll_criterion` and `maxavgnum`
+    arguments of ``simulate_and_compare`` do not apply to this comparison.
+
+    Parameters
+    ----------
+    data_arrays : 1-D or 2-D array
+        Experimental trace(s) interpolated onto the time axis of `to`,
+        spanning one laser period.
+    to : dictionary
+        Dictionary with time parameters.
+
+    Optional Parameters
+    -------------------
+    irf_args : dictionary
+        Arguments for constructing the Instrument Response Function. See
+        ``sim.lib.build_irf``.
+    harmonics : integer or None
+        Number of harmonics (including the DC term) that are compared. Default
+        is None, in which case all harmonics where the IRF spectrum is larger
+        than `irf_cutoff` are used; higher harmonics of the simulation are
+        suppressed by the IRF and only carry noise in the data.
+    irf_cutoff : float
+        See `harmonics`. Default is 1e-3.
+    norm : boolean
+        If True, each simulated trace is scaled by its own least-squares
+        amplitude and each data trace is normalized by its maximum. If False,
+        one amplitude is shared by all traces and the data are normalized by
+        their overall maximum, preserving relative intensities across powers.
+        Default is True.
+    """
+
+    def __init__(self, data_arrays, to, irf_args={'fwhm': 55 * ps},
+                 harmonics=None, irf_cutoff=1e-3, norm=True):
+
+        self.to = to
+        self.t = to['array'][::to['subsample']]
+        self.irf_args = irf_args
+        self.norm = norm
+
+        data_arrays = np.asarray(data_arrays, dtype=float)
+        self.ndim = data_arrays.ndim
+        data = kin_kit.make_2d(data_arrays)
+        self.n = n = data.shape[-1]
+        if n != len(self.t):
+            raise ValueError('Data arrays must have the length of the time '
+                             'axis (%i).' % len(self.t))
+        if norm:
+            data = kin_kit.normalized(data, alert=False)
+        else:
+            data = data / data.max()
+        self.data = data
+
+        self.irf_spectrum = np.fft.rfft(self._circular_irf())
+        if harmonics is None:
+            above = np.abs(self.irf_spectrum) > irf_cutoff
+            harmonics = len(above) if above.all() else np.argmin(above)
+        self.harmonics = K = max(int(harmonics), 2)
+
+        self.data_spectra = np.fft.rfft(data, axis=-1)[:, :K]
+        self.omega = 2 * np.pi * np.arange(K) / n
+        weights = np.full(K, 2.); weights[0] = 1
+        if K == n//2 + 1 and n % 2 == 0:
+            weights[-1] = 1
+        self.weights = weights / n
+
+    def _circular_irf(self):
+        # circular kernel equivalent to sim.lib.convolve_irf
+        irf = sim.lib.build_irf(self.t, **self.irf_args)
+        m = irf.size
+        h = np.zeros(self.n)
+        h[:m] = irf
+        return np.roll(h, -((m - 1) // 2))
+
+    def _fitted_spectra(self, pl, harmonics):
+        pl = kin_kit.make_2d(pl)
+        S = np.fft.rfft(pl, axis=-1)[:, :harmonics] \
+            * self.irf_spectrum[:harmonics]
+        K = self.harmonics
+        Sk = S[:, :K]
+
+        # shared shift maximizing the correlation with the data
+        rownorm = np.sqrt(np.sum(self.weights * np.abs(Sk)**2, axis=-1))
+        rownorm[rownorm == 0] = 1
+        cross = np.sum(self.data_spectra * np.conj(Sk)
+                       / rownorm[:, np.newaxis], axis=0)
+        steps = _cross_spectrum_peak(cross, self.n)
+        omega = 2 * np.pi * np.arange(S.shape[-1]) / self.n
+        S = S * np.exp(-1j * omega * steps)
+        Sk = S[:, :K]
+
+        # least-squares amplitude(s)
+        num = np.real(self.weights * self.data_spectra * np.conj(Sk))
+        den = self.weights * np.abs(Sk)**2
+        if self.norm:
+            den = den.sum(axis=-1)
+            den[den == 0] = 1
+            amp = num.sum(axis=-1) / den
+        else:
+            amp = np.full(len(S), num.sum() / max(den.sum(), 1e-300))
+        return S * amp[:, np.newaxis], steps
+
+    def diffs(self, pl):
+        """
+        Returns the weighted real and imaginary parts of the difference
+        between the data spectra and the fitted simulation spectra, as a
+        flat array. `pl` is the unconvolved simulated PL, with the shape of
+        the data.
+        """
+        if np.all(pl == 0):
+            return np.ones(2 * self.data_spectra.size) * 1e20
+        S, steps = self._fitted_spectra(pl, self.harmonics)
+        resid = (self.data_spectra - S) * np.sqrt(self.weights)
+        return np.concatenate((resid.real, resid.imag), axis=-1).flatten()
+
+    def cost(self, pl):
+        """
+        Returns the band-limited sum of squared differences between data and
+        simulation.
+        """
+        return np.sum(self.diffs(pl)**2)
+
+    def aligned(self, pl):
+        """
+        Returns the data and the IRF-convolved, shifted and scaled simulation
+        in the time domain, on the time axis of the data, for plotting and
+        saving. Unlike the cost, the simulation is not band-limited.
+
+        Returns
+        -------
+        data : array
+            Normalized data arrays.
+        sims : array
+            Simulated arrays matched to the data.
+        shift : float
+            Time by which the simulation was shifted forward.
+        """
+        S, steps = self._fitted_spectra(pl, self.n//2 + 1)
+        sims = np.fft.irfft(S, n=self.n, axis=-1)
+        data = self.data
+        if self.ndim == 1:
+            data, sims = data[0], sims[0]
+        return data, sims, steps * (self.t[1] - self.t[0])
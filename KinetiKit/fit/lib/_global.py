@@ -0,0 +1,303 @@
+"""
+Global fitting of several datasets with shared parameters
+
+Some parameters of a model are often common to several samples, temperatures
+or excitation conditions (shared parameters), while others differ from one
+dataset to the next (local parameters). A global fit refines all of them in a
+single least-squares problem. Residuals of a dataset depend only on the shared
+parameters and on its own local parameters, so the Jacobian is block-sparse:
+finite differences perturb the local parameters of all datasets at once, and
+a Jacobian costs as many simulations of each dataset as a separate fit would.
+Datasets are independent and are simulated in parallel.
+
+"""
+import copy
+import time
+import concurrent.futures
+
+import numpy as np
+import scipy as sp
+import scipy.optimize
+import scipy.sparse
+
+from ._lib import simulate_and_compare, sac_args
+
+__all__ = ['GlobalFitter']
+
+# datasets of the worker processes, set once by the pool initializer
+_datasets = None
+
+
+def _initialize(datasets):
+    global _datasets
+    _datasets = datasets
+
+
+def _residuals(dataset, values):
+    keys, args = dataset
+    return np.asarray(simulate_and_compare(values, keys, *args), dtype=float)
+
+
+def _worker_residuals(index, values):
+    return _residuals(_datasets[index], values)
+
+
+class GlobalFitter(object):
+    """
+    Fits several datasets at once, with parameters shared by all datasets
+    and parameters that are fitted separately for each dataset.
+
+    Parameters
+    ----------
+    shared : dictionary
+        (lower, upper) bounds of the shared parameters.
+    local : dictionary
+        Default (lower, upper) bounds of the per-dataset parameters; they may
+        be overridden for a dataset in ``add``.
+
+    Optional Parameters
+    -------------------
+    workers : integer
+        Number of datasets simulated in parallel. Default is 1 (serial).
+    executor : 'process' or 'thread'
+        Parallelize over processes (the datasets are sent once to each
+        process) or threads. Default is 'process'.
+
+    Example
+    -------
+    >>> gf = GlobalFitter(shared={'k_ann': (1e8, 1e10)},
+    ...                   local={'k_dis': (1e7, 1e9)}, workers=4)
+    >>> for system, data in zip(systems, traces):
+    ...     gf.add(system, data, to, light, irf_args=irf_args)
+    >>> result = gf.fit()
+    >>> result['shared']['k_ann'], result['local'][0]['k_dis']
+    """
+
+    def __init__(self, shared, local, workers=1, executor='process'):
+        if executor not in ('process', 'thread'):
+            raise ValueError('executor must be "process" or "thread".')
+        overlap = set(shared) & set(local)
+        if overlap:
+            raise ValueError('Parameters cannot be both shared and local: %s'
+                             % ', '.join(sorted(overlap)))
+        self.shared = dict(shared)
+        self.local = dict(local)
+        self.workers = workers
+        self.executor = executor
+        self.datasets = []
+
+    def add(self, system, data_arrays, to, light=None, bounds=None, name=None,
+            **kwargs):
+        """
+        Adds a dataset to the fit.
+
+        Parameters
+        ----------
+        system : object
+            System simulating the dataset; a copy is made, so the same object
+            may be passed for all datasets. Its parameter values are the
+            starting point of the fit.
+        data_arrays : array, list of 1D arrays, DataSet or FourierComparison
+            Experimental data, as in ``simulate_and_compare``.
+        to : dictionary
+            Dictionary with time parameters.
+        light : object
+            Excitation object, or None for a ``FunctionModel``.
+
+        Optional Parameters
+        -------------------
+        bounds : dictionary or None
+            Bounds of some local parameters for this dataset, replacing the
+            default bounds.
+        name : string or None
+            Label of the dataset in the results. Default is its index.
+        **kwargs
+            Other arguments of ``simulate_and_compare`` (`powers`, `irf_args`,
+            `comparison`, `limits`, etc.).
+
+        Returns
+        -------
+        index : integer
+            Index of the dataset.
+        """
+        bounds = dict(self.local, **(bounds or {}))
+        unknown = set(bounds) - set(self.local)
+        if unknown:
+            raise ValueError('Unknown local parameters: %s'
+                             % ', '.join(sorted(unknown)))
+        kwargs.update(condensed_output=False, verbose=False)
+        # a dictionary, since dict_keys cannot be sent to worker processes
+        keys = dict.fromkeys(list(self.shared) + list(self.local))
+        args = sac_args(keys, copy.deepcopy(system), data_arrays, to, light,
+                        **kwargs)[1:]
+        index = len(self.datasets)
+        self.datasets.append({'name': index if name is None else name,
+                              'keys': keys,
+                              'args': args,
+                              'bounds': bounds,
+                              'system': args[0]})
+        return index
+
+    # Parameter vector: shared parameters, then one block of local
+    # parameters per dataset.
+
+    def _split(self, x):
+        S, L = len(self.shared), len(self.local)
+        return [np.concatenate((x[:S], x[S + i*L:S + (i+1)*L]))
+                for i in range(len(self.datasets))]
+
+    def initial(self):
+        """
+        Returns the starting parameter vector, from the parameters of the
+        systems of the datasets (shared parameters from the first dataset).
+        """
+        first = self.datasets[0]['system'].params()
+        x0 = [first[key] for key in self.shared]
+        for dataset in self.datasets:
+            params = dataset['system'].params()
+            x0 += [params[key] for key in self.local]
+        return np.array(x0, dtype=float)
+
+    def bounds(self):
+        """
+        Returns the (lower, upper) arrays of bounds of the parameter vector.
+        """
+        limits = list(self.shared.values())
+        for dataset in self.datasets:
+            limits += [dataset['bounds'][key] for key in self.local]
+        return tuple(np.array(limits, dtype=float).T)
+
+    def sparsity(self):
+        """
+        Returns the sparsity structure of the Jacobian, a sparse matrix with
+        one row per residual and one column per fitted parameter.
+        """
+        S, L = len(self.shared), len(self.local)
+        sizes = [len(_residuals((d['keys'], d['args']), values))
+                 for d, values in zip(self.datasets,
+                                      self._split(self.initial()))]
+        structure = sp.sparse.lil_matrix((sum(sizes),
+                                          S + L*len(self.datasets)), dtype=int)
+        start = 0
+        for i, size in enumerate(sizes):
+            structure[start:start + size, :S] = 1
+            structure[start:start + size, S + i*L:S + (i+1)*L] = 1
+            start += size
+        return structure.tocsr(), sizes
+
+    def fit(self, x0=None, sparse=True, **kwargs):
+        """
+        Fits all datasets with ``scipy.optimize.least_squares``.
+
+        Optional Parameters
+        -------------------
+        x0 : array or None
+            Starting parameter vector (see ``initial``). Default is None
+            (parameters of the systems).
+        sparse : boolean
+            Whether the block-sparse structure of the Jacobian is passed to
+            the optimizer. Default is True; False treats the problem as dense,
+            which costs one simulation of every dataset per parameter.
+        **kwargs
+            Arguments of ``least_squares`` (`ftol`, `xtol`, `max_nfev`,
+            `loss`, etc.). The method is 'trf' and `x_scale` defaults to
+            'jac'.
+
+        Returns
+        -------
+        results : dictionary
+            'shared': dictionary of shared parameters,
+            'local': list of dictionaries of local parameters per dataset,
+            'shared_errors' and 'local_errors': corresponding standard errors,
+            'names': names of the datasets,
+            'residuals': list of residual arrays per dataset,
+            'cost': sum of squared residuals,
+            'nfev': number of evaluations of all datasets, including those of
+            the Jacobian,
+            'x', 'success', 'message' and 'time' (seconds).
+        """
+        if not self.datasets:
+            raise ValueError('No datasets to fit.')
+        if x0 is None:
+            x0 = self.initial()
+        lower, upper = self.bounds()
+        x0 = np.clip(np.asarray(x0, dtype=float), lower, upper)
+        structure, sizes = self.sparsity()
+        kwargs.setdefault('x_scale', 'jac')
+
+        pool = None
+        if self.workers > 1:
+            if self.executor == 'process':
+                pool = concurrent.futures.ProcessPoolExecutor(
+                    self.workers, initializer=_initialize,
+                    initargs=([(d['keys'], d['args'])
+                               for d in self.datasets],))
+            else:
+                pool = concurrent.futures.ThreadPoolExecutor(self.workers)
+        evaluations = [0]
+
+        def residuals(x):
+            evaluations[0] += 1
+            blocks = self._split(x)
+            if pool is None:
+                diffs = [_residuals((d['keys'], d['args']), values)
+                         for d, values in zip(self.datasets, blocks)]
+            elif self.executor == 'process':
+                diffs = list(pool.map(_worker_residuals,
+                                      range(len(blocks)), blocks))
+            else:
+                diffs = list(pool.map(_residuals,
+                                      [(d['keys'], d['args'])
+                                       for d in self.datasets], blocks))
+            return np.concatenate(diffs)
+
+        time_start = time.time()
+        try:
+            result = sp.optimize.least_squares(
+                residuals, x0, bounds=(lower, upper), method='trf',
+                jac_sparsity=structure if sparse else None, **kwargs)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+        elapsed = time.time() - time_start
+
+        errors = self._errors(result.jac, result.fun, len(x0))
+        S, L = len(self.shared), len(self.local)
+        shared = dict(zip(self.shared, result.x[:S]))
+        shared_errors = dict(zip(self.shared, errors[:S]))
+        local, local_errors = [], []
+        for i, dataset in enumerate(self.datasets):
+            values = result.x[S + i*L:S + (i+1)*L]
+            local.append(dict(zip(self.local, values)))
+            local_errors.append(dict(zip(self.local,
+                                         errors[S + i*L:S + (i+1)*L])))
+            dataset['system'].update(**shared, **local[-1])
+        bounds = np.cumsum([0] + sizes)
+
+        return {'shared': shared,
+                'local': local,
+                'shared_errors': shared_errors,
+                'local_errors': local_errors,
+                'names': [dataset['name'] for dataset in self.datasets],
+                'residuals': [result.fun[bounds[i]:bounds[i+1]]
+                              for i in range(len(sizes))],
+                'cost': np.sum(result.fun**2),
+                'nfev': evaluations[0],
+                'x': result.x,
+                'success': result.success,
+                'message': result.message,
+                'time': elapsed,
+                }
+
+    @staticmethod
+    def _errors(jac, fun, n):
+        # standard errors from the covariance (J^T J)^-1 s^2, as fit_leastsq
+        if sp.sparse.issparse(jac):
+            jtj = (jac.T @ jac).toarray()
+        else:
+            jtj = jac.T @ jac
+        if len(fun) <= n:
+            return np.full(n, np.inf)
+        s_sq = np.sum(fun**2) / (len(fun) - n)
+        covariance = np.linalg.pinv(jtj) * s_sq
+        return np.sqrt(np.abs(np.diag(covariance)))
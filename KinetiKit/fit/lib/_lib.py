@@ -12,6 +12,8 @@ from KinetiKit import sim
 from KinetiKit.units import units, ps
 from KinetiKit.settings import settings, counter
 import KinetiKit.kit as kin_kit
+from KinetiKit.data.lib import DataSet
+from ._fourier import FourierComparison
 
 
 def elementwise_diff(data_arrays, sim_arrays, norm=True, comparison='linear',
@@ -57,9 +59,8 @@ def elementwise_diff(data_arrays, sim_arrays, norm=True, comparison='linear',
     
     alert=False
     if norm:
-        for i, array in enumerate(data_arrays):
-            data_arrays = kin_kit.normalized(data_arrays, alert)
-            sim_arrays = kin_kit.normalized(sim_arrays, alert)
+        data_arrays = kin_kit.normalized(data_arrays, alert)
+        sim_arrays = kin_kit.normalized(sim_arrays, alert)
 
     if absolute==False:
         diffs = abs( data_arrays[np.where(data_arrays !=0)] 
@@ -131,10 +132,13 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
         been created previously in the code with dummy or guess parameters. It
         is then redefined with different parameters every time the 
         ``simulate_and_compare`` function is called.
-    data_list : array or list of 1D arrays
-        Array or list of 1D arrays containing experimental data to be compared 
-        to the simulation. The output of ``system.PLsig`` must have the same 
-        shape as `data_list`.
+    data_list : array or list of 1D arrays, DataSet, or FourierComparison
+        Array or list of 1D arrays, or ``data.lib.DataSet``, containing 
+        experimental data to be compared to the simulation. The output of ``system.PLsig`` must have the same 
+        shape as `data_list`. If a ``FourierComparison`` instance, data and
+        simulation are compared on the harmonics of the repetition rate, and
+        the `irf_args`, alignment and comparison arguments of this function 
+        are ignored (see ``FourierComparison``).
     to : dictionary
         Dictionary with time parameters. 
     light : object
@@ -163,12 +167,16 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
         with respect to itself. If false, all simulation and data traces are
         normalized by the simulation and data trace corresponding 
         to the highest power, respectively.
-    roll_criterion : string, 'steep' or 'max'
+    roll_criterion : string, 'steep', 'max' or 'xcorr'
         Determines whether the alignment of the two arrays happens by their 
-        maximum or their steepest point. Default is 'max'
+        maximum or their steepest point. With 'xcorr', the data are aligned by
+        their maximum and the simulation is then shifted onto the data by the
+        (sub-point) shift that maximizes their cross-correlation, see
+        ``KinetiKit.kit.find_shift``. This makes the cost a smooth function of
+        the parameters even on coarse time axes. Default is 'max'
     maxavgnum : integer
-        If `roll_criterion` is `"max"`, maxavgnum determines the `avgnum` 
-        keyword in ``KinetiKit.kit.align_by_max().``
+        If `roll_criterion` is `"max"` or `"xcorr"`, maxavgnum determines the
+        `avgnum` keyword in ``KinetiKit.kit.align_by_max().``
     verbose : boolean
         Whether to print the cost function at the end of each iteration. 
         
@@ -183,6 +191,9 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
         Aligned simulation arrays.
     """
     
+    if isinstance(data_arrays, DataSet):
+        data_arrays = data_arrays.y
+    
     param_dict = kin_kit.dict_from_list(varparams, varparamkeys)
     system.update(**param_dict)
     # print(system.params())
@@ -199,8 +210,6 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
     
     if system.populations is None:
         pl, converged = sim.lib.simulate_func(system, dtime)
-        sim_arrays = sim.lib.convolve_irf(pl, dtime, 
-                                          irf_args)
     
     else:
         if powers is None:
@@ -208,8 +217,6 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
             transient, converged = sim.lib.refined_simulation(system, to, light,
                                                           N_coarse=N_coarse)
             pl = system.PLsig(transient)
-            sim_arrays = sim.lib.convolve_irf(pl, dtime, 
-                                         irf_args)
             #sim_arrays /= max(sim_arrays)
             #data_arrays /= max(data_arrays)
             
@@ -230,9 +237,17 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
                     pl = pl_at_this_power
                 else:
                     pl = np.vstack((pl, pl_at_this_power)) 
-            sim_arrays = sim.lib.convolve_irf(pl, dtime, 
-                                          irf_args)    
     
+    if isinstance(data_arrays, FourierComparison):
+        # IRF, alignment and residual are evaluated on the data harmonics
+        diffs = data_arrays.diffs(pl)
+        if condensed_output:
+            if verbose:
+                print(np.sum(diffs**2))
+            return np.sum(diffs**2)
+        return diffs
+    
+    sim_arrays = sim.lib.convolve_irf(pl, dtime, irf_args)
     
     if roll_criterion == 'max':
         al_data_arrays = kin_kit.align_by_max(data_arrays, 
@@ -256,8 +271,18 @@ light, powers=None, which='pulse', irf_args={'fwhm':55 * ps}, N_coarse=500,
                                                 avgnum = maxavgnum,
                                                 value=roll_value)
         
+    elif roll_criterion == 'xcorr':
+        al_data_arrays = kin_kit.align_by_max(data_arrays, 
+                                           dtime, 
+                                           avgnum = maxavgnum,
+                                           value = roll_value)
+        shift = kin_kit.find_shift(kin_kit.normalized(al_data_arrays, False),
+                                   kin_kit.normalized(sim_arrays, False),
+                                   dtime)
+        al_sim_arrays = kin_kit.fractional_roll(sim_arrays, dtime, shift)
+        
     else: 
-        print('Roll_criterion must be max or steep.')
+        print('Roll_criterion must be max, steep or xcorr.')
     
     sim_arrays = kin_kit.make_2d(sim_arrays)
     data_arrays = kin_kit.make_2d(data_arrays)
@@ -323,4 +348,5 @@ def fit_leastsq(function, p0, args):
           error.append( 0.00 )
     pfit_leastsq = pfit
     perr_leastsq = np.array(error) 
+    infodict['message'], infodict['ier'] = errmsg, success
     return pfit_leastsq, perr_leastsq, infodict
\ No newline at end of file
@@ -0,0 +1,245 @@
+"""
+Phasor analysis
+
+The phasor of a decay is its normalized Fourier coefficient at a harmonic of
+the laser repetition rate, ``g + i s = sum(y exp(i n w t)) / sum(y)``, which
+is computed for any number of traces (or FLIM pixels) by one matrix product.
+Single-exponential decays lie on the universal semicircle and mixtures
+inside it, so phasors screen whole datasets for their lifetimes without any
+fitting. Phasors are returned as complex arrays (``g = phasor.real``,
+``s = phasor.imag``).
+
+"""
+import numpy as np
+import scipy as sp
+import scipy.cluster.vq
+
+from KinetiKit import sim
+
+__all__ = ['phasor', 'phasor_calibration', 'phasor_lifetimes',
+           'phasor_clusters']
+
+
+def _traces(data, t):
+    # (time axis, traces) of data objects, datasets or arrays
+    if hasattr(data, 'x') and hasattr(data, 'y'):
+        return np.asarray(data.x, dtype=float), np.asarray(data.y, dtype=float)
+    if isinstance(t, dict):
+        t = t['array'][::t['subsample']]
+    if t is None:
+        raise ValueError('A time axis must be given with data arrays.')
+    return np.asarray(t, dtype=float), np.asarray(data, dtype=float)
+
+
+def phasor(data, t=None, period=None, harmonic=1, calibration=None):
+    """
+    Returns the phasors of one or many decays.
+
+    Parameters
+    ----------
+    data : array, data object or DataSet
+        Decay(s), with time along the last axis: a trace, a 2-D array of
+        traces, a FLIM cube, or objects with `x` and `y` attributes (e.g.
+        ``data.lib.data_from_SPCM`` or ``data.lib.DataSet``). Dark counts
+        should be subtracted beforehand.
+
+    Optional Parameters
+    -------------------
+    t : 1-D array, dictionary of the type ``sim.time.linear()`` or None
+        Time axis of array data, in seconds. Ignored for data objects.
+    period : float or None
+        Laser repetition period, in seconds. Default is None, in which case
+        `t['period']` is used for a time dictionary, and otherwise the span
+        of the time axis plus one step.
+    harmonic : integer or list of integers
+        Harmonic(s) of the repetition rate. Default is 1. For a list, the
+        phasors of the harmonics are stacked along a trailing axis.
+    calibration : complex or array or None
+        Instrument calibration, see ``phasor_calibration``. Default is None
+        (raw phasors).
+
+    Returns
+    -------
+    phasors : complex array
+        One phasor per trace (per pixel for cubes).
+    """
+    if period is None and isinstance(t, dict):
+        period = t['period']
+    t, y = _traces(data, t)
+    if period is None:
+        period = t[-1] - t[0] + (t[1] - t[0])
+
+    harmonics = np.atleast_1d(harmonic)
+    # one column of exponentials per harmonic
+    kernel = np.exp(2j * np.pi * np.outer(t - t[0], harmonics) / period)
+    total = y.sum(axis=-1)[..., np.newaxis]
+    with np.errstate(invalid='ignore'):
+        phasors = (y @ kernel) / np.where(total != 0, total, np.nan)
+    if calibration is not None:
+        phasors = phasors * calibration
+    if np.ndim(harmonic) == 0:
+        phasors = phasors[..., 0]
+    return phasors
+
+
+def phasor_calibration(reference=None, t=None, period=None, harmonic=1,
+                       tau_ref=0, irf_args=None, onset=0):
+    """
+    Returns the complex factor that corrects raw phasors for the instrument
+    response and for the arbitrary time origin of the data, so that
+    ``phasor(data, ..., calibration=factor)`` gives the phasors of the pure
+    decays.
+
+    The factor rotates and scales the phasor of a reference of known
+    lifetime onto the universal semicircle. The reference can be a measured
+    decay of a standard with lifetime `tau_ref`, a measured IRF (with
+    `tau_ref` = 0), or a simulated IRF (`irf_args`) centered at `onset`.
+
+    Parameters
+    ----------
+    reference : array, data object or None
+        Measured reference trace, with the time axis and origin of the data.
+    t, period, harmonic
+        See ``phasor``.
+    tau_ref : float
+        Lifetime of the reference, in seconds. Default is 0 (an IRF).
+    irf_args : dictionary or None
+        Arguments of ``sim.lib.build_irf``, used instead of `reference`.
+    onset : float
+        Time of the center of the simulated IRF in the data, in seconds.
+        Default is 0.
+
+    Returns
+    -------
+    calibration : complex or complex array
+        One factor per harmonic.
+    """
+    if reference is None:
+        if irf_args is None:
+            raise ValueError('Either a reference or irf_args must be given.')
+        if isinstance(t, dict):
+            if period is None:
+                period = t['period']
+            t = t['array'][::t['subsample']]
+        irf = sim.lib.build_irf(t, **irf_args)
+        m = irf.size
+        reference = np.zeros(len(t))
+        reference[:m] = irf
+        dt = t[1] - t[0]
+        reference = np.roll(reference, -((m - 1) // 2) + int(round(onset / dt)))
+    measured = phasor(reference, t=t, period=period, harmonic=harmonic)
+    if period is None:
+        if isinstance(t, dict):
+            period = t['period']
+        else:
+            x = _traces(reference, t)[0]
+            period = x[-1] - x[0] + (x[1] - x[0])
+    omega = 2 * np.pi * np.asarray(harmonic) / period
+    expected = 1 / (1 - 1j * omega * tau_ref)
+    return expected / measured
+
+
+def phasor_lifetimes(phasors, period, harmonic=1):
+    """
+    Returns the apparent lifetimes of calibrated phasors: the phase lifetime
+    ``tan(phi) / w`` and the modulation lifetime ``sqrt(1/m**2 - 1) / w``.
+    Both equal the lifetime of a single-exponential decay; for mixtures of
+    exponentials, the phase lifetime is shorter than the modulation lifetime
+    and both lie between the shortest and longest component.
+
+    Parameters
+    ----------
+    phasors : complex array
+        Calibrated phasors.
+    period : float
+        Laser repetition period, in seconds.
+    harmonic : integer
+        Harmonic of the phasors. Default is 1.
+
+    Returns
+    -------
+    tau_phase, tau_mod : arrays
+        Lifetimes in seconds (NaN where undefined).
+    """
+    omega = 2 * np.pi * harmonic / period
+    phasors = np.asarray(phasors)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        tau_phase = phasors.imag / phasors.real / omega
+        modulation = np.abs(phasors)
+        tau_mod = np.sqrt(1 / modulation**2 - 1) / omega
+    tau_phase = np.where(tau_phase >= 0, tau_phase, np.nan)
+    return tau_phase, tau_mod
+
+
+def phasor_clusters(phasors, n_clusters, period, harmonic=1, widen=2.,
+                    percentiles=(5, 95), seed=None):
+    """
+    Groups phasors into clusters by k-means and returns, for each cluster, a
+    lifetime range that can seed the bounds of a fit.
+
+    Parameters
+    ----------
+    phasors : complex array
+        Calibrated phasors, of any shape (e.g. one per FLIM pixel). NaN
+        phasors (e.g. empty traces) are not assigned to any cluster.
+    n_clusters : integer
+        Number of clusters.
+    period : float
+        Laser repetition period, in seconds.
+
+    Optional Parameters
+    -------------------
+    harmonic : integer
+        Harmonic of the phasors. Default is 1.
+    widen : float
+        Factor by which the lifetime range of each cluster is widened on each
+        side. Default is 2.
+    percentiles : tuple of 2 floats
+        Percentiles of the phase and modulation lifetimes of the members that
+        define the range. Default is (5, 95).
+    seed : integer or None
+        Seed of the k-means initialization.
+
+    Returns
+    -------
+    labels : integer array
+        Cluster of each phasor, with the shape of `phasors` (-1 for NaN).
+    clusters : list of dictionaries
+        Sorted by lifetime, with 'center' (complex phasor), 'size' (number of
+        members), 'tau_phase' and 'tau_mod' (lifetimes of the center), and
+        'bounds', a (lower, upper) range of lifetimes in seconds: the lower
+        percentile of the phase lifetimes divided by `widen`, and the upper
+        percentile of the modulation lifetimes multiplied by `widen`.
+    """
+    phasors = np.asarray(phasors)
+    flat = phasors.ravel()
+    valid = np.isfinite(flat)
+    points = np.column_stack((flat.real[valid], flat.imag[valid]))
+    centers, found = sp.cluster.vq.kmeans2(points, n_clusters, minit='++',
+                                           seed=seed)
+
+    centers = centers[:, 0] + 1j * centers[:, 1]
+    tau_phase, tau_mod = phasor_lifetimes(flat[valid], period, harmonic)
+    center_phase, center_mod = phasor_lifetimes(centers, period, harmonic)
+    # relabel clusters by increasing lifetime
+    order = np.argsort(np.nan_to_num(center_phase, nan=np.inf))
+    rank = np.empty_like(order); rank[order] = np.arange(len(order))
+
+    clusters = []
+    for k in order:
+        members = found == k
+        if members.any():
+            lower = np.nanpercentile(tau_phase[members], percentiles[0])
+            upper = np.nanpercentile(tau_mod[members], percentiles[1])
+            bounds = (lower / widen, upper * widen)
+        else:
+            bounds = (np.nan, np.nan)
+        clusters.append({'center': centers[k],
+                         'size': int(members.sum()),
+                         'tau_phase': center_phase[k],
+                         'tau_mod': center_mod[k],
+                         'bounds': bounds})
+
+    labels = np.full(flat.shape, -1)
+    labels[valid] = rank[found]
+    return labels.reshape(phasors.shape), clusters
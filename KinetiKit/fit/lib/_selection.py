@@ -0,0 +1,213 @@
+"""
+Comparison of candidate models fitted to the same data
+
+The data are loaded, dark-subtracted, preprocessed and interpolated once,
+then every candidate model is fitted to them concurrently on a process pool.
+Models are ranked by the Akaike and Bayesian information criteria, computed
+from the residuals of the best fits, and reported with their reduced chi
+squared, timings and convergence diagnostics.
+
+"""
+import time
+import concurrent.futures
+
+import numpy as np
+
+from KinetiKit import data
+from KinetiKit.data.lib import DataSet
+from ._autofit import _fit_arrays
+
+__all__ = ['compare_models', 'information_criteria']
+
+
+def information_criteria(cost, n, k):
+    """
+    Returns the information criteria of a least-squares fit with Gaussian
+    residuals of unknown variance.
+
+    Parameters
+    ----------
+    cost : float
+        Sum of squared residuals.
+    n : integer
+        Number of residuals.
+    k : integer
+        Number of fitted parameters.
+
+    Returns
+    -------
+    criteria : dictionary
+        'aic' (Akaike), 'aicc' (Akaike corrected for small samples), 'bic'
+        (Bayesian) and 'chi2_red' (cost per degree of freedom).
+    """
+    log_likelihood = n * np.log(cost / n) if cost > 0 else -np.inf
+    dof = n - k
+    return {'aic': log_likelihood + 2*k,
+            'aicc': log_likelihood + 2*k
+                    + (2*k*(k + 1) / (dof - 1) if dof > 1 else np.inf),
+            'bic': log_likelihood + k*np.log(n),
+            'chi2_red': cost / dof if dof > 0 else np.inf,
+            }
+
+
+def _prepare_data(source, to, load_args={}, dark=None, preprocess=None):
+    # loads and preprocesses the data once for all models
+    if isinstance(source, str):
+        source = data.lib.data_from_SPCM(source, **load_args)
+        if dark is not None:
+            source.dark_subtract(dark)
+        if preprocess is not None:
+            preprocess(source)
+        source.interp(to)
+        return source.y
+    if isinstance(source, DataSet):
+        return source.y
+    if hasattr(source, 'interp'):
+        source.interp(to)
+        return source.y
+    return np.asarray(source, dtype=float)
+
+
+def _model_task(name, model, data_arrays, to):
+    # runs in the worker processes
+    time_start = time.time()
+    bounds = model['bounds']
+    fit = _fit_arrays(data_arrays, model['system'], bounds, to,
+                      model['light'], model.get('p0'), model['sac_kwargs'],
+                      model['method'], model['fit_args'], residuals=True)
+    n, k = np.size(fit.pop('residuals')), len(bounds)
+    at_bounds = [key for key, (lower, upper) in bounds.items()
+                 if np.isclose(fit['params'][key], lower, rtol=1e-3, atol=0)
+                 or np.isclose(fit['params'][key], upper, rtol=1e-3, atol=0)]
+    return dict(fit, name=name,
+                model=getattr(model['system'], 'class_name',
+                              type(model['system']).__name__),
+                n=n, k=k, at_bounds=at_bounds,
+                time=time.time() - time_start,
+                **information_criteria(fit['cost'], n, k))
+
+
+def compare_models(source, models, to, light=None, load_args={}, dark=None,
+                   preprocess=None, sac_kwargs={}, method='DE', fit_args={},
+                   workers=None, verbose=True):
+    """
+    Fits several candidate models to the same data and ranks them by their
+    information criteria.
+
+    Parameters
+    ----------
+    source : string, data object, DataSet or array
+        Data file (loaded with ``data.lib.data_from_SPCM``), data object
+        (interpolated onto `to`), DataSet or array(s) of traces on the time
+        axis of `to`.
+    models : dictionary
+        Candidate models by name. Each is a dictionary with a 'system'
+        (e.g. ``sim.systems.MonoRecX()``) and the 'bounds' of its varied
+        parameters, and optionally 'p0', 'light', 'sac_kwargs', 'method' and
+        'fit_args', which replace the common arguments below.
+    to : dictionary
+        Dictionary with time parameters.
+
+    Optional Parameters
+    -------------------
+    light : object
+        Excitation object, see ``simulate_and_compare``.
+    load_args, dark, preprocess :
+        Used once to load a data file, as in ``fit_file``.
+    sac_kwargs : dictionary
+        Keyword arguments of ``sac_args`` (e.g. `irf_args`, `roll_criterion`).
+    method : 'DE', 'surrogate' or 'LS'
+        Fitting method, see ``fit_file``. Default is 'DE'.
+    fit_args : dictionary
+        Keyword arguments of ``fit_DE`` or ``fit_surrogate``.
+    workers : integer or None
+        Number of worker processes. Default is None, i.e. the number of CPUs;
+        0 fits the models one after the other in the current process.
+    verbose : boolean
+        Whether the ranking is printed. Default is True.
+
+    Returns
+    -------
+    comparison : dictionary
+        'results': list of fit results sorted by increasing AIC, each with
+        the 'name' and 'model' class, 'params', 'errors', 'cost', number of
+        residuals 'n' and parameters 'k', 'aic', 'aicc', 'bic', 'chi2_red',
+        'delta_aic', 'delta_bic', Akaike 'weight', 'nfev', 'nit', 'time',
+        'success', 'message' and 'at_bounds' (parameters at a bound);
+        'errors': list of (name, message) of failed fits;
+        'best': name of the model with the lowest AIC;
+        'prep_time' and 'time': seconds spent preparing the data and in
+        total.
+    """
+    time_start = time.time()
+    data_arrays = _prepare_data(source, to, load_args, dark, preprocess)
+    prep_time = time.time() - time_start
+
+    tasks = {}
+    for name, model in models.items():
+        model = dict(model)
+        if 'system' not in model or 'bounds' not in model:
+            raise ValueError('Model %s needs a system and bounds.' % name)
+        model.setdefault('light', light)
+        model.setdefault('sac_kwargs', sac_kwargs)
+        model.setdefault('method', method)
+        model.setdefault('fit_args', fit_args)
+        tasks[name] = model
+
+    results, errors = [], []
+    def collect(name, future):
+        try:
+            results.append(future.result())
+        except Exception as error:
+            errors.append((name, str(error)))
+            if verbose:
+                print('Fit of %s failed: %s' % (name, error))
+
+    if workers == 0:
+        for name, model in tasks.items():
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(_model_task(name, model, data_arrays, to))
+            except Exception as error:
+                future.set_exception(error)
+            collect(name, future)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+            futures = {pool.submit(_model_task, name, model, data_arrays,
+                                   to): name
+                       for name, model in tasks.items()}
+            for future in concurrent.futures.as_completed(futures):
+                collect(futures[future], future)
+
+    results.sort(key=lambda result: result['aic'])
+    if results:
+        aic_min, bic_min = results[0]['aic'], min(r['bic'] for r in results)
+        weights = np.exp(-0.5 * np.array([r['aic'] - aic_min
+                                          for r in results]))
+        for result, weight in zip(results, weights / weights.sum()):
+            result['delta_aic'] = result['aic'] - aic_min
+            result['delta_bic'] = result['bic'] - bic_min
+            result['weight'] = weight
+
+    comparison = {'results': results,
+                  'errors': errors,
+                  'best': results[0]['name'] if results else None,
+                  'prep_time': prep_time,
+                  'time': time.time() - time_start,
+                  }
+    if verbose:
+        _print_comparison(comparison)
+    return comparison
+
+
+def _print_comparison(comparison):
+    print('%-16s %3s %10s %10s %8s %10s %6s %8s %6s'
+          % ('model', 'k', 'dAIC', 'dBIC', 'weight', 'chi2_red', 'nfev',
+             'time', 'ok'))
+    for r in comparison['results']:
+        print('%-16s %3i %10.2f %10.2f %8.3f %10.3e %6i %7.1fs %6s'
+              % (r['name'][:16], r['k'], r['delta_aic'], r['delta_bic'],
+                 r['weight'], r['chi2_red'], r['nfev'], r['time'],
+                 'yes' if r['success'] and not r['at_bounds'] else 'no'))
+    print('Best model: %s (%.1f s in total, %.2f s preparing the data)'
+          % (comparison['best'], comparison['time'], comparison['prep_time']))
@@ -0,0 +1,633 @@
+"""
+Local fit-job service
+
+A small server (standard library only) through which several users of one
+analysis machine share a fixed pool of worker processes. Jobs are described
+as in the job files of ``kinetikit-fit`` (see ``load_jobs``), sent as JSON
+over HTTP on a TCP port or a UNIX socket, and fitted file by file in order
+of priority. Queued and running jobs can be cancelled, and the progress of
+differential-evolution fits and their results are streamed to the client.
+
+Requests
+--------
+GET /status : workers, queued and running fits.
+GET /jobs : summaries of all jobs.
+POST /jobs : submits the job in the body, with an optional 'priority' entry
+    (higher first; default 0). Returns the job 'id'.
+GET /jobs/<id> : status and results of a job.
+GET /jobs/<id>/events?since=<n> : events of a job from the n-th on, streamed
+    as one JSON object per line until the job is finished.
+DELETE /jobs/<id> : cancels a job.
+
+"""
+import os
+import sys
+import json
+import time
+import heapq
+import socket
+import argparse
+import threading
+import http.client
+import http.server
+import socketserver
+import multiprocessing
+import urllib.parse
+import concurrent.futures
+
+import numpy as np
+
+from KinetiKit import kit
+from ._batch import _prepare_job, _check_remote, _fit_task, _record
+
+__all__ = ['FitService', 'FitClient']
+
+
+def _plain(value):
+    # JSON-compatible version of results
+    if isinstance(value, dict):
+        return {str(key): _plain(val) for key, val in value.items()}
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return [_plain(val) for val in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _outside(root, paths):
+    # paths that resolve (following links) to outside the root directory
+    root = os.path.realpath(root)
+    return [path for path in paths
+            if os.path.commonpath([root, os.path.realpath(path)]) != root]
+
+
+def _service_task(job, filename, tag, stop, events):
+    # runs in a worker process; reports the generations of DE fits and stops
+    # them when the job is cancelled
+    def callback(result):
+        events.put((tag, int(result.nit), float(result.fun)))
+    job = dict(job, fit=dict(job['fit'], stop=stop, callback=callback))
+    return _fit_task(job, filename)
+
+
+class _Job(object):
+
+    def __init__(self, job_id, spec, priority):
+        self.id = job_id
+        self.spec = spec
+        self.priority = priority
+        self.created = time.time()
+        self.queued = len(spec['files'])
+        self.running = {}
+        self.results = []
+        self.errors = []
+        self.cancelled = False
+        self.events = []
+
+    def event(self, kind, **entries):
+        self.events.append(dict(entries, type=kind, time=time.time()))
+
+    @property
+    def finished(self):
+        return self.queued == 0 and not self.running
+
+    def summary(self, results=False):
+        if not self.finished:
+            status = 'running' if self.running else 'queued'
+        else:
+            status = 'cancelled' if self.cancelled else 'done'
+        summary = {'id': self.id,
+                   'name': self.spec['name'],
+                   'status': status,
+                   'priority': self.priority,
+                   'created': self.created,
+                   'total': len(self.spec['files']),
+                   'done': len(self.results),
+                   'failed': len(self.errors),
+                   'running': sorted(self.running),
+                   'queued': self.queued,
+                   }
+        if results:
+            summary['results'] = self.results
+            summary['errors'] = self.errors
+        return summary
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+
+    def address_string(self):
+        # UNIX sockets have no client address
+        return str(self.client_address[0]) if self.client_address else 'local'
+
+    def log_message(self, format, *args):
+        if self.server.service.verbose:
+            super().log_message(format, *args)
+
+    def _send(self, content, code=200):
+        body = json.dumps(_plain(content)).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _route(self):
+        url = urllib.parse.urlparse(self.path)
+        parts = [part for part in url.path.split('/') if part]
+        query = urllib.parse.parse_qs(url.query)
+        job_id = None
+        if len(parts) >= 2 and parts[0] == 'jobs':
+            try:
+                job_id = int(parts[1])
+            except ValueError:
+                pass
+        return parts, query, job_id
+
+    def do_GET(self):
+        service = self.server.service
+        parts, query, job_id = self._route()
+        if parts == ['status']:
+            self._send(service.info())
+        elif parts == ['jobs']:
+            self._send(service.jobs())
+        elif len(parts) == 2 and job_id is not None:
+            status = service.status(job_id)
+            if status is None:
+                self._send({'error': 'No job %i.' % job_id}, 404)
+            else:
+                self._send(status)
+        elif len(parts) == 3 and parts[2] == 'events' \
+                and job_id in service._jobs:
+            self._stream(service, job_id, int(query.get('since', [0])[0]))
+        else:
+            self._send({'error': 'Not found.'}, 404)
+
+    def _stream(self, service, job_id, since):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for event in service.events(job_id, since):
+                self.wfile.write(json.dumps(_plain(event)).encode() + b'\n')
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # the client stopped listening
+            pass
+        self.close_connection = True
+
+    def do_POST(self):
+        parts, query, job_id = self._route()
+        if parts != ['jobs']:
+            self._send({'error': 'Not found.'}, 404)
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            spec = json.loads(self.rfile.read(length) or b'{}')
+            priority = spec.pop('priority', 0)
+            job_id = self.server.service.submit(spec, priority)
+        except (ValueError, KeyError, TypeError) as error:
+            self._send({'error': str(error)}, 400)
+            return
+        self._send({'id': job_id}, 201)
+
+    def do_DELETE(self):
+        parts, query, job_id = self._route()
+        if len(parts) != 2 or job_id is None \
+                or not self.server.service.cancel(job_id):
+            self._send({'error': 'Not found.'}, 404)
+            return
+        self._send(self.server.service.status(job_id, results=False))
+
+
+class _TCPServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _UnixServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class FitService(object):
+    """
+    Serves fit jobs on a fixed pool of worker processes.
+
+    Each job is split into one fit per data file. Fits are queued by job
+    priority (higher first, then in order of submission) and started when a
+    worker is free, so that a high-priority job overtakes queued fits of
+    earlier jobs but never interrupts running ones. Results are kept in
+    memory, and optionally appended to per-job CSV files and a results
+    store, as with ``run_jobs``.
+
+    Parameters
+    ----------
+    address : tuple or string
+        (host, port) on which the service listens over HTTP, or the path of
+        a UNIX socket. Port 0 picks a free port (see `address` after
+        ``start``). Default is ('127.0.0.1', 8765), i.e. local users only.
+
+    Optional Parameters
+    -------------------
+    workers : integer
+        Number of worker processes. Default is 2.
+    root : string
+        Directory relative to which the data patterns and dark files of jobs
+        are resolved. Jobs reading files outside of it are refused. Default
+        is the current directory.
+    output : string or None
+        Results directory, see ``run_jobs``. Default is None.
+    store : string or None
+        Results store, see ``run_jobs``. Default is None.
+    verbose : boolean
+        Whether requests are logged. Default is False.
+    """
+
+    def __init__(self, address=('127.0.0.1', 8765), workers=2, root='.',
+                 output=None, store=None, verbose=False):
+        self.address = address
+        self.workers = workers
+        self.root = os.path.abspath(root)
+        self.output = output
+        self.store = kit.ResultStore(store) if store is not None else None
+        self.verbose = verbose
+        if output is not None and not os.path.exists(output):
+            os.makedirs(output)
+
+        self._jobs = {}
+        self._queue = []
+        self._count = 0
+        self._running = 0
+        self._closed = False
+        self._changed = threading.Condition()
+        self._server = None
+
+    def start(self):
+        """
+        Starts the worker pool and serves requests in a background thread.
+        """
+        self._manager = multiprocessing.Manager()
+        self._progress = self._manager.Queue()
+        self._pool = concurrent.futures.ProcessPoolExecutor(self.workers)
+        if isinstance(self.address, str):
+            if os.path.exists(self.address):
+                os.remove(self.address)
+            self._server = _UnixServer(self.address, _Handler)
+        else:
+            self._server = _TCPServer(tuple(self.address), _Handler)
+            self.address = self._server.server_address[:2]
+        self._server.service = self
+        self._threads = [threading.Thread(target=self._server.serve_forever,
+                                          daemon=True),
+                         threading.Thread(target=self._drain, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Cancels all jobs, waits for the running fits to stop and shuts the
+        service down.
+        """
+        for job_id in list(self._jobs):
+            self.cancel(job_id)
+        with self._changed:
+            self._closed = True
+            self._changed.notify_all()
+        self._pool.shutdown(wait=True)
+        self._server.shutdown()
+        self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self._manager.shutdown()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        if self.store is not None:
+            self.store.close()
+
+    def submit(self, spec, priority=0):
+        """
+        Queues a job, given as a dictionary of the entries of a job file, and
+        returns its id. Raises ValueError if its data or dark files are
+        outside of `root`, if its name is not a plain file name, or if it
+        sets options that reach the file system of the service (e.g.
+        'checkpoint' in 'fit' or 'cache_dir' in 'load').
+        """
+        with self._changed:
+            if self._closed:
+                raise ValueError('The service is stopped.')
+            self._count += 1
+            job = _Job(self._count, _prepare_job(spec, {}, self.root,
+                                                 'job%i' % self._count),
+                       priority)
+            if not job.spec['files']:
+                raise ValueError('No data files match %s.'
+                                 % job.spec.get('data'))
+            dark = job.spec.get('dark', {}).get('file')
+            outside = _outside(self.root, job.spec['files']
+                               + ([dark] if dark is not None else []))
+            if outside:
+                raise ValueError('Files outside of the root directory: %s.'
+                                 % ', '.join(outside))
+            _check_remote(job.spec)
+            # the name is that of the results file in the output directory
+            name = job.spec['name']
+            if not isinstance(name, str) or name in ('', '.', '..') \
+                    or os.path.basename(name) != name \
+                    or (self.output is not None and _outside(
+                        self.output,
+                        [os.path.join(self.output, name + '_results.csv')])):
+                raise ValueError('Invalid job name %r.' % (name,))
+            self._jobs[job.id] = job
+            for filename in job.spec['files']:
+                heapq.heappush(self._queue, (-priority, job.id, filename))
+            job.event('queued', files=len(job.spec['files']))
+            self._changed.notify_all()
+        self._dispatch()
+        return job.id
+
+    def cancel(self, job_id):
+        """
+        Cancels the queued fits of a job and stops its running DE fits after
+        their current generation. Returns False for an unknown job.
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            if not job.finished:
+                job.cancelled = True
+                job.queued = 0
+                self._queue = [entry for entry in self._queue
+                               if entry[1] != job_id]
+                heapq.heapify(self._queue)
+                for stop in job.running.values():
+                    stop.set()
+                job.event('cancelled')
+                self._finish(job)
+            return True
+
+    def _finish(self, job):
+        if job.finished:
+            job.event('finished', status=job.summary()['status'])
+        self._changed.notify_all()
+
+    def _dispatch(self):
+        with self._changed:
+            while self._queue and self._running < self.workers \
+                    and not self._closed:
+                priority, job_id, filename = heapq.heappop(self._queue)
+                job = self._jobs[job_id]
+                stop = self._manager.Event()
+                future = self._pool.submit(_service_task, job.spec, filename,
+                                           (job_id, filename), stop,
+                                           self._progress)
+                job.queued -= 1
+                job.running[filename] = stop
+                self._running += 1
+                job.event('started', file=filename)
+                future.add_done_callback(
+                    lambda future, job=job, filename=filename:
+                    self._collect(job, filename, future))
+
+    def _collect(self, job, filename, future):
+        try:
+            result, error = future.result(), None
+        except Exception as exception:
+            result, error = None, str(exception)
+        with self._changed:
+            job.running.pop(filename)
+            self._running -= 1
+            if job.cancelled:
+                job.event('stopped', file=filename)
+            elif error is not None:
+                job.errors.append({'file': filename, 'error': error})
+                job.event('error', file=filename, error=error)
+            else:
+                result = _plain(result)
+                job.results.append(result)
+                job.event('result', file=filename, result=result)
+            self._finish(job)
+        if result is not None and not job.cancelled:
+            _record(job.spec, result, self.output, self.store)
+        self._dispatch()
+
+    def _drain(self):
+        # moves the progress of the workers into the events of the jobs
+        while not self._closed:
+            try:
+                (job_id, filename), nit, fun = self._progress.get(timeout=0.1)
+            except Exception:
+                continue
+            with self._changed:
+                self._jobs[job_id].event('progress', file=filename, nit=nit,
+                                         fun=fun)
+                self._changed.notify_all()
+
+    def events(self, job_id, since=0):
+        """
+        Yields the events of a job from the `since`-th on, waiting for new
+        ones until the job is finished.
+        """
+        job = self._jobs[job_id]
+        while True:
+            with self._changed:
+                self._changed.wait_for(lambda: len(job.events) > since
+                                       or job.finished or self._closed,
+                                       timeout=1)
+                new = job.events[since:]
+                done = job.finished or self._closed
+            for event in new:
+                yield event
+            since += len(new)
+            if done and not new:
+                return
+
+    def status(self, job_id, results=True):
+        """
+        Returns the status of a job, with its results and errors, or None
+        for an unknown job.
+        """
+        with self._changed:
+            job = self._jobs.get(job_id)
+            return None if job is None else job.summary(results)
+
+    def jobs(self):
+        """
+        Returns the summaries of all jobs.
+        """
+        with self._changed:
+            return [job.summary() for job in self._jobs.values()]
+
+    def info(self):
+        """
+        Returns the number of workers and of running and queued fits.
+        """
+        with self._changed:
+            return {'workers': self.workers, 'running': self._running,
+                    'queued': len(self._queue), 'jobs': len(self._jobs)}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _UnixConnection(http.client.HTTPConnection):
+
+    def __init__(self, path, timeout=None):
+        super().__init__('localhost', timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+
+class FitClient(object):
+    """
+    Client of a ``FitService``.
+
+    Parameters
+    ----------
+    address : tuple or string
+        (host, port) of the service, or the path of its UNIX socket.
+    timeout : float or None
+        Timeout of the connections in seconds. Default is None.
+    """
+
+    def __init__(self, address=('127.0.0.1', 8765), timeout=None):
+        self.address = address
+        self.timeout = timeout
+
+    def _connection(self):
+        if isinstance(self.address, str):
+            return _UnixConnection(self.address, self.timeout)
+        host, port = self.address
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    def _request(self, method, path, content=None):
+        connection = self._connection()
+        try:
+            body = None if content is None else json.dumps(content)
+            headers = {} if body is None \
+                else {'Content-Type': 'application/json'}
+            connection.request(method, path, body, headers)
+            response = connection.getresponse()
+            reply = json.loads(response.read())
+        finally:
+            connection.close()
+        if response.status >= 400:
+            raise ValueError(reply.get('error', response.reason))
+        return reply
+
+    def submit(self, job, priority=0):
+        """
+        Submits a job (a dictionary of the entries of a job file) and returns
+        its id.
+        """
+        return self._request('POST', '/jobs',
+                             dict(job, priority=priority))['id']
+
+    def status(self, job_id):
+        """
+        Returns the status of a job, with its results.
+        """
+        return self._request('GET', '/jobs/%i' % job_id)
+
+    def jobs(self):
+        """
+        Returns the summaries of all jobs.
+        """
+        return self._request('GET', '/jobs')
+
+    def info(self):
+        """
+        Returns the number of workers and of running and queued fits.
+        """
+        return self._request('GET', '/status')
+
+    def cancel(self, job_id):
+        """
+        Cancels a job and returns its status.
+        """
+        return self._request('DELETE', '/jobs/%i' % job_id)
+
+    def events(self, job_id, since=0):
+        """
+        Yields the events of a job ('queued', 'started', 'progress',
+        'result', 'error', 'cancelled', 'stopped', 'finished') as they occur,
+        until the job is finished.
+        """
+        connection = self._connection()
+        try:
+            connection.request('GET', '/jobs/%i/events?since=%i'
+                               % (job_id, since))
+            response = connection.getresponse()
+            if response.status >= 400:
+                raise ValueError(json.loads(response.read())['error'])
+            for line in response:
+                if line.strip():
+                    yield json.loads(line)
+        finally:
+            connection.close()
+
+    def wait(self, job_id):
+        """
+        Waits until a job is finished and returns its status.
+        """
+        for event in self.events(job_id):
+            pass
+        return self.status(job_id)
+
+
+def main(argv=None):
+    """
+    Entry point of the ``kinetikit-serve`` command.
+    """
+    parser = argparse.ArgumentParser(
+        prog='kinetikit-serve',
+        description='Serves fit jobs on a local pool of worker processes.')
+    parser.add_argument('--host', default='127.0.0.1',
+                        help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('-p', '--port', type=int, default=8765,
+                        help='port to listen on (default: 8765)')
+    parser.add_argument('--socket', default=None,
+                        help='UNIX socket to listen on instead of a port')
+    parser.add_argument('-w', '--workers', type=int,
+                        default=os.cpu_count() or 1,
+                        help='number of worker processes (default: number '
+                             'of CPUs)')
+    parser.add_argument('--root', default='.',
+                        help='directory of the data patterns of the jobs')
+    parser.add_argument('-o', '--output', default=None,
+                        help='results directory')
+    parser.add_argument('-s', '--store', default=None,
+                        help='SQLite results store')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help='log the requests')
+    args = parser.parse_args(argv)
+
+    address = args.socket if args.socket else (args.host, args.port)
+    service = FitService(address, workers=args.workers, root=args.root,
+                         output=args.output, store=args.store,
+                         verbose=args.verbose)
+    service.start()
+    print('Serving fit jobs on %s with %i workers.'
+          % (address if args.socket else '%s:%i' % service.address,
+             args.workers))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        print('Stopping.')
+    finally:
+        service.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,363 @@
+"""
+Surrogate-assisted global optimization
+
+When each evaluation of the cost requires slow simulations (e.g. of models
+with traps), a Gaussian process is fitted to the costs evaluated so far and
+new parameters are chosen where the expected improvement of the cost is
+largest, so that few evaluations are spent in poor regions of the parameter
+space. The surrogate is built in a unit cube of the parameters, with
+logarithmic axes for parameters whose bounds span orders of magnitude, and
+models the logarithm of the cost offset by its median. Parameters are
+proposed in batches (by the "kriging believer" heuristic), which are
+evaluated in parallel.
+
+"""
+import time
+import concurrent.futures
+
+import numpy as np
+import scipy as sp
+import scipy.linalg
+import scipy.optimize
+import scipy.stats
+
+__all__ = ['fit_surrogate']
+
+
+class _Objective(object):
+    # picklable func(x, *args), for worker processes
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+
+    def __call__(self, x):
+        return float(self.func(x, *self.args))
+
+
+def _matern(A, B, lengths):
+    # Matern 5/2 correlation between the rows of A and B
+    diff = (A[:, None, :] - B[None, :, :]) / lengths
+    r = np.sqrt(5 * np.sum(diff**2, axis=-1))
+    return (1 + r + r**2 / 3) * np.exp(-r)
+
+
+class _GaussianProcess(object):
+    """
+    Gaussian process with a constant mean and an anisotropic Matern 5/2
+    kernel, whose length scales and noise are fitted by maximizing the
+    marginal likelihood (with the signal variance profiled out).
+    """
+
+    bounds = (np.log(1e-2), np.log(1e1)), (np.log(1e-8), np.log(1e-3))
+
+    def __init__(self, X, y, theta=None, rng=None, restarts=2, start=None):
+        self.X, self.y = np.array(X), np.array(y)
+        self.mean = np.mean(self.y)
+        self.scale = np.std(self.y) if np.std(self.y) > 0 else 1.
+        dim = self.X.shape[1]
+        if theta is None:
+            theta = self._optimize(dim, rng, restarts, start)
+        self.theta = theta
+        self._factorize()
+
+    def _likelihood(self, theta):
+        # negative concentrated log-likelihood
+        lengths, noise = np.exp(theta[:-1]), np.exp(theta[-1])
+        z = (self.y - self.mean) / self.scale
+        K = _matern(self.X, self.X, lengths) + (noise + 1e-10) \
+            * np.eye(len(z))
+        try:
+            L = np.linalg.cholesky(K)
+        except np.linalg.LinAlgError:
+            return 1e10
+        alpha = sp.linalg.cho_solve((L, True), z)
+        variance = max(z @ alpha / len(z), 1e-300)
+        return 0.5 * len(z) * np.log(variance) + np.sum(np.log(np.diag(L)))
+
+    def _optimize(self, dim, rng, restarts, start=None):
+        # from `start` (e.g. the previous kernel parameters), a default and
+        # random starting points
+        (lo_l, hi_l), (lo_n, hi_n) = self.bounds
+        bounds = [(lo_l, hi_l)] * dim + [(lo_n, hi_n)]
+        starts = [np.append(np.full(dim, np.log(0.3)), np.log(1e-5))]
+        if start is not None:
+            starts.append(start)
+        rng = np.random.default_rng(rng)
+        for i in range(restarts):
+            starts.append(np.append(rng.uniform(lo_l, hi_l, dim),
+                                    rng.uniform(lo_n, hi_n)))
+        best = None
+        for start in starts:
+            opt = sp.optimize.minimize(self._likelihood, start,
+                                       method='L-BFGS-B', bounds=bounds)
+            if best is None or opt.fun < best.fun:
+                best = opt
+        return best.x
+
+    def _factorize(self):
+        lengths, noise = np.exp(self.theta[:-1]), np.exp(self.theta[-1])
+        z = (self.y - self.mean) / self.scale
+        K = _matern(self.X, self.X, lengths) + (noise + 1e-10) \
+            * np.eye(len(z))
+        self._L = np.linalg.cholesky(K)
+        self._alpha = sp.linalg.cho_solve((self._L, True), z)
+        self._variance = max(z @ self._alpha / len(z), 1e-300)
+
+    def predict(self, Xs):
+        """
+        Returns the mean and standard deviation of the process at Xs.
+        """
+        Ks = _matern(np.atleast_2d(Xs), self.X, np.exp(self.theta[:-1]))
+        mean = self.mean + self.scale * (Ks @ self._alpha)
+        v = sp.linalg.solve_triangular(self._L, Ks.T, lower=True)
+        var = self._variance * np.clip(1 - np.sum(v**2, axis=0), 1e-12, None)
+        return mean, self.scale * np.sqrt(var)
+
+    def conditioned(self, x, y):
+        """
+        Returns the process with an additional observation, keeping the
+        kernel parameters.
+        """
+        return _GaussianProcess(np.vstack((self.X, x)), np.append(self.y, y),
+                                self.theta)
+
+
+def _expected_improvement(gp, X, best, xi):
+    mean, std = gp.predict(X)
+    improvement = best - mean - xi
+    z = improvement / std
+    return improvement * sp.stats.norm.cdf(z) + std * sp.stats.norm.pdf(z)
+
+
+def _propose(gp, best, xi, rng, n_candidates=2000, n_starts=5):
+    # point of largest expected improvement, from random candidates and
+    # perturbations of the best points, refined by L-BFGS-B
+    dim = gp.X.shape[1]
+    top = gp.X[np.argsort(gp.y)[:5]]
+    candidates = np.vstack((
+        rng.uniform(size=(n_candidates, dim)),
+        np.clip(np.repeat(top, n_candidates // 10, axis=0)
+                + rng.normal(0, 0.05, (len(top) * (n_candidates // 10), dim)),
+                0, 1)))
+    ei = _expected_improvement(gp, candidates, best, xi)
+    proposal, value = candidates[np.argmax(ei)], np.max(ei)
+    for start in candidates[np.argsort(ei)[-n_starts:]]:
+        opt = sp.optimize.minimize(
+            lambda x: -_expected_improvement(gp, x[None, :], best, xi)[0],
+            start, method='L-BFGS-B', bounds=[(0, 1)] * dim)
+        if -opt.fun > value:
+            proposal, value = opt.x, -opt.fun
+    return proposal, value
+
+
+def _exploit(gp):
+    # minimum of the surrogate mean, started from the best points
+    dim = gp.X.shape[1]
+    proposal, value = None, np.inf
+    for start in gp.X[np.argsort(gp.y)[:3]]:
+        opt = sp.optimize.minimize(lambda x: gp.predict(x[None, :])[0][0],
+                                   start, method='L-BFGS-B',
+                                   bounds=[(0, 1)] * dim)
+        if opt.fun < value:
+            proposal, value = opt.x, opt.fun
+    return proposal
+
+
+def fit_surrogate(func, bounds, args=(), x0=None, max_nfev=200, batch=4,
+                  n_init=None, log='auto', workers=1, seed=None, xi=0.01,
+                  tol=1e-6, polish=True, budget=None, stop=None,
+                  callback=None):
+    """
+    Minimizes `func` with a Gaussian-process surrogate of its cost, as an
+    alternative to ``fit_DE`` that needs far fewer evaluations of slow cost
+    functions.
+
+    The cost is first evaluated on a Latin hypercube of `n_init` points.
+    The surrogate is then refitted after each batch of `batch` parameter
+    sets, chosen by maximizing the expected improvement over the best cost
+    (one of them minimizes the surrogate instead, to refine the best
+    solution), and the batch is evaluated in parallel.
+
+    Parameters
+    ----------
+    func : function
+        Cost function, called as ``func(x, *args)``, e.g.
+        ``simulate_and_compare``.
+    bounds : sequence or dictionary
+        (lower, upper) bounds of the parameters, or a dictionary of them as
+        in the FitRates examples.
+
+    Optional Parameters
+    -------------------
+    args : tuple
+        Extra arguments of `func`, e.g. the output of ``sac_args``.
+    x0 : array or None
+        Parameters evaluated with the initial design, e.g. a previous fit.
+    max_nfev : integer
+        Maximum number of evaluations of the surrogate search, not counting
+        the polishing. Default is 200.
+    batch : integer
+        Number of parameter sets proposed and evaluated together. Default
+        is 4.
+    n_init : integer or None
+        Number of points of the initial design. Default is None, i.e.
+        ``max(4 * dimensions, 2 * batch)``.
+    log : 'auto' or sequence of booleans
+        Which parameters are searched on a logarithmic axis. With 'auto',
+        those whose positive bounds span more than a decade. Default is
+        'auto'.
+    workers : integer or map-like function
+        Number of processes evaluating a batch in parallel (`func` and
+        `args` must then be picklable, e.g. ``sac_args`` with a dictionary
+        rather than ``dict.keys()`` of parameter names), or a map function
+        such as ``pool.map``. Default is 1 (serial).
+    seed : integer or None
+        Seed of the random number generator.
+    xi : float
+        Margin of the expected improvement, in units of the modelled
+        logarithm of the cost; larger values favour exploration. Default is
+        0.01.
+    tol : float
+        The search stops when the largest expected improvement falls below
+        `tol`. Default is 1e-6.
+    polish : boolean
+        Whether the best solution is refined with L-BFGS-B at the end.
+        Default is True.
+    budget : float or None
+        Wall-clock budget of the search in seconds; no new batch is started
+        when it is exceeded. Default is None.
+    stop : threading.Event, function or None
+        Checked before each batch; if set (or if ``stop()`` returns True),
+        the search returns the best solution found so far without
+        polishing, with `success` False. Used to preempt long fits, as in
+        ``fit_DE``.
+    callback : function or None
+        Called as ``callback(result)`` after each batch with the
+        intermediate result; the search stops if it returns True.
+
+    Returns
+    -------
+    result : OptimizeResult
+        With the best parameters 'x' and cost 'fun', 'nfev', the number of
+        batches 'nit', 'success', 'message', all evaluated parameters
+        'X' and costs 'costs', and the 'elapsed' time in seconds.
+    """
+    time_start = time.time()
+    if isinstance(bounds, dict):
+        bounds = list(bounds.values())
+    lower, upper = np.array(bounds, dtype=float).T
+    dim = len(lower)
+    if isinstance(log, str):
+        if log != 'auto':
+            raise ValueError('log must be "auto" or a sequence of booleans.')
+        log = (lower > 0) & (upper > 10 * lower)
+    log = np.asarray(log, dtype=bool)
+    lo = np.where(log, np.log(np.where(log, lower, 1)), lower)
+    hi = np.where(log, np.log(np.where(log, upper, 1)), upper)
+
+    def to_params(u):
+        v = lo + np.asarray(u) * (hi - lo)
+        return np.where(log, np.exp(v), v)
+
+    def to_unit(x):
+        x = np.clip(np.asarray(x, dtype=float), lower, upper)
+        v = np.where(log, np.log(np.where(log, x, 1)), x)
+        return (v - lo) / (hi - lo)
+
+    rng = np.random.default_rng(seed)
+    objective = _Objective(func, args)
+    pool = None
+    if callable(workers):
+        evaluate = workers
+    elif workers > 1:
+        pool = concurrent.futures.ProcessPoolExecutor(workers)
+        evaluate = pool.map
+    else:
+        evaluate = map
+
+    U, costs = [], []
+    def run(points):
+        U.extend(points)
+        costs.extend(evaluate(objective, [to_params(u) for u in points]))
+
+    def targets():
+        # log(cost + median cost) compresses the poor regions, while the
+        # basin of the minimum stays smooth; failed simulations get the
+        # worst cost
+        c = np.array(costs, dtype=float)
+        finite = np.isfinite(c)
+        worst = np.max(c[finite]) if finite.any() else 1.
+        c = np.where(finite, c, worst)
+        return np.log(c + max(np.median(c), 1e-300))
+
+    def intermediate(message='in progress', success=True):
+        best = int(np.argmin(np.where(np.isfinite(costs), costs, np.inf)))
+        return sp.optimize.OptimizeResult(
+            x=to_params(U[best]), fun=costs[best], nfev=len(costs), nit=nit,
+            success=success, message=message, X=np.array([to_params(u)
+                                                          for u in U]),
+            costs=np.array(costs), elapsed=time.time() - time_start)
+
+    if n_init is None:
+        n_init = max(4 * dim, 2 * batch)
+    n_init = min(n_init, max_nfev)
+    design = sp.stats.qmc.LatinHypercube(d=dim, seed=rng).random(n_init)
+    if x0 is not None:
+        design[0] = to_unit(x0)
+
+    nit, theta = 0, None
+    message, success = 'Maximum number of evaluations reached.', True
+    preempted = False
+    try:
+        run(list(design))
+        while len(costs) < max_nfev:
+            if stop is not None and (stop.is_set() if hasattr(stop, 'is_set')
+                                     else stop()):
+                message, success, preempted = 'Preempted.', False, True
+                break
+            if budget is not None and time.time() - time_start > budget:
+                message, success = 'Time budget exhausted.', False
+                break
+            y = targets()
+            gp = _GaussianProcess(np.array(U), y, rng=rng, start=theta)
+            theta = gp.theta
+            best = np.min(y)
+            proposals, largest = [], None
+            size = min(batch, max_nfev - len(costs))
+            # one point of each batch (every other batch of 1) refines the
+            # minimum of the surrogate
+            exploit = (size > 1 or nit % 2 == 1)
+            if exploit:
+                proposal = _exploit(gp)
+                if np.min(np.linalg.norm(gp.X - proposal, axis=1)) > 1e-6:
+                    proposals.append(proposal)
+            while len(proposals) < size:
+                proposal, value = _propose(gp, best, xi, rng)
+                largest = value if largest is None else largest
+                proposals.append(proposal)
+                # believe the surrogate at the proposal for the next ones
+                gp = gp.conditioned(proposal, gp.predict(proposal)[0][0])
+            if largest is not None and largest < tol:
+                message = 'Expected improvement below tolerance.'
+                break
+            run(proposals)
+            nit += 1
+            if callback is not None and callback(intermediate()):
+                message = 'callback function requested stop early'
+                success = False
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    result = intermediate(message, success)
+    if polish and not preempted:
+        polished = sp.optimize.minimize(
+            lambda u: objective(to_params(u)), to_unit(result.x),
+            method='L-BFGS-B', bounds=[(0, 1)] * dim,
+            options={'maxfun': 20 * dim})
+        result.nfev += polished.nfev
+        if polished.fun < result.fun:
+            result.x, result.fun = to_params(polished.x), polished.fun
+        result.elapsed = time.time() - time_start
+    return result
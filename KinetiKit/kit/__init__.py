@@ -5,6 +5,7 @@ from ._mathfuncs import *
 from ._alignment import *
 from ._savetools import *
 from ._readtools import *
+from ._store import *
 from ._ald import *
 from ._displaying import *
 
@@ -17,11 +18,16 @@ __all__ = ['Gauss',
            'dict_from_list',
            'dict_to_csv',
            'find_nearest',
+           'find_shift',
+           'fractional_roll',
            'list_to_array',
+           'npz_to_dict',
            'normalized',
            'precision',
            'printparamsexp',
            'roll_by_array_shift',
+           'ResultStore',
            'find_baseline',
            'save_fit',
-           'traces_to_csv']
\ No newline at end of file
+           'traces_to_csv',
+           'traces_to_npz']
\ No newline at end of file
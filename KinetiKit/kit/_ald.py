@@ -55,11 +55,16 @@ def list_to_array(listorarray):
 
  
 def make_2d(array):
+    """
+    Returns a 2-D view of `array` whose rows run along its last axis: 1-D 
+    arrays become a single row, and all leading (batch) axes of arrays with 
+    more than two dimensions are flattened into rows.
+    """
     array = list_to_array(array)
-    if len(array.shape) ==1:
-        return(np.reshape(array, (1,len(array))))
-    elif len(array.shape) > 2:
-        return np.concatenate(array)
+    if array.ndim == 1:
+        return array[np.newaxis]
+    elif array.ndim > 2:
+        return array.reshape(-1, array.shape[-1])
     else:
         return array
 
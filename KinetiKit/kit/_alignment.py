@@ -17,23 +17,28 @@ def find_nearest(array, value):
     ----------
     array : arr
         The array from which a value and index will be returned
-    value : float
-        The value that the returned element of `arr` will be nearest to
+    value : float or arr
+        The value that the returned element of `arr` will be nearest to. If
+        an array, the nearest element to each of its values is returned.
         
     Returns
     -------
-    idx : int
+    idx : int or arr of ints
         The index of `arr` corresponding to the nearest value to `value`
-    nearest_val : float
+    nearest_val : float or arr
         The nearest value of the array to `value`
     """
     
     array = np.asarray(array)
-    idx = (np.abs(array - value)).argmin()
-    nearest_val = array[idx]
+    if np.ndim(value) == 0:
+        idx = (np.abs(array - value)).argmin()
+    else:
+        idx = _nearest_indices(array.ravel(), value)
+    nearest_val = array.ravel()[idx]
     return idx, nearest_val
 
-def roll_by_array_shift(arrays, refarray, shift, direction='forward'):
+def roll_by_array_shift(arrays, refarray, shift, direction='forward',
+                        fractional=False):
     """
     Performs ``numpy.roll(arrays)`` by the same number of points that 
     correspond to a `shift` in a reference array (`refarray`).
@@ -53,12 +58,22 @@ def roll_by_array_shift(arrays, refarray, shift, direction='forward'):
         Desired shift in `refarray` values.
     direction : str, 'forward' or 'back'
         Determines the direction of rolling. Default is 'forward.'
+    fractional : boolean
+        If True, `arrays` are shifted by exactly `shift` with
+        ``fractional_roll`` instead of by the nearest whole number of points.
+        Default is False.
     
     Returns
     -------
     rolled_array : arr
         Shifted array
     """
+    if fractional:
+        if direction not in ['forward', 'back']:
+            raise ValueError('Direction must be \'forward\' or \'back\'.')
+        sign = 1 if direction == 'forward' else -1
+        return fractional_roll(arrays, refarray, sign*shift)
+    
     rolled_arrays = arrays.copy()
     
     offset = shift + refarray[0]
@@ -74,7 +89,8 @@ def roll_by_array_shift(arrays, refarray, shift, direction='forward'):
     return rolled_arrays
 
  
-def align_by_max(arrays, refarray_x, refarray_y=None, avgnum=1, value=0):
+def align_by_max(arrays, refarray_x, refarray_y=None, avgnum=1, value=0,
+                 per_row=False, fractional=False):
     """
     Determines how many indices refarray_y must be rolled by so that its max.
     region aligns with `value` in `refarray_x', and then rolls each array in 
@@ -102,47 +118,39 @@ def align_by_max(arrays, refarray_x, refarray_y=None, avgnum=1, value=0):
     value : float
         Default is zero. If the exact value does not exist in `refarray_x`, 
         then the nearest value on the array will be chosen.
+    per_row : boolean
+        If True, each row of a 2-D `arrays` is aligned by its own maximum 
+        region and `refarray_y` is ignored. Default is False, in which case
+        all rows are rolled by the shift of the shared reference.
+    fractional : boolean
+        If True, the average position of the maxima is moved exactly onto 
+        `value` with ``fractional_roll``, instead of rolling by a whole number
+        of points. Default is False.
     
     Returns
     -------
     rolled_arrays : list of arrays or 2D array
         Set of aligned arrays.
     """
-    rolled_arrays = arrays.copy()
-    
+    arrays = np.asarray(arrays)
+    refarray_x = np.asarray(refarray_x)
+    refarray_y = _reference(arrays, refarray_y, per_row)
     if refarray_y is None:
-        if rolled_arrays.ndim == 2:
-            refarray_y = rolled_arrays[0].copy()
-        elif rolled_arrays.ndim == 1:
-            refarray_y = rolled_arrays.copy()
-        else: 
-            print('Function only accepts 1D and 2D arrays.')
-            #issue_error
-            return
-    
-    sacrificial = refarray_y.copy()
-    refvalues_of_maxes = np.array([])
-        
-    for i in range(0,avgnum):
-        current_max = sacrificial.max()
-        max_idx = np.where(refarray_y==current_max)[0][0]
-        current_refvalue = refarray_x[max_idx]
-        refvalues_of_maxes = np.append(refvalues_of_maxes, [current_refvalue])
-        sacrificial[np.where(sacrificial==current_max)[0][0]] = -sys.maxsize
-        
-    avg_ref_value = np.average(refvalues_of_maxes)
-    max_idx = find_nearest(refarray_x, avg_ref_value)[0]
+        return
+    
+    max_idxs = _max_indices(refarray_y, avgnum)
+    avg_ref_value = np.average(refarray_x[max_idxs], axis=-1)
+    if fractional:
+        return fractional_roll(arrays, refarray_x, value - avg_ref_value)
+    max_idx = _nearest_indices(refarray_x, avg_ref_value)
         
     val_idx, val = find_nearest(refarray_x, value)
-        
-    shift_idx = int(max_idx - val_idx)
-    
-    rolled_arrays = np.roll(rolled_arrays, -shift_idx, axis=-1)
     
-    return rolled_arrays
+    return _roll_rows(arrays, max_idx - val_idx)
 
 
-def align_by_steep(arrays, refarray_x, refarray_y=None, avgnum=3, value=0):
+def align_by_steep(arrays, refarray_x, refarray_y=None, avgnum=3, value=0,
+                   per_row=False, fractional=False):
     """
     Analogous function to  ``align_by_max``: Rolls each array in `arrays` by 
     the index required to align the steepest region of `refarray_y` with a 
@@ -162,55 +170,243 @@ def align_by_steep(arrays, refarray_x, refarray_y=None, avgnum=3, value=0):
     value : float
         Default is zero. If the exact value does not exist in `refarray_x`, 
         then the nearest value on the array will be chosen.
+    per_row : boolean
+        If True, each row of a 2-D `arrays` is aligned by its own steepest 
+        region and `refarray_y` is ignored. Default is False.
+    fractional : boolean
+        If True, the steepest point is located between samples by a parabolic
+        fit and moved exactly onto `value` with ``fractional_roll``. Default 
+        is False.
     
     Returns
     -------
     rolled_arrays : list of arrays or 2D array
         Set of aligned arrays.
     """
-     
-    rolled_arrays = arrays.copy()
-    
+    arrays = np.asarray(arrays)
+    refarray_y = _reference(arrays, refarray_y, per_row)
     if refarray_y is None:
-        if rolled_arrays.ndim == 2:
-            refarray_y = rolled_arrays[0].copy()
-        elif rolled_arrays.ndim == 1:
-            refarray_y = rolled_arrays.copy()
-        else: 
-            print('Function only accepts 1D and 2D arrays.')
-            #issue_error
-            return
-        
-    difs = np.zeros(len(refarray_y))
-    for i in range(len(refarray_y)-1):
-        difs[i] = refarray_y[i]-refarray_y[i-2*avgnum]
-    difs = np.roll(difs, -avgnum)
+        return
+    
+    # difference over 2*avgnum points, centered on each point
+    difs = refarray_y - np.roll(refarray_y, 2*avgnum, axis=-1)
+    difs[..., -1] = 0
+    difs = np.roll(difs, -avgnum, axis=-1)
     
-    steep_idx = np.argmax(difs)
+    steep_idx = np.argmax(difs, axis=-1)
+    if fractional:
+        steep_value = refarray_x[0] + (steep_idx + _parabolic_peak(difs, steep_idx)) \
+            * (refarray_x[1] - refarray_x[0])
+        return fractional_roll(arrays, refarray_x, value - steep_value)
     val_idx, val = find_nearest(refarray_x, value)
-    shift_idx = int(steep_idx - val_idx)
     
-    rolled_arrays = np.roll(rolled_arrays, -shift_idx, axis=-1)
-        
-    return rolled_arrays
+    return _roll_rows(arrays, steep_idx - val_idx)
     
 def find_baseline(y, avgnum=50):
     """
     Returns the baseline value of a time-resolved trace by assuming that the 
     baseline is also the least steep point.
+    
+    If `y` is 2-D, an array with the baseline of each row is returned.
     """
+    y = np.asarray(y)
     
-    diffs = np.zeros(len(y))
-    for i in range(len(y)-1):
-        for k in range(avgnum):
-            if k == 0:
-                total_diff = y[i]-y[i-1]
-            else:
-                new_diff = y[i-k] - y[i-k-1]
-                total_diff = total_diff + new_diff
-        avg_diff = total_diff/avgnum
-        diffs[i+1] = avg_diff
-        
-    i_min = np.argmin(diffs[diffs!=0])
-    # print(i_min, y[i_min])
-    return y[i_min]
+    # average of the last `avgnum` steps, i.e. (y[i] - y[i-avgnum]) / avgnum
+    i = np.arange(y.shape[-1] - 1)
+    diffs = np.zeros(y.shape)
+    diffs[..., 1:] = (y[..., i] - y[..., i - avgnum]) / avgnum
+    
+    # index among the non-zero differences, as in ``argmin(diffs[diffs!=0])``
+    nonzero = diffs != 0
+    i_min = np.argmin(np.where(nonzero, diffs, np.inf), axis=-1)
+    i_min = np.take_along_axis(np.cumsum(nonzero, axis=-1), 
+                               np.expand_dims(i_min, -1), axis=-1) - 1
+    return np.take_along_axis(y, i_min, axis=-1)[..., 0]
+
+
+def fractional_roll(arrays, refarray, shift, method='fourier'):
+    """
+    Shifts periodic arrays forward by `shift` in units of `refarray`, which 
+    need not be a whole number of points. Analogous to 
+    ``roll_by_array_shift``, but without rounding the shift to the grid.
+    
+    Assumes linear step size for `refarray` and that `arrays` span one period.
+    
+    Parameters
+    ----------
+    arrays : 1D or 2D array
+        Arrays whose values will be shifted.
+    refarray : 1D array
+        Array to whose values the `shift` pertains.
+    shift : float or 1D array
+        Desired shift in `refarray` values. Positive values shift forward. If
+        an array, each row of a 2-D `arrays` is shifted by its own value.
+    method : 'fourier' or 'linear'
+        'fourier' applies a phase ramp to the Fourier transform of the arrays
+        (band-limited interpolation); 'linear' interpolates linearly between
+        neighboring points. Default is 'fourier'.
+    
+    Returns
+    -------
+    rolled_arrays : arr
+        Shifted arrays.
+    """
+    arrays = np.asarray(arrays, dtype=float)
+    n = arrays.shape[-1]
+    steps = np.asarray(shift, dtype=float) / (refarray[1] - refarray[0])
+    if steps.ndim == 1:
+        steps = steps[:, np.newaxis]
+    
+    if method == 'fourier':
+        phase = np.exp(-2j * np.pi * np.fft.rfftfreq(n) * steps)
+        if n % 2 == 0: 
+            # the Nyquist component must remain real
+            phase[..., -1:] = np.cos(np.pi * steps)
+        spectrum = np.fft.rfft(arrays, axis=-1) * phase
+        return np.fft.irfft(spectrum, n=n, axis=-1)
+    elif method == 'linear':
+        idx = np.arange(n) - steps
+        lo = np.floor(idx)
+        frac = idx - lo
+        lo = np.broadcast_to(lo.astype(int) % n, arrays.shape)
+        hi = (lo + 1) % n
+        return (1 - frac) * np.take_along_axis(arrays, lo, axis=-1) \
+            + frac * np.take_along_axis(arrays, hi, axis=-1)
+    else:
+        raise ValueError('Method must be \'fourier\' or \'linear\'.')
+
+def find_shift(arrays, refarrays, refarray_x, newton_steps=3):
+    """
+    Returns the shift, in units of `refarray_x`, by which `refarrays` must be
+    moved forward (see ``fractional_roll``) to best overlap with `arrays`.
+    
+    The shift maximizes the circular cross-correlation of the two sets of
+    arrays, summed over rows. Because a circular shift preserves the norm of
+    `refarrays`, this is also the shift minimizing their squared difference.
+    The correlation is computed in the Fourier domain, and the whole-point 
+    maximum is refined below the grid spacing with Newton steps on the 
+    band-limited correlation.
+    
+    Parameters
+    ----------
+    arrays : 1D or 2D array
+        Arrays that stay in place, e.g. data.
+    refarrays : 1D or 2D array
+        Arrays to be shifted, e.g. simulations. Must have the shape of 
+        `arrays`.
+    refarray_x : 1D array
+        Linearly spaced axis of the arrays, e.g. the time array.
+    newton_steps : integer
+        Number of sub-point refinement steps. Default is 3.
+    
+    Returns
+    -------
+    shift : float
+        Optimal shift in units of `refarray_x`, between -1/2 and 1/2 of the
+        span of `refarray_x`.
+    """
+    arrays = np.asarray(arrays, dtype=float)
+    n = arrays.shape[-1]
+    cross = np.fft.rfft(arrays, axis=-1) \
+        * np.conj(np.fft.rfft(refarrays, axis=-1))
+    if cross.ndim == 2:
+        cross = cross.sum(axis=0)
+    
+    tau = _cross_spectrum_peak(cross, n, newton_steps)
+    
+    return tau * (refarray_x[1] - refarray_x[0])
+
+
+# --- Functions assisting alignment
+def _reference(arrays, refarray_y, per_row):
+    """
+    Returns the 1-D or 2-D array whose maximum/steepest region determines the
+    alignment shift(s).
+    """
+    if arrays.ndim not in [1, 2]:
+        print('Function only accepts 1D and 2D arrays.')
+        #issue_error
+        return
+    if per_row:
+        return arrays
+    if refarray_y is None:
+        return arrays[0] if arrays.ndim == 2 else arrays
+    return np.asarray(refarray_y)
+
+def _max_indices(y, avgnum):
+    """
+    Returns the indices of the `avgnum` largest values along the last axis of
+    `y`, in descending order of value. Ties resolve to the first occurrence 
+    of the value.
+    """
+    top = np.argpartition(y, -avgnum, axis=-1)[..., -avgnum:]
+    top_values = np.take_along_axis(y, top, axis=-1)
+    top_values = np.take_along_axis(
+        top_values, np.argsort(-top_values, axis=-1, kind='stable'), axis=-1)
+    return np.argmax(y[..., np.newaxis, :] == top_values[..., np.newaxis], 
+                     axis=-1)
+
+def _nearest_indices(array, values):
+    """
+    Vectorized ``find_nearest``: returns the indices of `array` nearest to 
+    each of `values`.
+    """
+    values = np.asarray(values)
+    return np.abs(array - values[..., np.newaxis]).argmin(axis=-1)
+
+def _roll_rows(arrays, shift_idx):
+    """
+    Returns ``numpy.roll(arrays, -shift_idx, axis=-1)``, where `shift_idx` 
+    may hold a separate shift for each row of a 2-D `arrays`.
+    """
+    shift_idx = np.asarray(shift_idx)
+    if shift_idx.ndim == 0:
+        return np.roll(arrays, -int(shift_idx), axis=-1)
+    n = arrays.shape[-1]
+    idx = (np.arange(n) + shift_idx[:, np.newaxis]) % n
+    return np.take_along_axis(arrays, idx, axis=-1)
+
+def _parabolic_peak(y, idx):
+    """
+    Returns the offset, between -1/2 and 1/2, of the vertex of the parabola
+    through the (circular) neighbors of `idx` along the last axis of `y`.
+    """
+    n = y.shape[-1]
+    idx = np.expand_dims(np.asarray(idx), -1)
+    y0 = np.take_along_axis(y, (idx - 1) % n, axis=-1)[..., 0]
+    y1 = np.take_along_axis(y, idx, axis=-1)[..., 0]
+    y2 = np.take_along_axis(y, (idx + 1) % n, axis=-1)[..., 0]
+    curvature = y0 - 2*y1 + y2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        offset = np.where(curvature < 0, 0.5*(y0 - y2)/curvature, 0)
+    return np.clip(offset, -0.5, 0.5)
+
+def _cross_spectrum_peak(cross, n, newton_steps=3):
+    """
+    Returns the position, in points of the original axis of length `n`, of
+    the maximum of the circular cross-correlation whose one-sided spectrum is
+    `cross`. The spectrum may be truncated to its lowest harmonics, in which
+    case the correlation is first sampled on a grid sized to the harmonics.
+    """
+    nfreq = len(cross)
+    full = nfreq == n//2 + 1
+    m = n if full else max(4 * (nfreq - 1), 16)
+    
+    corr = np.fft.irfft(cross, n=m)
+    k = np.argmax(corr)
+    tau = (k + _parabolic_peak(corr, k)) * n / m
+    
+    # derivatives of the band-limited correlation
+    omega = 2 * np.pi * np.arange(nfreq) / n
+    weights = np.full(nfreq, 2.); weights[0] = 1
+    if full and n % 2 == 0:
+        weights[-1] = 1
+    for i in range(newton_steps):
+        rotated = weights * cross * np.exp(1j * omega * tau)
+        d1 = np.sum(np.real(1j * omega * rotated))
+        d2 = -np.sum(np.real(omega**2 * rotated))
+        if d2 >= 0:
+            break
+        tau -= np.clip(d1 / d2, -n / m, n / m)
+    
+    return (tau + n/2) % n - n/2
@@ -10,11 +10,13 @@ import numpy as np
 from scipy import special
 import matplotlib.pyplot as plt
 
-def normalized(ar, alert=True):
+def normalized(ar, alert=True, out=None):
     """
     Returns an array normalized by its maximum value.
     
-    Assumes that ar is to be normalized by a positive value.
+    Assumes that ar is to be normalized by a positive value. Arrays with more
+    than one dimension are treated as a batch of 1-D arrays along the last 
+    axis, each of which is normalized by its own maximum.
     
     Parameters
     ----------
@@ -24,35 +26,23 @@ def normalized(ar, alert=True):
     alert : boolean, optional
         Determines whether or not to print a warning if the maximum of 
         ar_max is less than or equal to zero. Default is True.
+    out : arr, optional
+        Array of the shape of `ar` in which the result is placed, e.g. `ar`
+        itself for in-place normalization. Default is None.
     
     Returns
     -------
     norm_ar : arr
-        Normalized array
+        Normalized array. Arrays whose maximum is not positive are returned
+        unchanged.
     """
-    norm_ar = ar.copy()
+    ar = np.asarray(ar)
+    ar_max = ar.max(axis=-1, keepdims=True)
+    positive = ar_max > 0
+    if alert and not positive.all():
+        print('Array does not contain non-zero positive values!')
     
-    if ar.ndim > 2:
-        print('Error: Normalized function accepts only 2D or 1D arrays')
-        #issue_error
-        return
-    
-    if ar.ndim == 1:
-        norm_ar = np.reshape(norm_ar, (1, len(ar)))
-        
-    for i, raw_ar in enumerate(norm_ar):
-        raw_ar_max = raw_ar.max()
-        if raw_ar_max <= 0:
-            norm_ar[i] = raw_ar
-            if alert:
-                print('Array does not contain non-zero positive values!')
-        else:  
-            norm_ar[i] = raw_ar / raw_ar_max
-            
-    if ar.ndim == 1:
-        return norm_ar[0]
-    else:
-        return norm_ar
+    return np.divide(ar, np.where(positive, ar_max, 1), out=out)
 
 def precision(number):
     """
@@ -60,14 +50,14 @@ def precision(number):
 
     Parameters
     ----------
-    number : float
+    number : float or array of floats
         Number whose precision to determine. Note: if an integer with a 
         floating point (e.g `1.`) is input, it will be considered a 
         float number with precision 1.
 
     Returns
     -------
-    precision : int
+    precision : int or array of ints
         The negative log ofo a float containing the digit 1 in the same 
         position as the last decimal point of the input number. If the number
         does not contain decimal points, then the value 0 is returned.
@@ -75,16 +65,11 @@ def precision(number):
     
     """
     
-    if '.' not in str(number):
-        return 0
+    if np.ndim(number) == 0:
+        return len(str(number).partition('.')[2])
     
-
-    decimals = str(number).split('.')[1]
-    i=0
-    while i < len(decimals):
-        i += 1
-        
-    return i
+    decimals = np.char.partition(np.asarray(number).astype(str), '.')[..., 2]
+    return np.char.str_len(decimals)
 
 
 def Gauss(t, a, t0, fwhm):
@@ -178,14 +163,8 @@ def GaussDiff(t, t0, a, fwhm, tau, b, c, weighted, tau_wt):
         arg1 = Gauss(t, 1, t0, fwhm)
     else:
         arg1 = ExpGauss(t, t0, 1, fwhm, tau_wt, b=0)
-    arg2 = np.exp(-(t-t0)/tau)
-    for i, y in enumerate(arg2):
-        if t[i] < t0:
-            arg2[i] = 0 
-    y = np.zeros(len(arg1))
-    arg1 /= np.max(arg1)    
-    for i in range(len(y)):
-        y[i] = np.max([a*arg1[i], a*b*arg2[i]])
-    c *=np.max(y)
-    y[y<c] = c
-    return y 
+    arg2 = np.where(t < t0, 0, np.exp(-(t-t0)/tau))
+    arg1 /= np.max(arg1, axis=-1, keepdims=True)
+    y = np.maximum(a*arg1, a*b*arg2)
+    c = c * np.max(y, axis=-1, keepdims=True)
+    return np.maximum(y, c)
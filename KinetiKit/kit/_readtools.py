@@ -29,24 +29,32 @@ def csv_to_dict(filename, sourcefolder='', headertype='row'):
     
     if headertype == 'row':
         # assumes that the headers are arranged in each row, with a single 
-        # value following to the right of each header (e.g. a _params file)
-        headers = np.genfromtxt(p, delimiter = ',', unpack=True, usecols=[0],
-                                dtype=str) 
-        values = np.genfromtxt(p, delimiter = ',', unpack=True, usecols=[1],
-                               dtype=float)
+        # value following to the right of each header (e.g. a _params file);
+        # values that are not numbers are read as NaN
+        headers = []; values = []
+        with open(p, 'r') as f:
+            for row in csv.reader(f, delimiter=','):
+                if not row:
+                    continue
+                headers.append(row[0])
+                try:
+                    values.append(float(row[1]))
+                except (ValueError, IndexError):
+                    values.append(np.nan)
+        values = np.array(values)
     if headertype == 'column':
         # assumes that the headers are arranged in each column, with a single
         # value or an array of values stacked vertically below each header
         with open(p, 'r') as f:
-            reader = csv.reader(f, delimiter=',')
             # get header from first row
-            headers = next(reader)
-            # get all the rows as a list
-            data = list(reader)
-            # transform data into numpy array
+            headers = next(csv.reader([f.readline()], delimiter=','))
+            # parse all the rows at once into a numpy array
+            start = f.tell()
             try:
-                values = np.transpose(np.array(data).astype(float))
+                values = np.loadtxt(f, delimiter=',', ndmin=2).T
             except ValueError:
+                f.seek(start)
+                data = list(csv.reader(f, delimiter=','))
                 values = np.transpose(np.array(data).astype(str))
     
     outdict = {}
@@ -55,3 +63,19 @@ def csv_to_dict(filename, sourcefolder='', headertype='row'):
         outdict[header] = values[i]
     
     return outdict
+
+def npz_to_dict(filename, sourcefolder=''):
+    """
+    Returns a dictionary of the arrays in a .npz file, e.g. the traces saved
+    by ``traces_to_npz``, in the order in which they were saved.
+    
+    Parameters
+    ----------
+    filename : string
+        Filename of the .npz file.
+    sourcefolder : path (or string)
+        Location of the .npz file.
+    """
+    
+    with np.load(os.path.join(sourcefolder, filename)) as npz:
+        return {key: npz[key] for key in npz.files}
@@ -87,7 +87,7 @@ def dict_to_csv(filename, dictionary, paramdict=True):
                 f.write("%s,%s \n"%(key, dictionary[key]))
         print('Saved %s.csv.'%filename)
    
-def traces_to_csv(filename, dictionary):
+def traces_to_csv(filename, dictionary, fmt=None):
     """
     Writes a .csv file containing x and y data from a dictionary.
     
@@ -99,35 +99,76 @@ def traces_to_csv(filename, dictionary):
         The keys of the dictionary must contain the title of each trace
         (or the time), and the ditionary values must be arrays of the same
         size.
+    fmt : string or None, optional
+        Format of the values, e.g. '%.6g', which gives smaller files. Default
+        is None, in which case each value is written with the shortest string
+        that reads back to the same number.
     """
     
-    headings = []
-    for key_string in list(dictionary.keys()):
-        headings.append(key_string)
+    headings = list(dictionary.keys())
+    columns = [np.asarray(dictionary[key]) for key in headings]
     
     # Use first element of dict to determine array length
-    length = len(dictionary[headings[0]])
+    length = len(columns[0])
+    # whole columns are converted at once; astype(str) gives the shortest
+    # string of each value for its own dtype (e.g. 0.1 for float32)
+    if fmt is None:
+        strings = [column[:length].astype(str) for column in columns]
+    else:
+        strings = [np.char.mod(fmt, column[:length]) for column in columns]
+    lines = map(','.join, zip(*[column.tolist() for column in strings]))
+    
     filename += '_traces'
     with open(filename + '.csv', 'w') as f:
-        f.write(','.join(headings))
-        f.write('\n')
-        for i in range(length):
-            values = []
-            for key in dictionary.keys():
-                values.append(dictionary[key][i].astype(str))
-            f.write(','.join(values))
-            f.write('\n')
+        f.write(','.join(headings) + '\n')
+        f.write('\n'.join(lines) + '\n')
         print('Saved %s.csv.'%filename)
 
-def save_fit(filename, traces={}, params={}, destinationfolder='', figs=True):
+def traces_to_npz(filename, dictionary, compressed=False):
+    """
+    Writes the x and y data of a dictionary to a binary .npz file, which
+    is written and read much faster than a .csv file and keeps the full
+    precision of the values. Read back with ``npz_to_dict``.
+    
+    Parameters
+    ----------
+    filename : ``string``
+        Containing the desired filename WITHOUT the .npz extension. The 
+        string '_traces' is appended, as in ``traces_to_csv``.
+    dictionary : dictionary
+        The keys of the dictionary are the titles of the traces, and the
+        values are arrays.
+    compressed : boolean, optional
+        Whether the arrays are compressed. Default is False.
+    """
+    
+    filename += '_traces'
+    save = np.savez_compressed if compressed else np.savez
+    # keys are passed as a mapping, since titles are not always identifiers
+    save(filename + '.npz', **{str(key): np.asarray(value) 
+                               for key, value in dictionary.items()})
+    print('Saved %s.npz.'%filename)
+
+def save_fit(filename, traces={}, params={}, destinationfolder='', figs=True,
+             traces_format='csv', store=None):
     """
     A shortcut for performing ``traces_to_csv`` and ``dict_to_csv``
     to save the fit parameters and data/sim traces of successful fits, and
     saving any necessary figures. 
     The function will add the number 1 to the end of the provided filename,
-    and increase that number if the filename already exists
+    and increase that number if the filename already exists.
+    `traces_format` is 'csv' (default) or 'npz', in which case the traces are
+    saved with ``traces_to_npz``.
+    If a ``kit.ResultStore`` is given as `store`, the parameters (the output
+    of ``saveparam_dict``) and traces are added to it with `filename` as the
+    sample, no files are written, and the id of the stored fit is returned.
     """
     
+    if store is not None:
+        return store.add_saveparam_dict(params, traces, sample=filename)
+    
+    if traces_format not in ('csv', 'npz'):
+        raise ValueError('traces_format must be \'csv\' or \'npz\'.')
     if not os.path.exists(destinationfolder):
         os.makedirs(destinationfolder)
         
@@ -136,13 +177,16 @@ def save_fit(filename, traces={}, params={}, destinationfolder='', figs=True):
     for i in np.arange(0,500,1):
         d = od + str(i+1)
         
-        condition = os.path.exists(d+'.svg') or os.path.exists(d+'.png') or os.path.exists(d+'_params.csv') or os.path.exists(d+'_traces.csv') 
+        condition = os.path.exists(d+'.svg') or os.path.exists(d+'.png') or os.path.exists(d+'_params.csv') or os.path.exists(d+'_traces.csv') or os.path.exists(d+'_traces.npz')
         if condition:
             pass
         
         else:
             dict_to_csv(d,params)
-            traces_to_csv(d,traces) 
+            if traces_format == 'npz':
+                traces_to_npz(d,traces)
+            else:
+                traces_to_csv(d,traces)
             if figs:
                 plt.savefig(d+'.svg', format='svg')
                 print('Saved ' + d + '.svg')
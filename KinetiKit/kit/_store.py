@@ -0,0 +1,357 @@
+"""
+Results store that keeps fit parameters, metadata and traces in a single
+SQLite file, as an alternative to the loose files written by ``save_fit``.
+"""
+
+import io
+import json
+import time
+import sqlite3
+import datetime
+import threading
+
+import numpy as np
+
+__all__ = ['ResultStore']
+
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS fits (
+    id INTEGER PRIMARY KEY,
+    created REAL NOT NULL,
+    model TEXT,
+    sample TEXT,
+    key TEXT,
+    filename TEXT,
+    pulse_power REAL,
+    cw_power REAL,
+    wavelength REAL,
+    cost REAL,
+    nfev INTEGER,
+    time REAL,
+    metadata TEXT
+);
+CREATE TABLE IF NOT EXISTS params (
+    fit_id INTEGER NOT NULL REFERENCES fits(id) ON DELETE CASCADE,
+    name TEXT NOT NULL,
+    value REAL,
+    error REAL,
+    lower REAL,
+    upper REAL,
+    PRIMARY KEY (fit_id, name)
+);
+CREATE TABLE IF NOT EXISTS traces (
+    fit_id INTEGER PRIMARY KEY REFERENCES fits(id) ON DELETE CASCADE,
+    data BLOB NOT NULL
+);
+CREATE INDEX IF NOT EXISTS fits_model ON fits(model);
+CREATE INDEX IF NOT EXISTS fits_sample ON fits(sample);
+CREATE INDEX IF NOT EXISTS fits_pulse_power ON fits(pulse_power);
+CREATE INDEX IF NOT EXISTS fits_cw_power ON fits(cw_power);
+CREATE INDEX IF NOT EXISTS fits_created ON fits(created);
+CREATE INDEX IF NOT EXISTS params_name ON params(name, value);
+"""
+
+_FIELDS = ['created', 'model', 'sample', 'key', 'filename', 'pulse_power',
+           'cw_power', 'wavelength', 'cost', 'nfev', 'time']
+
+# entries of ``saveparam_dict`` that are not parameters of the system
+_FIT_INFO = ['Sum of Sq. of Residuals', 'No. of DE Evaluations',
+             'No. of DE Iterations', 'No. of LS Evaluations']
+
+
+def _plain(value):
+    # JSON-compatible version of numpy scalars and arrays
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (np.ndarray, tuple)):
+        return [_plain(v) for v in value]
+    return value
+
+
+def _timestamp(value):
+    if isinstance(value, datetime.datetime):
+        return value.timestamp()
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time()).timestamp()
+    return value
+
+
+def _pack_traces(traces):
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **{str(key): np.asarray(value)
+                                   for key, value in traces.items()})
+    return buffer.getvalue()
+
+
+def _unpack_traces(blob):
+    with np.load(io.BytesIO(blob)) as npz:
+        return {key: npz[key] for key in npz.files}
+
+
+class ResultStore(object):
+    """
+    Stores fit results in a single SQLite file: one row per fit with the
+    model, sample, powers, cost, number of evaluations and fitting time; the
+    fitted parameters with their errors and bounds; other metadata (e.g. the
+    comparison settings of ``saveparam_dict``) as JSON; and, optionally, the
+    data and simulated traces as a compressed .npz blob.
+
+    Fits are inserted in bulk within one transaction (``add_many``) and
+    queried through indices on the model, sample, powers and date. The store
+    can be shared by the threads of one process.
+
+    Parameters
+    ----------
+    path : string
+        File of the store, created if it does not exist. ':memory:' keeps the
+        store in memory.
+    timeout : float, optional
+        Time in seconds to wait for another process that is writing to the
+        file. Default is 30.
+    """
+
+    def __init__(self, path, timeout=30.):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, timeout=timeout,
+                                   check_same_thread=False)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute('PRAGMA foreign_keys = ON')
+        if path != ':memory:':
+            # readers do not block the writer
+            self._db.execute('PRAGMA journal_mode = WAL')
+        with self._db:
+            self._db.executescript(_SCHEMA)
+
+    def add(self, params, traces=None, **fields):
+        """
+        Adds one fit and returns its id. See ``add_many``.
+        """
+        return self.add_many([dict(fields, params=params, traces=traces)])[0]
+
+    def add_many(self, records):
+        """
+        Adds many fits in one transaction and returns their ids.
+
+        Parameters
+        ----------
+        records : list of dictionaries
+            Each with the entries
+            'params' : dictionary of the fitted parameters;
+            and, optionally,
+            'errors', 'bounds' : dictionaries of the errors and (lower, upper)
+            bounds of the parameters;
+            'traces' : dictionary of arrays, e.g. as passed to ``save_fit``;
+            'metadata' : dictionary of other information, stored as JSON;
+            'model', 'sample', 'key', 'filename' : strings;
+            'pulse_power', 'cw_power', 'wavelength', 'cost', 'time' : floats;
+            'nfev' : integer;
+            'created' : timestamp or datetime (default is the current time).
+            Results of ``fit.lib.fit_file`` can be added as they are.
+        """
+        ids = []
+        now = time.time()
+        with self._lock, self._db:
+            for record in records:
+                record = dict(record)
+                params = record.pop('params')
+                errors = record.pop('errors', None) or {}
+                bounds = record.pop('bounds', None) or {}
+                traces = record.pop('traces', None)
+                metadata = record.pop('metadata', None)
+                record.pop('p0', None)
+                record['created'] = _timestamp(record.get('created') or now)
+                record['metadata'] = json.dumps(_plain(metadata), default=str) \
+                    if metadata else None
+                unknown = set(record) - set(_FIELDS) - {'metadata'}
+                if unknown:
+                    raise ValueError('Unknown fields: %s.'
+                                     % ', '.join(sorted(unknown)))
+
+                columns = list(record.keys())
+                cursor = self._db.execute(
+                    'INSERT INTO fits (%s) VALUES (%s)'
+                    % (', '.join(columns), ', '.join('?' * len(columns))),
+                    [_plain(record[column]) for column in columns])
+                fit_id = cursor.lastrowid
+                rows = []
+                for name, value in params.items():
+                    lower, upper = bounds.get(name, (None, None))
+                    rows.append((fit_id, name, _plain(value),
+                                 _plain(errors.get(name)), _plain(lower),
+                                 _plain(upper)))
+                self._db.executemany('INSERT INTO params VALUES '
+                                     '(?, ?, ?, ?, ?, ?)', rows)
+                if traces:
+                    self._db.execute('INSERT INTO traces VALUES (?, ?)',
+                                     (fit_id, _pack_traces(traces)))
+                ids.append(fit_id)
+        return ids
+
+    def add_saveparam_dict(self, saveparam_dict, traces=None, **fields):
+        """
+        Adds a fit described by the output of ``kit.saveparam_dict`` and
+        returns its id. The model type, bounds, errors, sum of squared
+        residuals and numbers of evaluations are stored in their own fields,
+        and the other non-numeric entries as metadata. `fields` are as in
+        ``add_many`` (e.g. `sample`, `pulse_power`).
+        """
+        entries = dict(saveparam_dict)
+        params, errors, bounds = {}, {}, {}
+        metadata = dict(fields.pop('metadata', None) or {})
+        for info in _FIT_INFO:
+            if info in entries:
+                metadata[info] = entries.pop(info)
+        fields.setdefault('model', entries.pop('Model type', None))
+        if 'Sum of Sq. of Residuals' in metadata:
+            fields.setdefault('cost', metadata['Sum of Sq. of Residuals'])
+        if 'No. of DE Evaluations' in metadata:
+            fields.setdefault('nfev', metadata['No. of DE Evaluations']
+                              + metadata.get('No. of LS Evaluations', 0))
+
+        for name, value in entries.items():
+            if name.endswith('_bounds') and isinstance(value, tuple):
+                bounds[name[:-len('_bounds')]] = value
+            elif name.endswith('_error'):
+                errors[name[:-len('_error')]] = value
+            elif isinstance(value, (int, float, np.number)) \
+                    and not isinstance(value, bool):
+                params[name] = value
+            else:
+                metadata[name] = value
+        return self.add(params, traces, errors=errors, bounds=bounds,
+                        metadata=metadata, **fields)
+
+    def _fit(self, row, traces=False):
+        fit = dict(row)
+        fit['metadata'] = json.loads(fit['metadata']) \
+            if fit['metadata'] else {}
+        fit['params'], fit['errors'], fit['bounds'] = {}, {}, {}
+        for name, value, error, lower, upper in self._db.execute(
+                'SELECT name, value, error, lower, upper FROM params '
+                'WHERE fit_id = ? ORDER BY rowid', (fit['id'],)):
+            fit['params'][name] = value
+            if error is not None:
+                fit['errors'][name] = error
+            if lower is not None or upper is not None:
+                fit['bounds'][name] = (lower, upper)
+        if traces:
+            fit['traces'] = self.traces(fit['id'])
+        return fit
+
+    def get(self, fit_id, traces=False):
+        """
+        Returns the fit of id `fit_id` as a dictionary with the fields of
+        ``add_many`` and 'id', or None if there is no such fit. The traces
+        are included if `traces` is True.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT * FROM fits WHERE id = ?',
+                                   (fit_id,)).fetchone()
+            return None if row is None else self._fit(row, traces)
+
+    def traces(self, fit_id):
+        """
+        Returns the dictionary of traces of a fit, or None if it has none.
+        """
+        with self._lock:
+            row = self._db.execute('SELECT data FROM traces WHERE fit_id = ?',
+                                   (fit_id,)).fetchone()
+        return None if row is None else _unpack_traces(row[0])
+
+    def query(self, model=None, sample=None, pulse_power=None, cw_power=None,
+              wavelength=None, since=None, until=None, params=None,
+              order='created', limit=None, traces=False):
+        """
+        Returns the fits that match all the given criteria, as a list of
+        dictionaries (see ``get``).
+
+        Optional Parameters
+        -------------------
+        model, sample : string or None
+            Model type and sample. SQL wildcards (%, _) are accepted.
+        pulse_power, cw_power, wavelength : float, tuple or None
+            Value or (lower, upper) range, either of which may be None.
+        since, until : timestamp, datetime or None
+            Range of creation dates.
+        params : dictionary or None
+            Ranges of parameter values, e.g. ``{'tau1': (1*ns, None)}``.
+        order : string
+            Field by which fits are sorted. Default is 'created'.
+        limit : integer or None
+            Maximum number of fits returned.
+        traces : boolean
+            Whether the traces are included. Default is False.
+        """
+        if order not in _FIELDS + ['id']:
+            raise ValueError('Cannot order by %s.' % order)
+        conditions, values = [], []
+
+        def add_range(column, bound):
+            if isinstance(bound, (tuple, list)):
+                lower, upper = bound
+                if lower is not None:
+                    conditions.append('%s >= ?' % column)
+                    values.append(_plain(lower))
+                if upper is not None:
+                    conditions.append('%s <= ?' % column)
+                    values.append(_plain(upper))
+            elif bound is not None:
+                conditions.append('%s = ?' % column)
+                values.append(_plain(bound))
+
+        for column, pattern in (('model', model), ('sample', sample)):
+            if pattern is not None:
+                conditions.append('%s LIKE ?' % column)
+                values.append(pattern)
+        add_range('pulse_power', pulse_power)
+        add_range('cw_power', cw_power)
+        add_range('wavelength', wavelength)
+        add_range('created', (_timestamp(since), _timestamp(until)))
+        for i, (name, bound) in enumerate((params or {}).items()):
+            column = 'p%i.value' % i
+            conditions.append(
+                'EXISTS (SELECT 1 FROM params AS p%i WHERE p%i.fit_id = '
+                'fits.id AND p%i.name = ?' % (i, i, i))
+            values.append(name)
+            count = len(conditions)
+            add_range(column, bound)
+            # nest the value conditions in the subquery
+            inner = conditions[count:]
+            del conditions[count:]
+            conditions[-1] += ''.join(' AND ' + c for c in inner) + ')'
+
+        sql = 'SELECT * FROM fits'
+        if conditions:
+            sql += ' WHERE ' + ' AND '.join(conditions)
+        sql += ' ORDER BY %s, id' % order
+        if limit is not None:
+            sql += ' LIMIT %i' % limit
+        with self._lock:
+            rows = self._db.execute(sql, values).fetchall()
+            return [self._fit(row, traces) for row in rows]
+
+    def delete(self, fit_id):
+        """
+        Removes a fit, with its parameters and traces.
+        """
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM fits WHERE id = ?', (fit_id,))
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM fits').fetchone()[0]
+
+    def close(self):
+        """
+        Closes the connection to the file.
+        """
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -15,7 +15,7 @@ class RateModel:
         
         self.name = self.class_name
         
-        self.keys = params.keys()
+        self.keys = list(params.keys())
         for key, value in params.items():
             setattr(self, key, value)
 
@@ -46,7 +46,7 @@ class FunctionModel:
         
         self.name = self.class_name
         
-        self.keys = params.keys()
+        self.keys = list(params.keys())
         for key, value in params.items():
             setattr(self, key, value)
             
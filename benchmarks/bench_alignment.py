@@ -0,0 +1,121 @@
+"""
+Benchmark of the vectorized alignment kernels in ``KinetiKit.kit`` against
+the loop-based implementations they replaced. 
+
+Checks that both produce identical output on simulated TRPL-like traces and
+prints the time per call. Run with ``python benchmarks/bench_alignment.py``.
+"""
+
+import sys
+import timeit
+
+import numpy as np
+
+from KinetiKit import kit as kin_kit
+from KinetiKit import sim
+from KinetiKit.units import ns
+
+#--- Loop-based implementations prior to vectorization
+def legacy_align_by_max(arrays, refarray_x, refarray_y=None, avgnum=1, value=0):
+    rolled_arrays = arrays.copy()
+    if refarray_y is None:
+        refarray_y = rolled_arrays[0].copy() if rolled_arrays.ndim == 2 \
+            else rolled_arrays.copy()
+    sacrificial = refarray_y.copy()
+    refvalues_of_maxes = np.array([])
+    for i in range(0,avgnum):
+        current_max = sacrificial.max()
+        max_idx = np.where(refarray_y==current_max)[0][0]
+        current_refvalue = refarray_x[max_idx]
+        refvalues_of_maxes = np.append(refvalues_of_maxes, [current_refvalue])
+        sacrificial[np.where(sacrificial==current_max)[0][0]] = -sys.maxsize
+    avg_ref_value = np.average(refvalues_of_maxes)
+    max_idx = kin_kit.find_nearest(refarray_x, avg_ref_value)[0]
+    val_idx, val = kin_kit.find_nearest(refarray_x, value)
+    shift_idx = int(max_idx - val_idx)
+    return np.roll(rolled_arrays, -shift_idx, axis=-1)
+
+def legacy_align_by_steep(arrays, refarray_x, refarray_y=None, avgnum=3, value=0):
+    rolled_arrays = arrays.copy()
+    if refarray_y is None:
+        refarray_y = rolled_arrays[0].copy() if rolled_arrays.ndim == 2 \
+            else rolled_arrays.copy()
+    difs = np.zeros(len(refarray_y))
+    for i in range(len(refarray_y)-1):
+        difs[i] = refarray_y[i]-refarray_y[i-2*avgnum]
+    difs = np.roll(difs, -avgnum)
+    steep_idx = np.argmax(difs)
+    val_idx, val = kin_kit.find_nearest(refarray_x, value)
+    shift_idx = int(steep_idx - val_idx)
+    return np.roll(rolled_arrays, -shift_idx, axis=-1)
+
+def legacy_find_baseline(y, avgnum=50):
+    diffs = np.zeros(len(y))
+    for i in range(len(y)-1):
+        for k in range(avgnum):
+            if k == 0:
+                total_diff = y[i]-y[i-1]
+            else:
+                new_diff = y[i-k] - y[i-k-1]
+                total_diff = total_diff + new_diff
+        avg_diff = total_diff/avgnum
+        diffs[i+1] = avg_diff
+    i_min = np.argmin(diffs[diffs!=0])
+    return y[i_min]
+
+
+def make_traces(n_traces=50, N=4096, seed=0):
+    """Poisson-noisy exponential decays with randomly placed rises."""
+    rng = np.random.default_rng(seed)
+    t = sim.time.linear(N=N)['array']
+    taus = rng.uniform(0.3, 3, n_traces)[:, np.newaxis] * ns
+    clean = 1e4 * np.exp(-t / taus) + 20
+    traces = rng.poisson(clean).astype(float)
+    shifts = rng.integers(0, N, n_traces)
+    traces = np.array([np.roll(tr, s) for tr, s in zip(traces, shifts)])
+    return t, traces
+
+
+def bench(label, new, old, number):
+    t_new = timeit.timeit(new, number=number) / number
+    t_old = timeit.timeit(old, number=number) / number
+    print('%-28s legacy %9.3f ms   vectorized %8.3f ms   speedup %6.1fx'
+          %(label, 1e3*t_old, 1e3*t_new, t_old/t_new))
+
+
+if __name__ == '__main__':
+    t, traces = make_traces()
+    
+    #--- identical output
+    for avgnum in [1, 5, 10]:
+        for tr in traces:
+            assert np.array_equal(
+                kin_kit.align_by_max(tr, t, avgnum=avgnum, value=0.5*ns),
+                legacy_align_by_max(tr, t, avgnum=avgnum, value=0.5*ns))
+            assert np.array_equal(
+                kin_kit.align_by_steep(tr, t, avgnum=avgnum, value=0.5*ns),
+                legacy_align_by_steep(tr, t, avgnum=avgnum, value=0.5*ns))
+        assert np.array_equal(
+            kin_kit.align_by_max(traces, t, avgnum=avgnum),
+            legacy_align_by_max(traces, t, avgnum=avgnum))
+        per_row = kin_kit.align_by_max(traces, t, avgnum=avgnum, per_row=True)
+        for tr, al in zip(traces, per_row):
+            assert np.array_equal(al, legacy_align_by_max(tr, t, avgnum=avgnum))
+    for tr in traces[:10]:
+        assert kin_kit.find_baseline(tr) == legacy_find_baseline(tr)
+    print('Vectorized and legacy alignment output are identical.')
+    
+    #--- timing
+    tr = traces[0]
+    bench('align_by_max (avgnum=10)',
+          lambda: kin_kit.align_by_max(tr, t, avgnum=10),
+          lambda: legacy_align_by_max(tr, t, avgnum=10), 200)
+    bench('align_by_steep (avgnum=5)',
+          lambda: kin_kit.align_by_steep(tr, t, avgnum=5),
+          lambda: legacy_align_by_steep(tr, t, avgnum=5), 200)
+    bench('find_baseline (avgnum=50)',
+          lambda: kin_kit.find_baseline(tr),
+          lambda: legacy_find_baseline(tr), 3)
+    bench('align_by_max, 50 rows',
+          lambda: kin_kit.align_by_max(traces, t, avgnum=10, per_row=True),
+          lambda: [legacy_align_by_max(r, t, avgnum=10) for r in traces], 20)
@@ -115,6 +115,8 @@ doFit = True # if False, system will be modeled with initparams
 doLS = False # whether to refine the optimization via a local least-squares 
             # fitting (and obtain error estimates). Ignore if doFit = False
 settings['display_counter'] = True # display counter showing search iteration
+budget = 2*3600 # wall-clock budget of the global search, in seconds (or None)
+patience = 50 # generations without improvement before stopping (or None)
 
 #--- arguments of sim.fit.simulate_and_compare() -- see docstring
 comparison_type = 'log' # "linear" of "log" comparison betw. data and sim.
@@ -190,10 +192,17 @@ if doFit:
     # First perform a global search using Differential Evolution
     if settings['display_counter']==True:
         print("Search iteration counter...")
-    opt_DE = sp.optimize.differential_evolution(fit.lib.simulate_and_compare,
-                                              bounds= boundtuples, 
-                                              args= conditions,
-                                              )
+    opt_DE = fit.lib.fit_DE(fit.lib.simulate_and_compare,
+                            bounds= boundtuples, 
+                            args= conditions,
+                            budget=budget,
+                            patience=patience,
+                            monitor=lambda progress: print(
+                                'generation %i: cost %.4e, spread %.3f' 
+                                % (progress['nit'], progress['fun'],
+                                   progress['spread'].max())),
+                            )
+    print(opt_DE.message)
     if doLS:
         # Fine-tune with a least-squares fit to determine curvature 
         # of parameter space
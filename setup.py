@@ -8,12 +8,21 @@ setup(
 	author="Natalia Spitha",
 	author_email="natalia.spitha@gmail.com",
     packages=find_packages(exclude=("tests", "tests.*")),
-    python_requires=">=3.6",
+    python_requires=">=3.9",
     install_requires=[
         "matplotlib>=3.0",
         "numpy>=1.15.0",
-        "scipy",
+        # fit_DE steps the private scipy solver (with a fallback); versions
+        # above the last one tested may change it
+        "scipy>=1.7,<1.18",
 		"ipywidgets",
     ],
     description="Tools for comparing and kinetically simulating time-resolved data",
+    entry_points={
+        "console_scripts": [
+            "kinetikit-fit = KinetiKit.fit.lib._batch:main",
+            "kinetikit-serve = KinetiKit.fit.lib._service:main",
+            "kinetikit-worker = KinetiKit.fit.lib._cluster:main",
+        ],
+    },
 )
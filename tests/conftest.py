@@ -0,0 +1,31 @@
+"""
+Fixtures shared by the tests of the fitting tools.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from KinetiKit import sim
+from KinetiKit.units import ns, ps
+
+
+@pytest.fixture
+def write_trace():
+    """
+    Returns a function that writes the trace of a biexponential decay with a
+    fast lifetime `tau`, convolved with a 100 ps IRF on ``sim.time.linear(
+    N=500)``, to a data file. Files appear at once, as from an instrument.
+    """
+    to = sim.time.linear(N=500)
+    dtime = to['array'][::to['subsample']]
+    def write(filename, tau):
+        system = sim.systems.Biexp(A1=1, tau1=tau, tau2=1*ns)
+        pl, converged = sim.lib.simulate_func(system, dtime)
+        y = np.roll(sim.lib.convolve_irf(pl, dtime, {'fwhm': 100*ps}), 50) \
+            * 1e4
+        np.savetxt(filename + '.tmp', np.column_stack((dtime / ns, y)),
+                   delimiter=',')
+        os.replace(filename + '.tmp', filename)
+    return write
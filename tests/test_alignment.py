@@ -0,0 +1,45 @@
+"""
+Test for the vectorized alignment functions of ``KinetiKit.kit`` on stacks
+of traces.
+"""
+
+import numpy as np
+
+from KinetiKit import sim
+from KinetiKit import kit as kin_kit
+from KinetiKit.units import ns
+
+to = sim.time.linear(N=1000)
+dtime = to['array']
+decay = np.exp(-dtime/(1*ns)) + 0.01
+traces = np.array([np.roll(decay, s) for s in [0, 100, 250, 731]])
+
+
+def test_shared_reference_shift():
+    aligned = kin_kit.align_by_max(traces, dtime, avgnum=1, value=0.5*ns)
+    shift = kin_kit.find_nearest(dtime, 0.5*ns)[0]
+    assert np.array_equal(aligned, np.roll(traces, shift, axis=-1))
+    
+def test_per_row_alignment():
+    for func in [kin_kit.align_by_max, kin_kit.align_by_steep]:
+        aligned = func(traces, dtime, avgnum=3, value=0.5*ns, per_row=True)
+        for row in aligned:
+            assert np.array_equal(row, aligned[0])
+        for row, tr in zip(aligned, traces):
+            assert np.array_equal(row, func(tr, dtime, avgnum=3, value=0.5*ns))
+
+def test_find_baseline_rows():
+    baselines = kin_kit.find_baseline(traces, avgnum=20)
+    assert baselines.shape == (len(traces),)
+    for b, tr in zip(baselines, traces):
+        assert b == kin_kit.find_baseline(tr, avgnum=20)
+
+def test_fractional_shift_recovered():
+    gauss = kin_kit.Gauss(dtime, 1, 2*ns, 0.5*ns)
+    dt = dtime[1] - dtime[0]
+    shifted = kin_kit.Gauss(dtime, 1, 2*ns + 0.37*dt, 0.5*ns)
+    assert np.allclose(kin_kit.fractional_roll(gauss, dtime, 0.37*dt), shifted)
+    assert np.isclose(kin_kit.find_shift(shifted, gauss, dtime), 0.37*dt)
+    assert np.allclose(kin_kit.roll_by_array_shift(gauss, dtime, 10*dt, 
+                                                   fractional=True),
+                       np.roll(gauss, 10))
@@ -0,0 +1,87 @@
+"""
+Test for the live fitting of new data files with ``data.lib.FolderWatcher``
+and ``fit.lib.AutoFitter``, on a temporary directory written by the test.
+"""
+
+import csv
+import time
+
+import numpy as np
+
+from KinetiKit import sim, fit, data, kit
+from KinetiKit.units import ns, ps
+
+to = sim.time.linear(N=500)
+irf_args = {'fwhm': 100*ps}
+
+
+def test_watcher(tmp_path, write_trace):
+    write_trace(str(tmp_path / 'old.asc'), 1*ns)
+    found = []
+    watcher = data.lib.FolderWatcher(str(tmp_path), found.append, settle=0)
+    assert watcher.poll() == []
+    write_trace(str(tmp_path / 'new.asc'), 1*ns)
+    assert watcher.poll() == [str(tmp_path / 'new.asc')]
+    assert watcher.poll() == [] and found == [str(tmp_path / 'new.asc')]
+
+
+def test_autofit(tmp_path, write_trace):
+    results_file = str(tmp_path / 'results.csv')
+    store = str(tmp_path / 'fits.sqlite')
+    system = sim.systems.Biexp(A1=1, tau1=1*ns, tau2=1*ns)
+    fitter = fit.lib.AutoFitter(str(tmp_path), system, {'tau1': (0.1*ns, 10*ns)},
+                                to, results_file=results_file, store=store,
+                                method='LS',
+                                load_args={'skip_h': 0, 'skip_f': 0}, 
+                                sac_kwargs={'irf_args': irf_args},
+                                interval=0.05, settle=0.1)
+    taus = [2*ns, 2.2*ns, 2.5*ns]
+    with fitter:
+        for i, tau in enumerate(taus):
+            write_trace(str(tmp_path / ('trace_%i.asc' % i)), tau)
+            deadline = time.time() + 60
+            while len(fitter.results) + len(fitter.errors) < i + 1 \
+                    and time.time() < deadline:
+                time.sleep(0.05)
+    
+    assert fitter.errors == []
+    assert [r['key'] for r in fitter.results] == ['trace_0', 'trace_1', 
+                                                  'trace_2']
+    for result, tau in zip(fitter.results, taus):
+        assert np.isclose(result['params']['tau1'], tau, rtol=1e-2)
+    # warm start from the previous fit
+    assert fitter.results[1]['p0'] == fitter.results[0]['params']
+    
+    with open(results_file) as f:
+        rows = list(csv.DictReader(f))
+    assert [row['key'] for row in rows] == ['trace_0', 'trace_1', 'trace_2']
+    assert np.isclose(float(rows[2]['tau1']), taus[2], rtol=1e-2)
+    with kit.ResultStore(store) as results:
+        fits = results.query(model='Biexp')
+    assert sorted(fit['key'] for fit in fits) == ['trace_0', 'trace_1',
+                                                  'trace_2']
+
+
+def test_autofit_failure_is_recorded_quietly(tmp_path, capsys):
+    system = sim.systems.Biexp(A1=1, tau1=1*ns, tau2=1*ns)
+    fitter = fit.lib.AutoFitter(str(tmp_path), system, {'tau1': (0.1*ns, 10*ns)},
+                                to, method='LS', verbose=False)
+    fitter.submit(str(tmp_path / 'missing.asc'))
+    assert fitter.wait(60)
+    fitter.stop()
+    assert fitter.results == [] and len(fitter.errors) == 1
+    assert fitter.errors[0][0] == str(tmp_path / 'missing.asc')
+    assert capsys.readouterr().out == ''
+
+
+def test_fit_file_parallel_DE(tmp_path, write_trace):
+    # the comparison arguments are pickled for the worker processes
+    filename = str(tmp_path / 'trace.asc')
+    write_trace(filename, 2*ns)
+    system = sim.systems.Biexp(A1=1, tau1=1*ns, tau2=1*ns)
+    result = fit.lib.fit_file(filename, system, {'tau1': (0.1*ns, 10*ns)}, to,
+                              load_args={'skip_h': 0, 'skip_f': 0},
+                              sac_kwargs={'irf_args': irf_args},
+                              fit_args={'workers': 2, 'updating': 'deferred',
+                                        'maxiter': 5, 'seed': 1})
+    assert np.isclose(result['params']['tau1'], 2*ns, rtol=5e-2)
@@ -0,0 +1,89 @@
+"""
+Test for batch fitting of data files from JSON and TOML job files with
+``fit.lib.load_jobs``, ``fit.lib.run_jobs`` and the ``kinetikit-fit`` entry
+point.
+"""
+
+import os
+import csv
+import json
+
+import numpy as np
+
+from KinetiKit import fit, kit
+from KinetiKit.fit.lib._batch import main
+from KinetiKit.units import ns
+
+
+job = {'model': 'Biexp',
+       'params': {'A1': 1, 'tau1': '1 ns', 'tau2': '1 ns'},
+       'bounds': {'tau1': ['0.1 ns', '10 ns']},
+       'time': {'N': 500, 'reprate': '80 MHz'},
+       'irf': {'fwhm': '100 ps'},
+       'load': {'skip_h': 0, 'skip_f': 0},
+       'method': 'LS'}
+
+
+def test_load_and_run(tmp_path, write_trace):
+    os.makedirs(str(tmp_path / 'a'))
+    taus = {'a/s1.asc': 2*ns, 'a/s2.asc': 2.5*ns, 's3.asc': 1.5*ns}
+    for name, tau in taus.items():
+        write_trace(str(tmp_path / name), tau)
+    jobfile = str(tmp_path / 'campaign.json')
+    with open(jobfile, 'w') as f:
+        json.dump({'defaults': job,
+                   'jobs': [{'name': 'A', 'data': 'a/*.asc'},
+                            {'data': ['s3.asc'], 'method': 'DE',
+                             'fit': {'seed': 0, 'maxiter': 30},
+                             'checkpoint': True}]}, f)
+    
+    jobs = fit.lib.load_jobs(jobfile)
+    assert [j['name'] for j in jobs] == ['A', 'campaign_2']
+    assert np.isclose(jobs[0]['bounds']['tau1'][0], 0.1*ns)
+    assert np.isclose(jobs[0]['time']['reprate'], 80e6)
+    assert [os.path.basename(f) for f in jobs[0]['files']] == ['s1.asc', 's2.asc']
+    
+    output = str(tmp_path / 'out')
+    store = str(tmp_path / 'fits.sqlite')
+    summary = fit.lib.run_jobs(jobs, workers=2, output=output, store=store,
+                               verbose=False)
+    assert summary['errors'] == [] and summary['fits'] == 3
+    assert summary['nfev'] > 0 and summary['fits_per_hour'] > 0
+    for result in summary['results']:
+        tau = taus[os.path.relpath(result['filename'], str(tmp_path))]
+        assert np.isclose(result['params']['tau1'], tau, rtol=1e-2)
+    
+    with open(os.path.join(output, 'A_results.csv')) as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(row['key'] for row in rows) == ['s1', 's2']
+    assert not [name for name in os.listdir(output) if name.endswith('.ckpt')]
+    with kit.ResultStore(store) as results:
+        assert len(results.query(sample='A', model='Biexp')) == 2
+    
+    # completed files are skipped when resuming
+    summary = fit.lib.run_jobs(jobs, workers=0, output=output, resume=True,
+                               verbose=False)
+    assert summary['skipped'] == 3 and summary['fits'] == 0
+
+
+def test_main_toml(tmp_path, capsys, write_trace):
+    write_trace(str(tmp_path / 'x_0.5uW.asc'), 2*ns)
+    jobfile = str(tmp_path / 'job.toml')
+    with open(jobfile, 'w') as f:
+        f.write('model = "Biexp"\nmethod = "LS"\ndata = "*.asc"\n'
+                'time = {N = 500, reprate = "80 MHz"}\n'
+                'irf = {fwhm = "100 ps"}\n'
+                'load = {skip_h = 0, skip_f = 0}\n'
+                'excitation = {power_from_filename = true, '
+                'pulse = {wavelength = "400 nm"}}\n'
+                '[params]\nA1 = 1\ntau1 = "1 ns"\ntau2 = "1 ns"\n'
+                '[bounds]\ntau1 = ["0.1 ns", "10 ns"]\n')
+    
+    assert main([jobfile, '--dry-run']) == 0
+    assert 'x_0.5uW.asc' in capsys.readouterr().out
+    output = str(tmp_path / 'out')
+    assert main([jobfile, '-w', '1', '-o', output, '-q']) == 0
+    assert '1 fits (0 failed, 0 skipped)' in capsys.readouterr().out
+    rows = kit.csv_to_dict(os.path.join(output, 'job_results.csv'),
+                           headertype='column')
+    assert np.isclose(float(rows['tau1'][0]), 2*ns, rtol=1e-2)
@@ -0,0 +1,67 @@
+"""
+Test for concurrent loading of the example heterostructure directory with
+``data.lib.load_directory``, compared to importing each file separately.
+"""
+
+import os
+import glob
+
+import numpy as np
+import pytest
+
+from KinetiKit import data
+from KinetiKit.units import uW, nm
+
+ex_data = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+                       os.pardir, 'examples', 'ex_data')
+hetero = os.path.join(ex_data, 'hetero')
+
+
+def test_parse_filename():
+    assert data.lib.parse_filename('het_n=1_0.54uW_TRPL.asc') \
+        == {'pulse_power': pytest.approx(0.54*uW)}
+    found = data.lib.parse_filename('6-trpl-0,96uw-20s-n1_532nm')
+    assert found['pulse_power'] == pytest.approx(0.96*uW)
+    assert found['wavelength'] == pytest.approx(532*nm)
+    assert data.lib.parse_filename('sample_A', {'cw_power': r'(\d+)'}) == {}
+    # exact units before the case-insensitive fallback
+    assert data.lib.parse_filename('a_2MW.asc')['pulse_power'] \
+        == pytest.approx(2e6)
+    assert data.lib.parse_filename('a_2mW.asc')['pulse_power'] \
+        == pytest.approx(2e-3)
+    assert data.lib.parse_filename('a_2mw.asc')['pulse_power'] \
+        == pytest.approx(2e-3)
+
+
+@pytest.mark.parametrize('executor', ['thread', 'process'])
+def test_matches_single_files(executor):
+    dataset = data.lib.load_directory(hetero, skip_h=154, skip_f=884, 
+                                      coll=900, executor=executor, workers=2,
+                                      verbose=False)
+    filenames = sorted(glob.glob(os.path.join(hetero, '*.asc')))
+    assert len(dataset) == len(filenames)
+    for i, f in enumerate(filenames):
+        do = data.lib.data_from_SPCM(f, skip_h=154, skip_f=884, coll=900)
+        assert np.array_equal(dataset.y[i], do.y)
+        assert dataset.key[i] == os.path.splitext(os.path.basename(f))[0]
+    # powers missing from the filename are read from the title in the header
+    assert np.allclose(dataset.pulse_power.astype(float), 
+                       np.array([0.54, 1.00, 0.96, 0.54, 1.00, 0.96])*uW)
+
+
+def test_glob_and_dark():
+    dark = data.lib.data_from_SPCM(os.path.join(ex_data, 'dark.asc'), 
+                                   skip_h=354, skip_f=884, coll=300)
+    dataset = data.lib.load_directory(os.path.join(hetero, 'het_n=2_*'), 
+                                      skip_h=154, skip_f=884, coll=900, 
+                                      dark=dark, verbose=False)
+    do = data.lib.data_from_SPCM(os.path.join(hetero, 'het_n=2_TRPL.asc'), 
+                                 skip_h=154, skip_f=884, coll=900)
+    do.dark_subtract(dark)
+    assert len(dataset) == 3 and dataset.dark_subtracted
+    assert np.allclose(dataset.y[-1], do.y)
+
+
+def test_missing_files():
+    with pytest.raises(FileNotFoundError):
+        data.lib.load_directory(os.path.join(hetero, '*.sdt'), verbose=False)
@@ -0,0 +1,65 @@
+"""
+Test for the parsed-data cache of ``data.lib.read_spcm``: cached reads must 
+equal text reads, and the cache must be rebuilt when the file or the parse 
+options change.
+"""
+
+import os
+import shutil
+
+import numpy as np
+
+from KinetiKit import data
+
+ex_data = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+                       os.pardir, 'examples', 'ex_data')
+source = os.path.join(ex_data, 'hetero', 'het_n=1_TRPL.asc')
+
+
+def test_cached_read(tmp_path):
+    filename = shutil.copy(source, tmp_path)
+    parsed = data.lib.read_spcm(filename)
+    first = data.lib.read_spcm(filename, cache=True)
+    assert os.path.exists(data.lib.cache_path(filename))
+    cached = data.lib.read_spcm(filename, cache=True)
+    assert isinstance(cached['y'], np.memmap)
+    for key in ['x', 'y']:
+        assert np.array_equal(first[key], parsed[key])
+        assert np.array_equal(cached[key], parsed[key])
+    assert cached['header'] == parsed['header']
+    
+    # data objects modify their arrays without touching the cache
+    do = data.lib.data_from_SPCM(filename, skip_h=154, skip_f=884, coll=900,
+                                 cache=True)
+    do = data.lib.data_from_SPCM(filename, skip_h=154, skip_f=884, coll=900,
+                                 cache=True)
+    ref = data.lib.data_from_SPCM(filename, skip_h=154, skip_f=884, coll=900)
+    assert np.array_equal(do.x, ref.x) and np.array_equal(do.y, ref.y)
+    assert np.array_equal(data.lib.read_spcm(filename, cache=True)['y'], 
+                          parsed['y'])
+
+
+def test_invalidation(tmp_path):
+    filename = shutil.copy(source, tmp_path)
+    cache_dir = os.path.join(tmp_path, 'cache')
+    data.lib.read_spcm(filename, cache=True, cache_dir=cache_dir)
+    assert len(os.listdir(cache_dir)) == 1
+    
+    # different parse options
+    cropped = data.lib.read_spcm(filename, skip_h=154, skip_f=884, 
+                                 cache=True, cache_dir=cache_dir)
+    assert len(cropped['y']) == len(data.lib.read_spcm(
+        filename, skip_h=154, skip_f=884)['y'])
+    
+    # modified file
+    with open(filename) as file:
+        lines = file.read().splitlines()
+    with open(filename, 'w') as file:
+        file.write('\n'.join(lines[:154] + ['0,0'] + lines[154:]))
+    os.utime(filename, ns=(0, 0))
+    updated = data.lib.read_spcm(filename, skip_h=154, skip_f=884, 
+                                 cache=True, cache_dir=cache_dir)
+    assert len(updated['y']) == len(cropped['y']) + 1
+    
+    data.lib.clear_cache(filename, cache_dir=cache_dir)
+    assert os.listdir(cache_dir) == []
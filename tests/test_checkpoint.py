@@ -0,0 +1,128 @@
+"""
+Test for checkpointing and resuming differential evolution with
+``fit.lib.fit_DE``.
+"""
+
+import os
+import time
+import pickle
+import threading
+
+import numpy as np
+import pytest
+import scipy as sp
+import scipy.optimize
+
+from KinetiKit import fit
+
+bounds = [(-2, 2)] * 4
+de_args = {'seed': 1, 'maxiter': 40, 'polish': False}
+
+
+def test_matches_scipy():
+    result = fit.lib.fit_DE(sp.optimize.rosen, bounds, **de_args)
+    reference = sp.optimize.differential_evolution(sp.optimize.rosen, bounds,
+                                                   **de_args)
+    assert np.array_equal(result.x, reference.x)
+    assert result.nfev == reference.nfev and result.nit == reference.nit
+    assert result.resumed is None
+
+
+def test_preempt_and_resume(tmpdir):
+    checkpoint = os.path.join(str(tmpdir), 'fit.ckpt')
+    reference = fit.lib.fit_DE(sp.optimize.rosen, bounds, **de_args)
+    
+    stop = threading.Event()
+    def callback(result):
+        if result.nit == 15:
+            stop.set()
+    state = {'cache': np.arange(3)}
+    preempted = fit.lib.fit_DE(sp.optimize.rosen, bounds, checkpoint=checkpoint,
+                               stop=stop, callback=callback, state=state,
+                               **de_args)
+    assert not preempted.success and preempted.nit == 16
+    saved = fit.lib.load_checkpoint(checkpoint)
+    assert saved['nit'] == 16 and not saved['done']
+    assert saved['population'].shape == (60, 4)
+    
+    restored = {}
+    resumed = fit.lib.fit_DE(sp.optimize.rosen, bounds, checkpoint=checkpoint,
+                             interval=0, state=restored, **de_args)
+    assert resumed.resumed == 16
+    assert np.array_equal(restored['cache'], np.arange(3))
+    # same trajectory as the uninterrupted fit
+    assert np.array_equal(resumed.x, reference.x)
+    assert resumed.nfev == reference.nfev and resumed.nit == reference.nit
+    assert fit.lib.load_checkpoint(checkpoint)['done']
+    
+    # a finished fit is not evolved further
+    again = fit.lib.fit_DE(sp.optimize.rosen, bounds, checkpoint=checkpoint,
+                           **dict(de_args, polish=True))
+    assert again.nit == reference.nit and again.fun <= reference.fun
+    
+    with pytest.raises(ValueError):
+        fit.lib.fit_DE(sp.optimize.rosen, [(-1, 1)] * 4, 
+                       checkpoint=checkpoint, **de_args)
+    
+    # the internal state is only resumed with the same scipy version
+    saved = fit.lib.load_checkpoint(checkpoint)
+    assert saved['scipy'] == sp.__version__
+    saved['scipy'] = '0.0.0'
+    with open(checkpoint, 'wb') as f:
+        pickle.dump(saved, f)
+    with pytest.raises(ValueError):
+        fit.lib.fit_DE(sp.optimize.rosen, bounds, checkpoint=checkpoint,
+                       **de_args)
+
+def test_falls_back_without_solver_internals(tmpdir, monkeypatch):
+    # as with a scipy version that renamed the private solver
+    from KinetiKit.fit.lib import _checkpoint
+    monkeypatch.setattr(_checkpoint, 'DifferentialEvolutionSolver', None)
+    checkpoint = os.path.join(str(tmpdir), 'fit.ckpt')
+    reference = sp.optimize.differential_evolution(sp.optimize.rosen, bounds,
+                                                   **de_args)
+    with pytest.warns(RuntimeWarning):
+        result = fit.lib.fit_DE(sp.optimize.rosen, bounds,
+                                checkpoint=checkpoint, **de_args)
+    assert np.array_equal(result.x, reference.x)
+    assert result.resumed is None and not os.path.exists(checkpoint)
+    
+    with pytest.warns(RuntimeWarning):
+        stopped = fit.lib.fit_DE(sp.optimize.rosen, bounds, 
+                                 stop=lambda: True, **de_args)
+    assert stopped.message == 'Preempted.' and not stopped.success
+
+def test_time_budget_returns_best_so_far():
+    def slow_rosen(x):
+        time.sleep(2e-4)
+        return sp.optimize.rosen(x)
+    budget = 0.5
+    result = fit.lib.fit_DE(slow_rosen, bounds, seed=1, maxiter=10000,
+                            tol=0, budget=budget, monitor=lambda p: False)
+    assert result.message == 'Time budget exhausted.' and not result.success
+    # stops before the projected next generation would exceed the budget,
+    # allowing for generations slower than the average on a loaded machine
+    generation = np.diff([0] + [p['elapsed'] for p in result.history]).max()
+    assert result.elapsed <= budget + 2*generation
+    assert result.fun == slow_rosen(result.x)
+
+def test_stall_and_evaluation_limits():
+    stalled = fit.lib.fit_DE(sp.optimize.rosen, bounds, seed=1, maxiter=10000,
+                             tol=0, patience=5, stall_tol=0.5)
+    assert stalled.message.startswith('Best cost stalled') and stalled.success
+    capped = fit.lib.fit_DE(sp.optimize.rosen, bounds, seed=1, maxiter=10000,
+                            tol=0, max_nfev=500)
+    assert 500 <= capped.nfev < 500 + 15*len(bounds)
+    assert not capped.success
+
+def test_monitor_logs_population_spread():
+    log = []
+    def monitor(progress):
+        log.append(progress)
+        return progress['nit'] == 20
+    result = fit.lib.fit_DE(sp.optimize.rosen, bounds, monitor=monitor,
+                            **de_args)
+    assert result.nit == 20 and len(result.history) == 20
+    assert log[0]['spread'].shape == (len(bounds),)
+    assert log[-1]['spread'].mean() < log[0]['spread'].mean()
+    assert np.all(np.diff([p['fun'] for p in log]) <= 0)
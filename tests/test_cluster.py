@@ -0,0 +1,202 @@
+"""
+Test for distributing fits with ``fit.lib.Coordinator`` to worker processes
+on localhost, including workers that disconnect or fall silent.
+"""
+
+import os
+import sys
+import time
+import socket
+import struct
+import threading
+import subprocess
+
+import numpy as np
+import pytest
+
+from KinetiKit import fit
+from KinetiKit.fit.lib._batch import _prepare_job
+from KinetiKit.fit.lib._cluster import _send, _receive
+from KinetiKit.units import ns
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def fake_worker(address, token='secret'):
+    """ Connects, accepts one fit and returns the socket. """
+    sock = socket.create_connection(address)
+    _send(sock, {'type': 'hello', 'name': 'fake', 'slots': 1, 
+                 'token': token})
+    assert _receive(sock)['type'] == 'welcome'
+    assert _receive(sock)['type'] == 'task'
+    return sock
+
+
+def test_coordinator(tmp_path, write_trace):
+    taus = [1.5*ns, 2*ns, 2.5*ns, 3*ns]
+    for i, tau in enumerate(taus):
+        write_trace(str(tmp_path / ('s%i.asc' % i)), tau)
+    with open(str(tmp_path / 'job.json'), 'w') as f:
+        f.write('{"model": "Biexp", "method": "LS", "data": "*.asc",'
+                ' "params": {"A1": 1, "tau1": "1 ns", "tau2": "1 ns"},'
+                ' "bounds": {"tau1": ["0.1 ns", "10 ns"]},'
+                ' "time": {"N": 500, "reprate": "80 MHz"},'
+                ' "irf": {"fwhm": "100 ps"},'
+                ' "load": {"skip_h": 0, "skip_f": 0}}')
+    jobs = fit.lib.load_jobs(str(tmp_path / 'job.json'))
+    output = str(tmp_path / 'out')
+    
+    coordinator = fit.lib.Coordinator(jobs, ('127.0.0.1', 0), output=output,
+                                      heartbeat=0.2, timeout=1., 
+                                      token='secret', verbose=False)
+    coordinator.start()
+    address = coordinator.address
+    
+    # refused without the right token
+    for token in (None, 'wrong', 42):
+        sock = socket.create_connection(address)
+        _send(sock, {'type': 'hello', 'slots': 1, 'token': token})
+        assert _receive(sock)['type'] == 'shutdown'
+        sock.close()
+    
+    # a worker that disconnects and one that falls silent with a fit each
+    fake_worker(address).close()
+    silent = fake_worker(address)
+    
+    env = dict(os.environ, PYTHONPATH=root, MPLBACKEND='Agg')
+    workers = [subprocess.Popen([sys.executable, '-m', 
+                                 'KinetiKit.fit.lib._cluster',
+                                 '%s:%i' % address, '-w', '1', '--name',
+                                 'w%i' % i, '--token', 'secret'], env=env,
+                                stdout=subprocess.DEVNULL)
+               for i in range(2)]
+    try:
+        assert coordinator.wait(timeout=120)
+    finally:
+        summary = coordinator.stop()
+        for worker in workers:
+            assert worker.wait(timeout=60) == 0
+        silent.close()
+    
+    assert summary['errors'] == [] and summary['fits'] == 4
+    assert summary['retries'] == 2
+    assert sum(summary['workers'].values()) == 4
+    assert set(summary['workers']) <= {'w0', 'w1'}
+    fitted = {os.path.basename(r['filename']): r['params']['tau1'] 
+              for r in summary['results']}
+    for i, tau in enumerate(taus):
+        assert np.isclose(fitted['s%i.asc' % i], tau, rtol=1e-2)
+    assert os.path.exists(os.path.join(output, 'job_results.csv'))
+
+
+def test_retries_exhausted(tmp_path, write_trace):
+    write_trace(str(tmp_path / 'a.asc'), 2*ns)
+    job = _prepare_job(
+        {'model': 'Biexp', 'data': 'a.asc', 'bounds': {'tau1': [1e-10, 1e-8]}},
+        {}, str(tmp_path), 'job')
+    coordinator = fit.lib.Coordinator([job], ('127.0.0.1', 0), retries=1,
+                                      output=str(tmp_path / 'out'),
+                                      verbose=False)
+    coordinator.start()
+    for i in range(2):
+        fake_worker(coordinator.address, token=None).close()
+    assert coordinator.wait(timeout=30)
+    summary = coordinator.stop()
+    assert summary['fits'] == 0 and len(summary['errors']) == 1
+    assert 'lost 2 times' in summary['errors'][0][2]
+
+
+def test_network_address_requires_token(tmp_path):
+    with pytest.raises(ValueError):
+        fit.lib.Coordinator([], ('0.0.0.0', 0), output=str(tmp_path))
+    coordinator = fit.lib.Coordinator([], ('0.0.0.0', 0), token='secret',
+                                      output=str(tmp_path))
+    assert coordinator.address == ('0.0.0.0', 0)
+
+
+def test_handshake_limits(tmp_path, monkeypatch):
+    # peers without a token may neither send large messages nor hang
+    from KinetiKit.fit.lib import _cluster
+    monkeypatch.setattr(_cluster, '_HANDSHAKE_TIMEOUT', 0.5)
+    coordinator = fit.lib.Coordinator([], ('127.0.0.1', 0), token='secret',
+                                      output=str(tmp_path), verbose=False)
+    coordinator.start()
+    try:
+        sock = socket.create_connection(coordinator.address)
+        sock.sendall(struct.pack('>I', 1 << 31))
+        assert _receive(sock) is None
+        sock.close()
+        sock = socket.create_connection(coordinator.address)
+        sock.settimeout(30)
+        start = time.time()
+        assert _receive(sock) is None
+        assert time.time() - start < 10
+        sock.close()
+    finally:
+        coordinator.stop()
+
+
+def test_slow_worker_does_not_block_dispatch(tmp_path):
+    # a worker that stops reading while it is sent a large file
+    with open(str(tmp_path / 'a_large.asc'), 'wb') as f:
+        f.write(b'0' * (64 << 20))
+    with open(str(tmp_path / 'b.asc'), 'w') as f:
+        f.write('0,1\n')
+    job = _prepare_job(
+        {'model': 'Biexp', 'data': '*.asc', 'bounds': {'tau1': [1e-10, 1e-8]}},
+        {}, str(tmp_path), 'job')
+    coordinator = fit.lib.Coordinator([job], ('127.0.0.1', 0),
+                                      output=str(tmp_path / 'out'),
+                                      verbose=False)
+    coordinator.start()
+    stalled = socket.create_connection(coordinator.address)
+    stalled.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 12)
+    try:
+        _send(stalled, {'type': 'hello', 'slots': 1})
+        assert _receive(stalled)['type'] == 'welcome'
+        time.sleep(0.5)
+        other = socket.create_connection(coordinator.address)
+        other.settimeout(10)
+        _send(other, {'type': 'hello', 'slots': 1})
+        assert _receive(other)['type'] == 'welcome'
+        task = _receive(other)
+        assert task['type'] == 'task' and task['filename'].endswith('b.asc')
+        other.close()
+    finally:
+        stalled.close()
+        coordinator.stop()
+
+
+def test_worker_reconnects_and_refuses_host_options(tmp_path):
+    # a fake coordinator that falls silent, then hands out an unsafe fit
+    server = socket.create_server(('127.0.0.1', 0))
+    server.settimeout(30)
+    worker = fit.lib.FitWorker(server.getsockname()[:2], workers=1,
+                               connect_timeout=10)
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    
+    sock, _ = server.accept()
+    assert _receive(sock)['type'] == 'hello'
+    _send(sock, {'type': 'welcome', 'heartbeat': 0.1, 'timeout': 0.5})
+    sock.settimeout(30)
+    start = time.time()
+    again, _ = server.accept()
+    assert time.time() - start < 10
+    sock.close()
+    
+    again.settimeout(30)
+    assert _receive(again)['type'] == 'hello'
+    _send(again, {'type': 'welcome', 'heartbeat': 0.1, 'timeout': 30})
+    job = {'name': 'job', 'model': 'Biexp', 'bounds': {'tau1': [1e-10, 1e-8]},
+           'fit': {'checkpoint': str(tmp_path / 'evil.ckpt')}}
+    _send(again, {'type': 'task', 'task': 0, 'filename': 'a.asc', 'job': job})
+    reply = _receive(again)
+    while reply['type'] == 'heartbeat':
+        reply = _receive(again)
+    assert reply['type'] == 'error' and 'checkpoint' in reply['error']
+    _send(again, {'type': 'shutdown'})
+    thread.join(30)
+    assert not thread.is_alive()
+    again.close()
+    server.close()
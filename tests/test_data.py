@@ -0,0 +1,48 @@
+"""
+Test for importing Becker & Hickl SPCM .asc files from the example data.
+"""
+
+import os
+
+import numpy as np
+
+from KinetiKit import data
+from KinetiKit.units import ns
+
+ex_data = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+                       os.pardir, 'examples', 'ex_data')
+meta_path = os.path.join(ex_data, 'dark.asc')
+plain_path = os.path.join(ex_data, 'hetero', 'het_n=1_TRPL.asc')
+
+
+def test_read_spcm_header():
+    spcm = data.lib.read_spcm(meta_path)
+    assert spcm['header']['Title'] == 'dark'
+    assert spcm['sys_par']['SP_ADC_RE'] == 4096
+    assert len(spcm['x']) == len(spcm['y']) == 4096
+    
+def test_metadata_located_by_marker():
+    do = data.lib.data_from_SPCM(meta_path, metadata=True, weigh_by_coll=False)
+    assert do.coll == do.sys_par['SP_COL_T']
+    assert len(do.y) == 4096 and do.x[0] == 0
+    cropped = data.lib.data_from_SPCM(meta_path, metadata=True, autocrop=True)
+    assert len(cropped.y) < 4096
+
+def test_skip_lines_match_genfromtxt():
+    do = data.lib.data_from_SPCM(plain_path, skip_h=154, skip_f=884, 
+                                 weigh_by_coll=False)
+    x, y = np.genfromtxt(plain_path, delimiter=',', unpack=True, 
+                         skip_header=154, skip_footer=884)
+    assert np.array_equal(do.y, y)
+    assert np.allclose(do.x, (x - x[0])*ns)
+
+def test_block_with_comment_lines(tmpdir):
+    filename = str(tmpdir.join('commented.asc'))
+    with open(filename, 'w') as f:
+        f.write('# time (ns), counts\n0,1\n# gate opened\n1,4\n2,9\n')
+    spcm = data.lib.read_spcm(filename, skip_h=0, skip_f=0)
+    x, y = np.genfromtxt(filename, delimiter=',', unpack=True)
+    assert np.array_equal(spcm['x'], x) and np.array_equal(spcm['y'], y)
+    do = data.lib.data_from_SPCM(filename, skip_h=0, skip_f=0,
+                                 weigh_by_coll=False)
+    assert np.array_equal(do.y, [1, 4, 9])
@@ -0,0 +1,49 @@
+"""
+Test for batched preprocessing of the example heterostructure traces with
+``data.lib.DataSet``, compared to processing each data object separately.
+"""
+
+import os
+import glob
+
+import numpy as np
+
+from KinetiKit import data, sim
+from KinetiKit.units import nW
+
+ex_data = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+                       os.pardir, 'examples', 'ex_data')
+filenames = sorted(glob.glob(os.path.join(ex_data, 'hetero', '*.asc')))
+to = sim.time.linear(N=1000)
+
+objects = [data.lib.data_from_SPCM(f, skip_h=154, skip_f=884, coll=900, 
+                                   key=os.path.basename(f), 
+                                   pulse_power=(i+1)*100*nW)
+           for i, f in enumerate(filenames)]
+dark = data.lib.data_from_SPCM(os.path.join(ex_data, 'dark.asc'), 
+                               skip_h=354, skip_f=884, coll=300)
+
+
+def test_batch_matches_single_traces():
+    dataset = data.lib.DataSet.from_objects(objects)
+    dataset.dark_subtract(dark, method='elementwise')
+    dataset.smooth()
+    dataset.interp(to)
+    dataset.remove_zeros()
+    peaks = dataset.extract_peak()
+    for do, y, peak in zip(objects, dataset.y, peaks):
+        do = do.copy()
+        do.dark_subtract(dark, method='elementwise')
+        do.smooth()
+        do.interp(to)
+        do.remove_zeros()
+        assert np.allclose(do.y, y)
+        assert np.isclose(do.extract_peak(), peak)
+
+def test_metadata_columns():
+    dataset = data.lib.DataSet.from_objects(objects, t=to)
+    assert len(dataset) == len(filenames)
+    assert dataset.y.shape == (len(filenames), 1000)
+    high = dataset.select(pulse_power=200*nW)
+    assert len(high) == 1 and high.key[0] == os.path.basename(filenames[1])
+    assert list(dataset.sorted_by('pulse_power').key) == list(dataset.key)
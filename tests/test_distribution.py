@@ -0,0 +1,41 @@
+"""
+Test for recovering a lifetime distribution from simulated biexponential 
+traces using a precomputed lifetime kernel.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns
+
+#--- Creating Time Object and kernel
+to = sim.time.linear(N=1000)
+kernel = fit.lib.LifetimeKernel(to, num=60)
+
+#--- Two-lifetime distribution (0.5 ns and 3 ns) plus noise
+taus = kernel.taus
+amplitudes = np.zeros(kernel.shape[1])
+amplitudes[np.argmin(abs(taus - 0.5*ns))] = 1
+amplitudes[np.argmin(abs(taus - 3*ns))] = 0.5
+trace = kernel.matrix @ amplitudes
+rng = np.random.default_rng(0)
+traces = trace * (1 + 0.01*rng.standard_normal((20, len(trace))))
+
+
+def test_nnls_recovers_lifetimes():
+    result = kernel.fit(traces, method='nnls', alpha=1e-4)
+    assert result['amplitudes'].shape == (20, len(taus))
+    assert np.all(result['amplitudes'] >= 0)
+    dist = result['amplitudes'].mean(axis=0)
+    short = dist[taus < 1.5*ns].sum(); long = dist[taus >= 1.5*ns].sum()
+    assert short > long > 0
+    
+def test_maxent_single_trace():
+    result = kernel.fit(traces[0], method='maxent', alpha=1e-4)
+    assert result['amplitudes'].shape == (len(taus),)
+    assert result['residual'] < 0.05
+    
+def test_shortcut_aligns_data():
+    result = fit.lib.lifetime_distribution(np.roll(trace, 37), to, align=True,
+                                           kernel_args={'num': 60})
+    assert result['residual'] < 0.1
@@ -0,0 +1,56 @@
+"""
+Test for pixel-wise fitting of a synthetic FLIM cube, whose lifetime 
+increases along the columns, with ``fit.lib.FLIMFitter``.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns, ps
+
+to = sim.time.linear(N=256)
+dtime = to['array'][::to['subsample']]
+irf_args = {'fwhm': 100*ps}
+
+rows, cols = 6, 10
+tau_map = np.tile(np.linspace(0.5, 3, cols)*ns, (rows, 1))
+system = sim.systems.Biexp(A1=1, tau1=tau_map.reshape(-1, 1), tau2=1*ns)
+pl = sim.lib.convolve_irf(np.array(system.PLsig(dtime)), dtime, irf_args)
+pl = np.roll(pl / pl.max(axis=-1, keepdims=True), 37, axis=-1)
+cube = (1000 * pl + 5).reshape(rows, cols, -1)
+
+
+def test_bin_cube():
+    binned = fit.lib.bin_cube(cube, 1)
+    assert binned.shape == cube.shape
+    assert np.allclose(binned[2, 3], cube[1:4, 2:5].sum(axis=(0, 1)))
+    assert np.allclose(binned[0, 0], cube[:2, :2].sum(axis=(0, 1)))
+    blocks = fit.lib.bin_cube(cube, 3, mode='block')
+    assert blocks.shape == (2, 3, cube.shape[-1])
+    assert np.allclose(blocks[1, 2], cube[3:6, 6:9].sum(axis=(0, 1)))
+
+
+def test_basis_fit():
+    fitter = fit.lib.FLIMFitter(to, irf_args, chunk_size=25)
+    maps = fitter.fit_basis(cube)
+    assert maps['tau'].shape == (rows, cols, 1)
+    assert np.allclose(maps['tau'][..., 0], tau_map, rtol=5e-3)
+    assert maps['mask'].all()
+    
+    # spatial binning in a process pool
+    pooled = fit.lib.FLIMFitter(to, irf_args, spatial_bin=1, chunk_size=25,
+                                workers=2).fit_basis(cube, onset=maps['onset'])
+    assert np.allclose(pooled['counts'][2, 2], cube[1:4, 1:4].sum())
+    assert np.allclose(pooled['tau'][:, 1:-1, 0], tau_map[:, 1:-1], rtol=3e-2)
+
+
+def test_model_fit():
+    noisy = np.random.default_rng(0).poisson(cube).astype(float)
+    fitter = fit.lib.FLIMFitter(to, irf_args, min_counts=1e9)
+    assert not fitter.fit_basis(noisy)['mask'].any()
+    
+    fitter = fit.lib.FLIMFitter(to, irf_args)
+    start = sim.systems.Biexp(A1=1, tau1=1*ns, tau2=1*ns)
+    maps = fitter.fit_model(noisy, start, {'tau1': (0.1*ns, 10*ns)})
+    assert np.allclose(maps['tau1'], tau_map, rtol=0.1)
+    assert np.isclose(np.median(maps['tau1'] / tau_map), 1, atol=0.01)
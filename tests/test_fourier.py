@@ -0,0 +1,33 @@
+"""
+Test for comparing a biexponential simulation to shifted data in the Fourier
+domain with ``fit.lib.FourierComparison``.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns, ps
+
+#--- Creating Time Object and data
+to = sim.time.linear(N=1000)
+dtime = to['array'][::to['subsample']]
+irf_args = {'fwhm': 100*ps}
+
+system = sim.systems.Biexp(A1=0.7, tau1=0.5*ns, tau2=3*ns)
+pl, converged = sim.lib.simulate_func(system, dtime)
+data = np.roll(sim.lib.convolve_irf(pl, dtime, irf_args), 123) * 40
+
+
+def test_exact_parameters_give_zero_cost():
+    comparison = fit.lib.FourierComparison(data, to, irf_args)
+    assert comparison.harmonics < len(dtime)//2
+    args = fit.lib.sac_args({'tau1': 0}.keys(), system, comparison, to, None)
+    assert fit.lib.simulate_and_compare([0.5*ns], *args) < 1e-12
+    assert fit.lib.simulate_and_compare([0.6*ns], *args) > 1e-4
+
+def test_aligned_traces_match_data():
+    comparison = fit.lib.FourierComparison(np.vstack((data, data)), to, 
+                                           irf_args, norm=False)
+    al_data, al_sims, shift = comparison.aligned(np.vstack((pl, pl)))
+    assert np.allclose(al_data, al_sims)
+    assert np.isclose(shift, 123*(dtime[1] - dtime[0]))
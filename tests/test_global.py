@@ -0,0 +1,59 @@
+"""
+Test for the global fit of biexponential traces sharing their long lifetime,
+with ``fit.lib.GlobalFitter``.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns, ps
+
+#--- Creating Time Object and data
+to = sim.time.linear(N=1000)
+dtime = to['array'][::to['subsample']]
+irf_args = {'fwhm': 100*ps}
+
+tau1s = [0.3*ns, 0.5*ns, 0.8*ns, 1.1*ns, 1.5*ns, 0.4*ns]
+tau2 = 4*ns
+traces = []
+for tau1 in tau1s:
+    system = sim.systems.Biexp(A1=0.6, tau1=tau1, tau2=tau2)
+    pl, converged = sim.lib.simulate_func(system, dtime)
+    traces.append(sim.lib.convolve_irf(pl, dtime, irf_args))
+
+guess = sim.systems.Biexp(A1=0.6, tau1=0.7*ns, tau2=2.5*ns)
+
+
+def make_fitter(**kwargs):
+    gf = fit.lib.GlobalFitter(shared={'tau2': (1*ns, 10*ns)},
+                              local={'tau1': (0.1*ns, 2*ns)}, **kwargs)
+    for trace in traces:
+        gf.add(guess, trace, to, None, irf_args=irf_args)
+    return gf
+
+def test_shared_and_local_parameters_are_recovered():
+    result = make_fitter().fit()
+    assert result['success']
+    assert np.isclose(result['shared']['tau2'], tau2, rtol=1e-4)
+    assert np.allclose([local['tau1'] for local in result['local']], tau1s,
+                       rtol=1e-4)
+    assert len(result['residuals']) == len(traces)
+    # the guess system itself is left untouched
+    assert guess.tau2 == 2.5*ns
+
+def test_jacobian_is_block_sparse():
+    gf = make_fitter()
+    structure, sizes = gf.sparsity()
+    assert structure.shape == (sum(sizes), 1 + len(traces))
+    assert structure[:, 0].sum() == sum(sizes)
+    assert structure.sum() == 2*sum(sizes)
+
+def test_sparse_fit_needs_fewer_evaluations():
+    sparse = make_fitter().fit(max_nfev=5)
+    dense = make_fitter().fit(max_nfev=5, sparse=False)
+    assert sparse['nfev'] < dense['nfev']
+
+def test_parallel_fit_matches_serial():
+    serial = make_fitter().fit(max_nfev=5)
+    parallel = make_fitter(workers=2).fit(max_nfev=5)
+    assert np.allclose(serial['x'], parallel['x'])
@@ -0,0 +1,28 @@
+"""
+Test for the batch behavior of the array helpers of ``KinetiKit.kit``.
+"""
+
+import numpy as np
+
+from KinetiKit import kit as kin_kit
+
+rng = np.random.default_rng(0)
+batch = rng.random((3, 4, 50))
+batch[1, 2] *= -1
+
+
+def test_normalized_batch():
+    norm = kin_kit.normalized(batch, alert=False)
+    assert norm.shape == batch.shape
+    assert np.allclose(norm[0, 0], batch[0, 0] / batch[0, 0].max())
+    assert np.array_equal(norm[1, 2], batch[1, 2])
+    out = np.empty_like(batch)
+    kin_kit.normalized(batch, alert=False, out=out)
+    assert np.array_equal(out, norm)
+
+def test_make_2d_and_precision():
+    assert kin_kit.make_2d(batch).shape == (12, 50)
+    assert kin_kit.make_2d(batch[0, 0]).shape == (1, 50)
+    assert kin_kit.precision(12.345) == 3
+    assert np.array_equal(kin_kit.precision(np.array([[1., 0.25], [3, 2.5]])),
+                          [[1, 2], [1, 1]])
@@ -0,0 +1,85 @@
+"""
+Test for the phasor analysis of periodic decays with ``fit.lib.phasor`` and
+related functions, calibrated with a measured and a simulated IRF.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns, ps
+
+to = sim.time.linear(N=1024)
+dtime = to['array'][::to['subsample']]
+period = to['period']
+irf_args = {'fwhm': 100*ps}
+onset = 2*ns
+
+irf = np.exp(-0.5 * ((dtime - onset) / (irf_args['fwhm'] / 2.3548))**2)
+
+
+def decays(taus, fractions=(1,)):
+    """ Periodic decays convolved with the IRF, one row per lifetime set. """
+    taus = np.atleast_2d(taus)
+    fractions = np.asarray(fractions, dtype=float)
+    pure = sum(f * np.exp(-dtime / tau[:, None]) / (1 - np.exp(-period / tau[:, None]))
+               for f, tau in zip(fractions, taus.T))
+    return np.fft.irfft(np.fft.rfft(pure) * np.fft.rfft(irf), len(dtime))
+
+
+def test_single_exponential():
+    taus = np.linspace(0.3, 4, 20) * ns
+    traces = decays(taus[:, None])
+    calibration = fit.lib.phasor_calibration(irf, t=to)
+    phasors = fit.lib.phasor(traces, t=to, calibration=calibration)
+    assert phasors.shape == (20,)
+    # on the universal semicircle
+    assert np.allclose(np.abs(phasors - 0.5), 0.5, atol=5e-3)
+    tau_phase, tau_mod = fit.lib.phasor_lifetimes(phasors, period)
+    assert np.allclose(tau_phase, taus, rtol=2e-2)
+    assert np.allclose(tau_mod, taus, rtol=2e-2)
+
+    # simulated IRF and a reference of known lifetime give the same result
+    simulated = fit.lib.phasor_calibration(t=to, irf_args=irf_args, onset=onset)
+    reference = fit.lib.phasor_calibration(decays([[2*ns]])[0], t=to,
+                                           tau_ref=2*ns)
+    for other in (simulated, reference):
+        assert np.allclose(fit.lib.phasor(traces, t=to, calibration=other),
+                           phasors, atol=1e-2)
+
+    # several harmonics at once
+    both = fit.lib.phasor(traces, t=to, harmonic=[1, 2],
+                          calibration=fit.lib.phasor_calibration(
+                              irf, t=to, harmonic=[1, 2]))
+    assert both.shape == (20, 2)
+    assert np.allclose(both[:, 0], phasors)
+    tau_phase2, _ = fit.lib.phasor_lifetimes(both[:, 1], period, harmonic=2)
+    assert np.allclose(tau_phase2, taus, rtol=3e-2)
+
+
+def test_mixture_and_clusters():
+    tau_phase, tau_mod = fit.lib.phasor_lifetimes(
+        fit.lib.phasor(decays([[0.5*ns, 3*ns]], (1, 1)), t=to,
+                       calibration=fit.lib.phasor_calibration(irf, t=to)),
+        period)
+    assert 0.5*ns < tau_phase[0] < tau_mod[0] < 3*ns
+
+    # two populations of pixels, with noise and an empty pixel
+    rng = np.random.default_rng(0)
+    taus = np.where(np.arange(100) % 2, 0.6, 3)[:, None] * ns
+    taus = taus * rng.normal(1, 0.03, taus.shape)
+    traces = rng.poisson(2000 * decays(taus) / decays(taus).max()).astype(float)
+    traces[8] = 0
+    phasors = fit.lib.phasor(traces.reshape(10, 10, -1), t=to,
+                             calibration=fit.lib.phasor_calibration(irf, t=to))
+    assert phasors.shape == (10, 10)
+    labels, clusters = fit.lib.phasor_clusters(phasors, 2, period, seed=0)
+    assert labels.shape == (10, 10)
+    assert labels.ravel()[8] == -1
+
+    fast, slow = clusters
+    assert fast['size'] + slow['size'] == 99
+    assert np.allclose(fast['tau_phase'], 0.6*ns, rtol=5e-2)
+    assert np.allclose(slow['tau_phase'], 3*ns, rtol=5e-2)
+    assert fast['bounds'][0] < 0.6*ns < fast['bounds'][1] < 3*ns
+    assert slow['bounds'][0] < 3*ns < slow['bounds'][1]
+    assert (labels.ravel()[1::2] == 0).all()
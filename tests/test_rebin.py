@@ -0,0 +1,70 @@
+"""
+Test for integral-preserving rebinning of histograms with ``data.lib.rebin``,
+of single data objects and of datasets.
+"""
+
+import os
+import glob
+
+import numpy as np
+import pytest
+
+from KinetiKit import data, sim
+
+ex_data = os.path.join(os.path.dirname(os.path.realpath(__file__)), 
+                       os.pardir, 'examples', 'ex_data')
+filenames = sorted(glob.glob(os.path.join(ex_data, 'hetero', '*.asc')))
+
+
+def test_integer_factor():
+    x = np.arange(10.)
+    y = np.arange(20.).reshape(2, 10)
+    x_new, y_new, var_new = data.lib.rebin(x, y, factor=3)
+    assert np.array_equal(x_new, [0, 3, 6])
+    assert np.array_equal(y_new[1], [33, 42, 51])
+    assert np.array_equal(var_new, y_new)
+
+
+def test_edges():
+    rng = np.random.default_rng(0)
+    x = np.linspace(0, 1, 100, endpoint=False)
+    y = rng.poisson(50, size=(3, 100)).astype(float)
+    
+    # edges on old bin boundaries equal summing whole bins
+    _, y_factor, var_factor = data.lib.rebin(x, y, factor=4)
+    x_new, y_new, var_new = data.lib.rebin(x, y, edges=np.append(x[::4], 1))
+    assert np.allclose(y_new, y_factor) and np.allclose(var_new, var_factor)
+    
+    # arbitrary edges preserve the integral
+    edges = np.sort(np.concatenate(([0, 1], rng.uniform(0, 1, 30))))
+    x_new, y_new, var_new = data.lib.rebin(x, y, edges=edges)
+    assert np.allclose(y_new.sum(axis=-1), y.sum(axis=-1))
+    assert np.all(var_new <= y_new + 1e-9)
+    
+    with pytest.raises(ValueError):
+        data.lib.rebin(x, y)
+
+
+def test_data_objects():
+    to = sim.time.linear(N=1000)
+    objects = [data.lib.data_from_SPCM(f, skip_h=154, skip_f=884, coll=900) 
+               for f in filenames]
+    dataset = data.lib.DataSet.from_objects(objects)
+    total = dataset.y.sum(axis=-1)
+    
+    for do in objects:
+        do.rebin(edges=to)
+    dataset.rebin(edges=to)
+    assert np.array_equal(dataset.x, to['array'])
+    assert np.allclose(dataset.y, [do.y for do in objects])
+    assert np.allclose(dataset.variance, [do.variance for do in objects])
+    # counts beyond the period of the time axis are discarded
+    assert np.all(dataset.y.sum(axis=-1) <= total + 1e-6)
+    
+    # counts per second: variance is the rate over the collection time
+    dataset = data.lib.DataSet.from_objects(
+        [data.lib.data_from_SPCM(f, skip_h=154, skip_f=884, coll=900) 
+         for f in filenames])
+    dataset.rebin(factor=16)
+    assert dataset.y.shape == (len(filenames), 3069 // 16)
+    assert np.allclose(dataset[1].variance, np.abs(dataset.y[1]) / 900)
@@ -0,0 +1,91 @@
+"""
+Test for writing and reading back fit traces and parameters with the
+``kit`` save and read tools.
+"""
+
+import os
+
+import numpy as np
+
+from KinetiKit import kit
+from KinetiKit.units import ns
+
+
+def traces():
+    t = np.linspace(0, 12.5, 500) * ns
+    return {'Time (s)': t,
+            'data': np.exp(-t / (1.3*ns)) / 3,
+            'sim': np.exp(-t / (1.2*ns)) / 3,
+            'index': np.arange(500)}
+
+
+def test_traces_round_trip(tmpdir):
+    d = traces()
+    filename = os.path.join(str(tmpdir), 'fit1')
+    kit.traces_to_csv(filename, d)
+    
+    with open(filename + '_traces.csv') as f:
+        lines = f.read().splitlines()
+    assert lines[0] == 'Time (s),data,sim,index'
+    # same layout and values as one row per time point with ``astype(str)``
+    assert lines[7] == ','.join(d[key][6].astype(str) for key in d)
+    assert len(lines) == 501
+    
+    read = kit.csv_to_dict(filename + '_traces.csv', headertype='column')
+    assert list(read.keys()) == list(d.keys())
+    for key in d:
+        assert np.array_equal(read[key], d[key])
+    
+    kit.traces_to_csv(filename + 'b', d, fmt='%.6g')
+    read = kit.csv_to_dict(filename + 'b_traces.csv', headertype='column')
+    assert np.allclose(read['data'], d['data'], rtol=1e-5)
+    
+    kit.traces_to_npz(filename, d)
+    read = kit.npz_to_dict(filename + '_traces.npz')
+    assert list(read.keys()) == list(d.keys())
+    assert all(np.array_equal(read[key], d[key]) for key in d)
+
+
+def baseline_traces_csv(dictionary):
+    # text written by the original row-by-row traces_to_csv
+    keys = list(dictionary.keys())
+    text = ','.join(keys) + '\n'
+    for i in range(len(dictionary[keys[0]])):
+        text += ','.join(dictionary[key][i].astype(str) for key in keys)
+        text += '\n'
+    return text
+
+
+def test_traces_csv_matches_baseline(tmpdir):
+    d = traces()
+    d['data32'] = d['data'].astype(np.float32)
+    d['step'] = (np.arange(500) * 0.1).astype(np.float32)
+    d['special'] = np.where(np.arange(500) % 3, np.nan, np.inf) * 1e-20
+    filename = os.path.join(str(tmpdir), 'fit1')
+    kit.traces_to_csv(filename, d)
+    with open(filename + '_traces.csv') as f:
+        text = f.read()
+    assert text == baseline_traces_csv(d)
+    assert text.splitlines()[2].split(',')[5] == '0.1'
+
+
+def test_params_and_save_fit(tmpdir):
+    params = {'Model type': 'Mono', 'k': 2.5e8, 'k_bounds': (1e8, 1e9)}
+    kit.save_fit('sample', traces=traces(), params=params,
+                 destinationfolder=str(tmpdir), figs=False)
+    kit.save_fit('sample', traces=traces(), params=params,
+                 destinationfolder=str(tmpdir), figs=False, 
+                 traces_format='npz')
+    assert os.path.exists(os.path.join(str(tmpdir), 'sample_fit1_traces.csv'))
+    assert os.path.exists(os.path.join(str(tmpdir), 'sample_fit2_traces.npz'))
+    
+    read = kit.csv_to_dict('sample_fit1_params.csv', str(tmpdir))
+    assert list(read.keys()) == ['Model type', 'k', 'k_bounds']
+    assert np.isnan(read['Model type'])
+    assert read['k'] == 2.5e8 and read['k_bounds'] == 1e8
+    
+    # non-numeric traces are read as strings
+    kit.traces_to_csv(os.path.join(str(tmpdir), 'labels'),
+                      {'name': np.array(['a', 'b']), 'value': np.array([1, 2])})
+    read = kit.csv_to_dict('labels_traces.csv', str(tmpdir), 'column')
+    assert list(read['name']) == ['a', 'b'] and list(read['value']) == ['1', '2']
@@ -0,0 +1,78 @@
+"""
+Test for reading a synthetic Becker & Hickl .sdt file with 
+``data.lib.SDTFile``.
+"""
+
+import numpy as np
+
+from KinetiKit import data, sim
+from KinetiKit.data.lib._sdt import _FILE_HEADER, _BLOCK_HEADER, _MEASURE_INFO
+from KinetiKit.units import ns
+
+
+def write_sdt(path, blocks, block_type=0x0, adc_re=256, scan=(0, 0)):
+    """Writes uint16 `blocks` with one measurement description."""
+    info = b'*IDENTIFICATION\r\n  Title : synthetic\r\n*END\r\n'
+    setup = b'*SETUP\r\n  #SP [SP_COL_T,F,20]\r\n*END\r\n'
+    meas = np.zeros((), np.dtype(_MEASURE_INFO))
+    meas['tac_r'] = 50e-9; meas['tac_g'] = 4; meas['adc_re'] = adc_re
+    meas['col_t'] = 20; meas['scan_x'], meas['scan_y'] = scan
+    
+    info_offs = _FILE_HEADER.itemsize
+    setup_offs = info_offs + len(info)
+    meas_offs = setup_offs + len(setup)
+    offset = meas_offs + meas.itemsize
+    
+    fh = np.zeros((), _FILE_HEADER)
+    fh['info_offset'] = info_offs; fh['info_length'] = len(info)
+    fh['setup_offs'] = setup_offs; fh['setup_length'] = len(setup)
+    fh['meas_desc_block_offset'] = meas_offs
+    fh['no_of_meas_desc_blocks'] = 1
+    fh['meas_desc_block_length'] = meas.itemsize
+    fh['data_block_offset'] = offset; fh['no_of_data_blocks'] = len(blocks)
+    
+    body = b''
+    for i, block in enumerate(blocks):
+        raw = block.astype('<u2').tobytes()
+        bh = np.zeros((), _BLOCK_HEADER)
+        bh['block_no'] = i + 1; bh['block_type'] = block_type
+        bh['data_offs'] = offset + _BLOCK_HEADER.itemsize
+        bh['block_length'] = len(raw)
+        offset += _BLOCK_HEADER.itemsize + len(raw)
+        bh['next_block_offs'] = offset
+        body += bh.tobytes() + raw
+    with open(path, 'wb') as f:
+        f.write(fh.tobytes() + info + setup + meas.tobytes() + body)
+
+
+rng = np.random.default_rng(0)
+decays = rng.integers(0, 1000, (2, 256))
+
+
+def test_decay_blocks(tmp_path):
+    path = str(tmp_path / 'decays.sdt')
+    write_sdt(path, [decays[0], decays[1]])
+    sdt = data.lib.SDTFile(path)
+    assert len(sdt) == 2 and sdt.header['Title'] == 'synthetic'
+    assert sdt.sys_par['SP_COL_T'] == 20
+    assert np.array_equal(sdt.decay(1), decays[1])
+    assert not sdt.blocks[0].flags.owndata
+    assert not sdt.blocks[0].flags.writeable
+    assert np.isclose(sdt.times()[1], 50e-9/4/256)
+    
+    do = sdt.data(block=1)
+    assert np.allclose(do.y, decays[1] / 20)
+    raw = sdt.data(block=1, weigh_by_coll=False)
+    raw.dark_subtract(1.)
+    to = sim.time.linear(N=100, period=12*ns)
+    raw.interp(to)
+    assert len(raw.y) == 100
+    assert np.array_equal(sdt.decay(1), decays[1])
+
+def test_image_block(tmp_path):
+    path = str(tmp_path / 'image.sdt')
+    cube = rng.integers(0, 50, (3, 4, 64))
+    write_sdt(path, [cube], block_type=0x60, adc_re=64, scan=(4, 3))
+    sdt = data.lib.SDTFile(path)
+    assert np.array_equal(sdt.blocks[0], cube)
+    assert np.array_equal(sdt.decay(0, curve=5), cube[1, 1])
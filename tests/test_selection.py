@@ -0,0 +1,61 @@
+"""
+Test for ranking candidate models fitted to the same biexponential data with
+``fit.lib.compare_models``.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns, ps
+
+#--- Creating Time Object and data
+to = sim.time.linear(N=1000)
+dtime = to['array'][::to['subsample']]
+irf_args = {'fwhm': 100*ps}
+
+system = sim.systems.Biexp(A1=0.6, tau1=0.5*ns, tau2=4*ns)
+pl, converged = sim.lib.simulate_func(system, dtime)
+rng = np.random.default_rng(0)
+data = sim.lib.convolve_irf(pl, dtime, irf_args)
+data = data / data.max() + rng.normal(0, 1e-3, data.size)
+
+models = {
+    'biexp': {'system': sim.systems.Biexp(A1=0.5, tau1=1*ns, tau2=3*ns),
+              'bounds': {'A1': (0, 1), 'tau1': (0.1*ns, 2*ns),
+                         'tau2': (2*ns, 10*ns)}},
+    'mono': {'system': sim.systems.Biexp(A1=1, tau1=2*ns),
+             'bounds': {'tau1': (0.1*ns, 10*ns)}},
+    }
+
+
+def test_information_criteria():
+    criteria = fit.lib.information_criteria(2., 100, 3)
+    assert np.isclose(criteria['aic'], 100*np.log(0.02) + 6)
+    assert np.isclose(criteria['bic'], 100*np.log(0.02) + 3*np.log(100))
+    assert np.isclose(criteria['chi2_red'], 2/97)
+    assert criteria['aicc'] > criteria['aic']
+
+def test_biexponential_model_is_selected():
+    comparison = fit.lib.compare_models(data, models, to, method='LS',
+                                        sac_kwargs={'irf_args': irf_args},
+                                        workers=0, verbose=False)
+    assert comparison['best'] == 'biexp'
+    best, other = comparison['results']
+    assert best['delta_aic'] == 0 and other['delta_aic'] > 10
+    assert best['weight'] > 0.99
+    assert best['k'] == 3 and other['k'] == 1
+    assert best['n'] == other['n'] > 0
+    assert np.isclose(best['params']['tau2'], 4*ns, rtol=1e-2)
+    assert best['success'] and not best['at_bounds']
+
+def test_parallel_comparison_and_failed_models():
+    broken = dict(models, broken={'system': sim.systems.Biexp(),
+                                  'bounds': {'nonexistent': (0, 1)}})
+    comparison = fit.lib.compare_models(data, broken, to,
+                                        sac_kwargs={'irf_args': irf_args},
+                                        fit_args={'maxiter': 5, 'seed': 1},
+                                        workers=2, verbose=True)
+    assert [name for name, message in comparison['errors']] == ['broken']
+    assert {r['name'] for r in comparison['results']} == {'biexp', 'mono'}
+    assert all(r['nit'] is not None and r['time'] > 0
+               for r in comparison['results'])
@@ -0,0 +1,139 @@
+"""
+Test for the local fit-job service ``fit.lib.FitService`` and its client,
+over HTTP on localhost and over a UNIX socket.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+from KinetiKit import fit
+from KinetiKit.units import ns
+
+
+def job(data, **kwargs):
+    return dict({'model': 'Biexp', 'data': data,
+                 'params': {'A1': 1, 'tau1': '1 ns', 'tau2': '1 ns'},
+                 'bounds': {'tau1': ['0.1 ns', '10 ns']},
+                 'time': {'N': 500, 'reprate': '80 MHz'},
+                 'irf': {'fwhm': '100 ps'},
+                 'load': {'skip_h': 0, 'skip_f': 0},
+                 'method': 'LS'}, **kwargs)
+
+
+def test_service(tmp_path, write_trace):
+    for i, tau in enumerate([2*ns, 2.5*ns]):
+        write_trace(str(tmp_path / ('s%i.asc' % i)), tau)
+    output = str(tmp_path / 'out')
+    
+    with fit.lib.FitService(('127.0.0.1', 0), workers=1, root=str(tmp_path),
+                            output=output) as service:
+        client = fit.lib.FitClient(service.address, timeout=60)
+        # a long DE fit that is cancelled while it runs
+        slow = client.submit(job('s0.asc', method='DE',
+                                 fit={'maxiter': 100000, 'tol': 0, 
+                                      'popsize': 50}))
+        for event in client.events(slow):
+            if event['type'] == 'progress':
+                break
+        assert event['nit'] >= 1 and event['file'].endswith('s0.asc')
+        
+        low = client.submit(job('*.asc'), priority=0)
+        high = client.submit(job('s1.asc'), priority=5)
+        assert client.info()['queued'] == 3
+        client.cancel(slow)
+        
+        status = client.wait(low)
+        assert status['status'] == 'done' and status['done'] == 2
+        taus = sorted(r['params']['tau1'] for r in status['results'])
+        assert np.allclose(taus, [2*ns, 2.5*ns], rtol=1e-2)
+        events = list(client.events(high))
+        assert events[-1]['type'] == 'finished' and events[-1]['status'] == 'done'
+        # the running DE fit stops after its current generation
+        assert client.wait(slow)['status'] == 'cancelled'
+        assert client.status(slow)['results'] == []
+        stopped = [e['file'] for e in client.events(slow)
+                   if e['type'] == 'stopped']
+        assert len(stopped) == 1 and stopped[0].endswith('s0.asc')
+        # the high-priority job overtook the queued fits of the earlier one
+        started = lambda job_id: [e['time'] for e in client.events(job_id)
+                                  if e['type'] == 'started']
+        assert max(started(high)) < min(started(low))
+        
+        with pytest.raises(ValueError):
+            client.submit(job('missing*.asc'))
+        with pytest.raises(ValueError):
+            client.status(99)
+    assert os.path.exists(os.path.join(output, 'job2_results.csv'))
+
+
+def test_files_outside_root_are_refused(tmp_path, write_trace):
+    root = tmp_path / 'root'
+    root.mkdir()
+    write_trace(str(root / 'a.asc'), 2*ns)
+    write_trace(str(tmp_path / 'secret.asc'), 2*ns)
+    os.symlink(str(tmp_path / 'secret.asc'), str(root / 'link.asc'))
+    with fit.lib.FitService(('127.0.0.1', 0), workers=1,
+                            root=str(root)) as service:
+        # through '..', an absolute pattern, a link and the dark file
+        for spec in (job('../secret.asc'), job(str(tmp_path / '*.asc')),
+                     job('*.asc'),
+                     job('a.asc', dark={'file': '../secret.asc'})):
+            with pytest.raises(ValueError):
+                service.submit(spec)
+        assert service.info()['queued'] == 0
+
+
+def test_unsafe_jobs_are_refused(tmp_path, write_trace):
+    write_trace(str(tmp_path / 'a.asc'), 2*ns)
+    output = str(tmp_path / 'out')
+    with fit.lib.FitService(('127.0.0.1', 0), workers=1, root=str(tmp_path),
+                            output=output) as service:
+        client = fit.lib.FitClient(service.address, timeout=60)
+        # options that reach the file system of the service
+        for spec in (job('a.asc', method='DE',
+                         fit={'checkpoint': str(tmp_path / 'evil.ckpt')}),
+                     job('a.asc', checkpoint=True),
+                     job('a.asc', load={'cache': True,
+                                        'cache_dir': str(tmp_path)}),
+                     job('a.asc', dark={'file': 'a.asc', 'cache': True}),
+                     # names of results files outside the output directory
+                     job('a.asc', name='../escaped'),
+                     job('a.asc', name=str(tmp_path / 'escaped')),
+                     job('a.asc', name='..')):
+            with pytest.raises(ValueError):
+                client.submit(spec)
+        assert service.info()['jobs'] == 0
+        status = client.wait(client.submit(job('a.asc', name='fine',
+                                               fit={'seed': 1})))
+        assert status['status'] == 'done'
+    assert os.listdir(output) == ['fine_results.csv']
+    assert not os.path.exists(str(tmp_path / 'escaped_results.csv'))
+
+
+@pytest.mark.skipif(not hasattr(__import__('socket'), 'AF_UNIX'),
+                    reason='UNIX sockets are not available')
+def test_unix_socket(tmp_path, write_trace):
+    write_trace(str(tmp_path / 'a.asc'), 2*ns)
+    path = str(tmp_path / 'fit.sock')
+    with fit.lib.FitService(path, workers=1, root=str(tmp_path)):
+        client = fit.lib.FitClient(path, timeout=60)
+        status = client.wait(client.submit(job('a.asc')))
+        assert np.isclose(status['results'][0]['params']['tau1'], 2*ns, 
+                          rtol=1e-2)
+    assert not os.path.exists(path)
+
+
+def test_surrogate_job(tmp_path, write_trace):
+    write_trace(str(tmp_path / 'a.asc'), 2*ns)
+    with fit.lib.FitService(('127.0.0.1', 0), workers=1,
+                            root=str(tmp_path)) as service:
+        client = fit.lib.FitClient(service.address, timeout=60)
+        job_id = client.submit(job('a.asc', method='surrogate',
+                                   fit={'max_nfev': 16, 'seed': 0}))
+        status = client.wait(job_id)
+        assert status['status'] == 'done' and status['errors'] == []
+        assert np.isclose(status['results'][0]['params']['tau1'], 2*ns,
+                          rtol=1e-2)
+        assert any(e['type'] == 'progress' for e in client.events(job_id))
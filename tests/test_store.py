@@ -0,0 +1,84 @@
+"""
+Test for storing and querying fit results with ``kit.ResultStore``.
+"""
+
+import os
+import datetime
+import threading
+
+import numpy as np
+
+from KinetiKit import kit
+from KinetiKit.units import ns
+
+
+def records(n):
+    t = np.linspace(0, 12.5, 100) * ns
+    return [{'params': {'k': 1e8 * (i + 1), 'A': 0.5},
+             'errors': {'k': 1e6},
+             'bounds': {'k': (1e7, 1e10)},
+             'model': 'Mono' if i % 2 else 'Biexp',
+             'sample': 'sample%i' % (i % 3),
+             'pulse_power': 0.1 * i,
+             'cost': 1. / (i + 1),
+             'nfev': 100 + i,
+             'created': datetime.datetime(2024, 1, 1 + i),
+             'traces': {'Time (s)': t, 'data': np.exp(-t * 1e8 * (i + 1))}}
+            for i in range(n)]
+
+
+def test_add_and_query(tmpdir):
+    path = os.path.join(str(tmpdir), 'results.sqlite')
+    with kit.ResultStore(path) as store:
+        ids = store.add_many(records(10))
+        assert len(store) == 10 and ids == list(range(1, 11))
+    
+    store = kit.ResultStore(path)
+    fit = store.get(ids[3], traces=True)
+    assert fit['model'] == 'Mono' and fit['sample'] == 'sample0'
+    assert fit['params'] == {'k': 4e8, 'A': 0.5}
+    assert fit['errors'] == {'k': 1e6} and fit['bounds'] == {'k': (1e7, 1e10)}
+    assert np.array_equal(fit['traces']['data'], records(10)[3]['traces']['data'])
+    
+    assert len(store.query(model='Mono')) == 5
+    assert [f['id'] for f in store.query(sample='sample1', model='Biexp')] == [5]
+    found = store.query(pulse_power=(0.25, 0.65), order='cost')
+    assert [f['id'] for f in found] == [7, 6, 5, 4]
+    assert len(store.query(since=datetime.date(2024, 1, 8))) == 3
+    assert [f['id'] for f in store.query(params={'k': (2.5e8, 5e8)})] == [3, 4, 5]
+    assert len(store.query(params={'k': None, 'A': 0.5}, limit=2)) == 2
+    assert store.query(params={'tau': None}) == []
+    
+    store.delete(ids[0])
+    assert store.get(ids[0]) is None and store.traces(ids[0]) is None
+    assert len(store) == 9
+    store.close()
+
+
+def test_saveparam_dict_and_threads(tmpdir):
+    store = kit.ResultStore(os.path.join(str(tmpdir), 'results.sqlite'))
+    params = {'k': 2.5e8, 'Model type': 'Mono', 'Sum of Sq. of Residuals': 0.2,
+              'No. of DE Evaluations': 300, 'No. of DE Iterations': 10,
+              'No. of LS Evaluations': 20, 'k_bounds': (1e7, 1e9),
+              'k_error': 3e6, 'comparison': 'linear', 'absolute': False,
+              'time_limits': (0, 1e-8)}
+    fit_id = kit.save_fit('sample', traces={'y': np.arange(3.)}, params=params,
+                          store=store)
+    assert not os.path.exists('sample_fit1_params.csv')
+    fit = store.get(fit_id, traces=True)
+    assert fit['model'] == 'Mono' and fit['sample'] == 'sample'
+    assert fit['cost'] == 0.2 and fit['nfev'] == 320
+    assert fit['params'] == {'k': 2.5e8}
+    assert fit['errors'] == {'k': 3e6} and fit['bounds'] == {'k': (1e7, 1e9)}
+    assert fit['metadata']['comparison'] == 'linear'
+    assert fit['metadata']['time_limits'] == [0, 1e-8]
+    assert fit['metadata']['No. of DE Iterations'] == 10
+    assert list(fit['traces']['y']) == [0, 1, 2]
+    
+    threads = [threading.Thread(target=store.add_many, args=(records(5),))
+               for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(store) == 21
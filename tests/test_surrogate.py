@@ -0,0 +1,76 @@
+"""
+Test for the surrogate-assisted global search ``fit.lib.fit_surrogate``.
+"""
+
+import numpy as np
+
+from KinetiKit import sim, fit
+from KinetiKit.units import ns, ps
+
+#--- Creating Time Object and data
+to = sim.time.linear(N=1000)
+dtime = to['array'][::to['subsample']]
+irf_args = {'fwhm': 100*ps}
+
+system = sim.systems.Biexp(A1=0.6, tau1=0.5*ns, tau2=4*ns)
+pl, converged = sim.lib.simulate_func(system, dtime)
+data = sim.lib.convolve_irf(pl, dtime, irf_args)
+bounds = {'A1': (0, 1), 'tau1': (0.1*ns, 2*ns), 'tau2': (2*ns, 10*ns)}
+
+
+def rates_cost(x):
+    # valley in the logarithm of two rates spanning four decades
+    a, b = np.log10(x[0] / 3e8), np.log10(x[1] / 2e-9)
+    return a**2 + 3*b**2 + 0.5*a*b
+
+def test_logarithmic_search_finds_minimum():
+    result = fit.lib.fit_surrogate(rates_cost, [(1e6, 1e10), (1e-11, 1e-7)],
+                                   max_nfev=40, seed=0, polish=False)
+    assert result.nfev <= 40 and len(result.costs) == result.nfev
+    assert np.allclose(result.x, [3e8, 2e-9], rtol=0.1)
+    assert result.fun == result.costs.min()
+
+def test_reaches_DE_optimum_with_fewer_simulations():
+    args = fit.lib.sac_args(bounds.keys(), sim.systems.Biexp(), data, to,
+                            None, irf_args=irf_args)
+    batches = []
+    result = fit.lib.fit_surrogate(fit.lib.simulate_and_compare, bounds,
+                                   args=args, max_nfev=60, seed=1,
+                                   callback=batches.append)
+    reference = fit.lib.fit_DE(fit.lib.simulate_and_compare, bounds,
+                               args=args, seed=1)
+    assert result.fun < 1e-8 and reference.fun < 1e-8
+    assert np.allclose(result.x, [0.6, 0.5*ns, 4*ns], rtol=1e-3)
+    assert result.nfev < reference.nfev / 10
+    assert len(batches) == result.nit
+    assert [b.nfev for b in batches] == list(range(16, 61, 4))
+
+def test_fit_file_method(tmpdir):
+    filename = str(tmpdir.join('trace.dat'))
+    np.savetxt(filename, np.column_stack((dtime / ns, data * 1000)),
+               delimiter=',')
+    result = fit.lib.fit_file(filename, sim.systems.Biexp(), bounds, to,
+                              load_args={'skip_h': 0, 'skip_f': 0},
+                              sac_kwargs={'irf_args': irf_args},
+                              method='surrogate',
+                              fit_args={'max_nfev': 60, 'seed': 2})
+    assert np.allclose([result['params'][key] for key in bounds],
+                       [0.6, 0.5*ns, 4*ns], rtol=1e-2)
+    assert result['nfev'] < 200
+
+def test_parallel_batches_match_serial():
+    args = fit.lib.sac_args(dict(bounds), sim.systems.Biexp(), data, to,
+                            None, irf_args=irf_args)
+    serial = fit.lib.fit_surrogate(fit.lib.simulate_and_compare, bounds,
+                                   args=args, max_nfev=24, seed=1,
+                                   polish=False)
+    parallel = fit.lib.fit_surrogate(fit.lib.simulate_and_compare, bounds,
+                                     args=args, max_nfev=24, seed=1,
+                                     polish=False, workers=2)
+    assert np.allclose(serial.costs, parallel.costs)
+
+def test_stop_preempts_search():
+    result = fit.lib.fit_surrogate(rates_cost, [(1e6, 1e10), (1e-11, 1e-7)],
+                                   n_init=8, seed=0, stop=lambda: True)
+    assert result.message == 'Preempted.' and not result.success
+    assert result.nfev == 8
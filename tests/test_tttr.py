@@ -0,0 +1,65 @@
+"""
+Test for streaming Becker & Hickl FIFO (.spc) photon streams into TRPL 
+histograms with ``data.lib.data_from_TTTR``, on a synthetic file.
+"""
+
+import numpy as np
+
+from KinetiKit import data
+from KinetiKit.units import ns
+
+clock = 50*ns
+resolution = 12.5*ns / 4096
+
+
+def write_spc(filename, macro_ticks, adc, rout):
+    """
+    Writes photons (absolute macro-time ticks, ADC values, routing channels)
+    in the SPC-130 FIFO format, with overflow records between them.
+    """
+    records = [int(round(clock / 0.1e-9))]
+    overflows = 0
+    for tick, a, r in zip(macro_ticks, adc, rout):
+        skipped = tick // 4096 - overflows
+        mtov = 0
+        if skipped > 1:
+            records.append((1 << 31) | (1 << 30) | (skipped - 1))
+            mtov = 1 << 30
+        elif skipped == 1:
+            mtov = 1 << 30
+        overflows = tick // 4096
+        records.append(mtov | (a << 16) | (r << 12) | (tick % 4096))
+    np.array(records, dtype='<u4').tofile(filename)
+
+
+def test_histogram(tmp_path):
+    rng = np.random.default_rng(0)
+    n = 20000
+    ticks = np.cumsum(rng.integers(1, 3000, n))
+    micro = np.minimum(rng.exponential(400, n).astype(int), 4095)
+    rout = rng.integers(0, 2, n)
+    filename = str(tmp_path / 'stream.spc')
+    write_spc(filename, ticks, 4095 - micro, rout)
+    
+    chunks = list(data.lib.read_spc_chunks(filename, chunk_size=1000))
+    assert len(chunks) > 1
+    assert np.allclose(np.concatenate([c['macro'] for c in chunks]), 
+                       ticks * clock)
+    assert np.array_equal(np.concatenate([c['micro'] for c in chunks]), micro)
+    
+    do = data.lib.data_from_TTTR(filename, resolution, shift=2, 
+                                 chunk_size=1000, weigh_by_coll=False)
+    assert np.array_equal(do.y, np.bincount(micro >> 2, minlength=1024))
+    assert np.isclose(do.x[1], 4 * resolution)
+    assert np.isclose(do.coll, (ticks[-1] - ticks[0]) * clock)
+    
+    # gating by macro time and routing channel
+    start, stop = ticks[n//4] * clock, ticks[n//2] * clock
+    do = data.lib.data_from_TTTR(filename, resolution, chunk_size=1000,
+                                 macro_range=(start, stop), channels=[1])
+    keep = (ticks * clock >= start) & (ticks * clock < stop) & (rout == 1)
+    assert np.allclose(do.y * do.coll, np.bincount(micro[keep], 
+                                                   minlength=4096))
+    assert np.isclose(do.coll, stop - start)
+    do.rebin(factor=16)
+    assert len(do.y) == 256 and np.isclose(do.x[1] - do.x[0], 16*resolution)